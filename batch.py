@@ -0,0 +1,264 @@
+"""
+    Batch mode of the labs: one operation over many files on one process pool, started once for the whole run.
+    A failed file is reported and skipped, the run goes on. At the end: throughput and latency percentiles.
+
+    python batch.py --operation compress --compressor huffman --input 'res/*.p?m' --output_dir out
+    python batch.py --operation convolve --kernel res/sharp.kernel --output_dir out res/rose.ppm res/pythons.ppm
+    python batch.py --operation compand --law mulaw --manifest clips.txt --processes 8
+    python batch.py --operation haar --times 3 --cache .cache --input 'res/*.ppm' --output_dir out  # shared cache
+"""
+
+import copy
+import glob
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from lab2 import convolve
+from lab4 import short_time
+from utils import cache, prediction
+from utils.audio_processor import AudioProcessorWAVE
+from utils.compression import LZ77Compressor
+from utils.image_processor import ImageProcessor
+from utils.wavelet import LiftingWavelet
+from utils.windows import WINDOW_TYPES
+
+
+OPERATIONS = ('compress', 'decompress', 'convolve', 'haar', 'dft', 'compand')
+
+_worker = {}  # options and processors of the worker process, set once by init_worker
+
+
+def init_worker(options):
+    _worker['options'] = options
+    _worker['cache'] = cache.from_options(options)  # the workers share the directory
+    _worker['image'] = ImageProcessor(_worker['cache'])
+    _worker['audio'] = AudioProcessorWAVE(_worker['cache'])
+    if options.kernel:
+        with open(options.kernel, 'r') as f:
+            _worker['kernel'] = [[float(value) for value in line.split()] for line in f.readlines()]
+
+
+def output_name(options, filename):
+    name, extension = os.path.splitext(os.path.basename(filename))
+    operation = options.operation
+    if operation == 'compress':
+        name = name + extension + '.' + options.compressor
+    elif operation == 'decompress':
+        pass  # rose.ppm.huffman -> rose.ppm
+    elif operation == 'dft':
+        name = name + ('_tmp.wav' if options.itransform else '_stft.npy')
+    elif operation == 'compand':
+        name = name + '_' + options.law + extension
+    else:
+        name = name + '_' + operation + extension
+    return os.path.join(options.output_dir, name)
+
+
+def compress(proc, options, filename, filename_output):
+    image = proc.read(filename)
+    stripe_rows = options.stripe_rows or None  # the stripes are coded in this worker, the pool runs the files
+    if options.compressor == 'rle':
+        result = proc.compress_rle(image, options.packbits, options.predictor, stripe_rows)
+    elif options.compressor == 'lz77':
+        result = proc.compress_lz77(image, options.window_size, options.match_finder, options.chain_depth,
+                                    options.predictor, stripe_rows)
+    elif options.compressor == 'huffman':
+        result = proc.compress_huffman(image, options.predictor, stripe_rows)
+    elif options.compressor == 'arith':
+        result = proc.compress_arith(image, options.order, options.predictor, stripe_rows)
+    else:
+        result = proc.compress_wavelet(image, options.wavelet or 'cdf97', options.times or 5, options.step)
+    proc.write_container(filename_output, result)
+
+
+def decompress(proc, options, filename, filename_output):
+    image = proc.read(filename, compressed=True)
+    if image.compressor == 'rle':
+        result = proc.decompress_rle(image)
+    elif image.compressor == 'lz77':
+        result = proc.decompress_lz77(image, options.window_size)
+    elif image.compressor == 'huffman':
+        result = proc.decompress_huffman(image)
+    elif image.compressor == 'arith':
+        result = proc.decompress_arith(image)
+    elif image.compressor == 'wavelet':
+        result = proc.decompress_wavelet(image)
+    else:
+        raise ValueError('unknown compressor of {}: {}'.format(filename, image.compressor))
+    proc.write(filename_output, result)
+
+
+def run_file(task):
+    '''
+    Args: (input, output) file names
+    Return: (input, bytes read, bytes written, seconds, error message or None, (cache hits, cache misses))
+    '''
+    filename, filename_output = task
+    options = _worker['options']
+    results_cache = _worker['cache']
+    counters = (results_cache.hits, results_cache.misses) if results_cache else (0, 0)
+    start = time.perf_counter()
+    try:
+        operation = options.operation
+        if operation == 'compress':
+            compress(_worker['image'], options, filename, filename_output)
+        elif operation == 'decompress':
+            decompress(_worker['image'], options, filename, filename_output)
+        elif operation == 'convolve':
+            proc = _worker['image']
+            proc.write(filename_output, convolve(proc, proc.read(filename), _worker['kernel']))
+        elif operation == 'haar':
+            proc = _worker['image']
+            code = proc.haar_decode if options.decode else proc.haar_encode
+            proc.write(filename_output, code(proc.read(filename), options.times or 1, options.wavelet or 'haar',
+                                             options.reversible))
+        elif operation == 'dft':
+            file_options = copy.copy(options)
+            file_options.input, file_options.output = filename, filename_output
+            short_time(_worker['audio'], file_options, filename)
+        else:
+            _worker['audio'].compand_stream(filename, filename_output, options.law, encode=not options.decode,
+                                            g711=options.g711)
+    except Exception as error:
+        return filename, 0, 0, time.perf_counter() - start, '{}: {}'.format(type(error).__name__, error), (0, 0)
+
+    elapsed = time.perf_counter() - start
+    if results_cache:
+        counters = (results_cache.hits - counters[0], results_cache.misses - counters[1])
+    return filename, os.path.getsize(filename), os.path.getsize(filename_output), elapsed, None, counters
+
+
+def read_tasks(options, args):
+    ''' (input, output) pairs: the files of the glob and the arguments, then the lines "input [output]" of the manifest '''
+    filenames = sorted(glob.glob(options.input)) if options.input else []
+    tasks = [(filename, output_name(options, filename)) for filename in filenames + args]
+    if options.manifest:
+        with open(options.manifest, 'r') as f:
+            for line in f:
+                fields = line.split('#')[0].split()
+                if fields:
+                    tasks.append((fields[0], fields[1] if len(fields) > 1 else output_name(options, fields[0])))
+    return tasks
+
+
+def run(options, tasks):
+    if options.processes == 1:
+        init_worker(options)
+        yield from map(run_file, tasks)
+        return
+
+    with multiprocessing.Pool(options.processes or None, init_worker, (options, )) as pool:
+        yield from pool.imap_unordered(run_file, tasks)
+
+
+def report(results, elapsed):
+    done = [result for result in results if result[4] is None]
+    latencies = np.array([result[3] for result in done]) * 1000
+    bytes_in = sum(result[1] for result in done)
+    bytes_out = sum(result[2] for result in done)
+
+    print('Файлов обработано: {}, с ошибками: {}'.format(len(done), len(results) - len(done)))
+    print('Время: {:.2f} с, {:.2f} файлов/с, {:.2f} МБ/с (прочитано {:.1f} МБ, записано {:.1f} МБ)'.format(
+        elapsed, len(done) / elapsed, bytes_in / elapsed / 1e6, bytes_in / 1e6, bytes_out / 1e6))
+    if len(done):
+        p50, p90, p99 = np.percentile(latencies, (50, 90, 99))
+        print('Задержка на файл, мс: p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+            p50, p90, p99, latencies.max()))
+    hits, misses = (sum(result[5][i] for result in results) for i in range(2))
+    if hits or misses:
+        print('Кэш: попаданий {}, промахов {}'.format(hits, misses))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--operation', dest='operation', action='store', default='compress', type='choice',
+                      choices=list(OPERATIONS),
+                      help='операция: {}'.format(', '.join(OPERATIONS)))
+    parser.add_option('--input', dest='input', action='store', default='', type='str',
+                      help='шаблон входных файлов, например \'res/*.ppm\' (в кавычках)')
+    parser.add_option('--manifest', dest='manifest', action='store', default='', type='str',
+                      help='текстовый файл со списком: в каждой строке входной и, необязательно, выходной файл')
+    parser.add_option('--output_dir', dest='output_dir', action='store', default='.', type='str',
+                      help='папка для результатов')
+    parser.add_option('--processes', dest='processes', action='store', default=0, type='int',
+                      help='число процессов (0 - все ядра, 1 - без пула)')
+    cache.add_options(parser)
+    parser.add_option('--verbose', dest='verbose', action='store_true', default=False,
+                      help='печатать каждый обработанный файл')
+    # options of the operations, the same as in the labs
+    parser.add_option('--compressor', dest='compressor', action='store', default='huffman', type='choice',
+                      choices=['rle', 'lz77', 'huffman', 'arith', 'wavelet'],
+                      help='алгоритм сжатия: rle | lz77 | huffman | arith | wavelet')
+    parser.add_option('--window', dest='window_size', action='store', default=64, type='int',
+                      help='размер окна для сжатия LZ77')
+    parser.add_option('--match_finder', dest='match_finder', action='store', default='hash', type='choice',
+                      choices=list(LZ77Compressor.MATCH_FINDERS),
+                      help='поиск совпадений для LZ77: hash | suffix | legacy')
+    parser.add_option('--chain_depth', dest='chain_depth', action='store', default=16, type='int',
+                      help='сколько кандидатов проверять при поиске совпадения LZ77')
+    parser.add_option('--packbits', dest='packbits', action='store_true', default=False,
+                      help='RLE в режиме PackBits')
+    parser.add_option('--order', dest='order', action='store', default=0, type='int',
+                      help='порядок модели для --compressor arith: 0 или 1')
+    parser.add_option('--predictor', dest='predictor', action='store', default=None, type='choice',
+                      choices=list(prediction.PREDICTORS) + [prediction.ADAPTIVE],
+                      help='сжимать остатки предсказания пикселей (rle, lz77, huffman, arith)')
+    parser.add_option('--stripe_rows', dest='stripe_rows', action='store', default=0, type='int',
+                      help='сжимать каналы независимыми полосами по столько строк (0 - целиком)')
+    parser.add_option('--step', dest='step', action='store', default=8., type='float',
+                      help='шаг квантования для --compressor wavelet')
+    parser.add_option('--kernel', dest='kernel', action='store', default='', type='str',
+                      help='путь к текстовому файлу с ядром для convolve')
+    parser.add_option('--times', dest='times', action='store', default=None, type='int',
+                      help='число уровней вейвлет-разложения (1 для haar, 5 для --compressor wavelet)')
+    parser.add_option('--wavelet', dest='wavelet', action='store', default=None, type='choice',
+                      choices=list(LiftingWavelet.KINDS),
+                      help='вейвлет: haar, cdf53 или cdf97 (haar для haar, cdf97 для --compressor wavelet)')
+    parser.add_option('--reversible', dest='reversible', action='store_true', default=False,
+                      help='целочисленное обратимое вейвлет-преобразование')
+    parser.add_option('--decode', dest='decode', action='store_true', default=False,
+                      help='обратное преобразование для haar и compand')
+    parser.add_option('--frame_size', dest='frame_size', action='store', default=1024, type='int',
+                      help='размер кадра для dft')
+    parser.add_option('--hop', dest='hop', action='store', default=256, type='int',
+                      help='шаг между кадрами для dft')
+    parser.add_option('--window_type', dest='window_type', action='store', default='hann', type='choice',
+                      choices=list(WINDOW_TYPES),
+                      help='оконная функция для dft')
+    parser.add_option('--itransform', dest='itransform', action='store_true', default=False,
+                      help='dft: восстановить *.wav вместо спектрограммы')
+    parser.add_option('--law', dest='law', action='store', default='mulaw', type='choice',
+                      choices=['mulaw', 'alaw'],
+                      help='закон компандирования: mulaw | alaw')
+    parser.add_option('--g711', dest='g711', action='store_true', default=False,
+                      help='8-битное кодирование G.711')
+
+    options, args = parser.parse_args()
+    if not options.input and not options.manifest and not args:
+        parser.error('нужен --input, --manifest или список файлов')
+    if options.operation == 'convolve' and not options.kernel:
+        parser.error('для convolve нужен --kernel')
+    if options.operation == 'dft' and not 0 < options.hop < options.frame_size:
+        parser.error('шаг --hop должен быть меньше размера кадра --frame_size')
+
+    tasks = read_tasks(options, args)
+    os.makedirs(options.output_dir, exist_ok=True)
+
+    results = []
+    start = time.perf_counter()
+    for result in run(options, tasks):
+        results.append(result)
+        filename, _, _, elapsed, error, _ = result
+        if error:
+            print('Ошибка {}: {}'.format(filename, error))
+        elif options.verbose:
+            print('{} ({:.1f} мс)'.format(filename, elapsed * 1000))
+    report(results, time.perf_counter() - start)
+
+    if any(result[4] for result in results):
+        sys.exit(1)
@@ -0,0 +1,69 @@
+"""
+    Every convolution strategy against the original per-pixel loop on random images:
+    the number of differing pixels must be 0. Besides the kernels from files, an 8x8 kernel
+    that factorizes (outer product of two vectors) checks the separable path above 7x7.
+
+    python -m benchmarks.convolution --trials 5 --size 30x36
+"""
+
+import optparse
+
+import numpy as np
+
+from utils.convolution import Convolution
+
+SEPARABLE_KERNEL = np.outer([1, 4, 6, 4, 1, 2, 3, 1], [1, 2, 3, 2, 1, 5, 1, 1]).tolist()
+
+
+def read_kernel(filename):
+    with open(filename, 'r') as f:
+        return [[float(value) for value in line.split()] for line in f.readlines()]
+
+
+def per_pixel(convolution, image):
+    """ the original Convolution.__call__, one pixel at a time """
+
+    def get_pixel(image, i, j):
+        res = 0
+        for m in range(len(convolution.kernel)):
+            for n in range(len(convolution.kernel[0])):
+                res += convolution.kernel[m][n] * image[i - m][j - n]
+        return int(res)
+
+    res = np.array([[get_pixel(image, i, j) for j in range(image.shape[1])] for i in range(image.shape[0])])
+    if np.min(convolution.kernel) < 0:
+        res = ((res - res.min()) * (1 / (res.max() - res.min()) * 255)).astype('uint8')
+    return res
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--kernels', dest='kernels', action='store',
+                      default='res/gaussian_blur.kernel,res/sharp.kernel,res/edge.kernel', type='str',
+                      help='список файлов с ядрами через запятую')
+    parser.add_option('--size', dest='size', action='store', default='30x36', type='str',
+                      help='размер случайного изображения, высота x ширина')
+    parser.add_option('--trials', dest='trials', action='store', default=5, type='int',
+                      help='число случайных изображений')
+
+    options, args = parser.parse_args()
+
+    height, width = map(int, options.size.split('x'))
+    jobs = [(filename, read_kernel(filename)) for filename in options.kernels.split(',')]
+    jobs.append(('8x8 separable', SEPARABLE_KERNEL))
+
+    print('{:<28} {:>9} {:>10} {:>9}'.format('kernel', 'strategy', 'chosen', 'differ'))
+    failed = False
+    for name, kernel in jobs:
+        for strategy in Convolution.STRATEGIES:
+            convolution = Convolution(kernel, strategy)
+            differ = 0
+            for seed in range(options.trials):
+                image = np.random.RandomState(seed).randint(0, 256, (height, width)).astype(np.uint8)
+                differ += np.count_nonzero(convolution(image) != per_pixel(convolution, image))
+            failed = failed or differ > 0
+            chosen = convolution.choose_strategy(np.zeros((height, width)))
+            print('{:<28} {:>9} {:>10} {:>9}'.format(name, strategy, chosen, differ))
+
+    if failed:
+        raise AssertionError('strategies differ from the per-pixel loop')
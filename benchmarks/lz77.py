@@ -0,0 +1,73 @@
+"""
+    Compares LZ77 match finders: compression ratio and speed on every channel of the images.
+
+    python -m benchmarks.lz77 --window 32768 --limit 0 --finders hash,suffix
+"""
+
+import optparse
+import time
+
+from utils import container
+from utils.compression import LZ77Compressor
+from utils.image_processor import ImageProcessor
+
+
+DEFAULT_IMAGES = 'res/pythons.ppm,res/rose.ppm'
+
+
+def channels(image, limit):
+    mtrx = image.to_matrix()
+    if image.color_mode == 2:
+        mtrx = mtrx.reshape(image.height, image.width, 1)
+
+    for c in range(mtrx.shape[2]):
+        channel = mtrx[:, :, c].flatten()
+        if limit:
+            channel = channel[:limit]
+        yield ''.join(map(chr, channel))
+
+
+def benchmark(filename, finder, window_size, chain_depth, limit, check):
+    image = ImageProcessor().read(filename)
+    compressor = LZ77Compressor(window_size, finder, chain_depth)
+
+    size_in, size_out, elapsed = 0, 0, 0.
+    for channel in channels(image, limit):
+        start = time.perf_counter()
+        tokens = compressor.compress(channel)
+        elapsed += time.perf_counter() - start
+
+        size_in += len(channel)
+        pairs = [tuple(map(int, token.split('.')))[-2:] for token in tokens]
+        size_out += len(container.write_lz77_section(pairs))  # the way write_container stores them
+
+        if check and ''.join(map(chr, map(int, compressor.decompress(tokens)))) != channel:
+            raise AssertionError('{}: {} finder does not round trip'.format(filename, finder))
+
+    return size_in, size_out, elapsed
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--images', dest='images', action='store', default=DEFAULT_IMAGES, type='str',
+                      help='список изображений через запятую')
+    parser.add_option('--finders', dest='finders', action='store', default='legacy,hash,suffix', type='str',
+                      help='список алгоритмов поиска совпадений через запятую')
+    parser.add_option('--window', dest='window_size', action='store', default=64, type='int',
+                      help='размер окна для сжатия LZ77')
+    parser.add_option('--chain_depth', dest='chain_depth', action='store', default=16, type='int',
+                      help='сколько кандидатов проверять при поиске совпадения')
+    parser.add_option('--limit', dest='limit', action='store', default=20000, type='int',
+                      help='сколько байт каждого канала сжимать (0 - весь канал, legacy квадратичен)')
+    parser.add_option('--check', dest='check', action='store_true', default=False,
+                      help='проверить декомпрессию')
+
+    options, args = parser.parse_args()
+
+    print('{:<20} {:<8} {:>10} {:>10} {:>8} {:>8}'.format('image', 'finder', 'in, B', 'out, B', 'ratio', 'MB/s'))
+    for filename in options.images.split(','):
+        for finder in options.finders.split(','):
+            size_in, size_out, elapsed = benchmark(filename, finder, options.window_size, options.chain_depth,
+                                                   options.limit, options.check)
+            print('{:<20} {:<8} {:>10} {:>10} {:>8.3f} {:>8.3f}'.format(
+                filename, finder, size_in, size_out, size_in / size_out, size_in / elapsed / 1e6))
@@ -0,0 +1,334 @@
+"""
+    Benchmark suite of every public operation of ImageProcessor and AudioProcessorWAVE
+    on synthetic images and WAVs of growing size and on the files in res/.
+    For every operation: the time (best and median of --repeat runs), MB/s of the input,
+    the peak RSS of the process running it and the compression ratio (output / input bytes) where there is an output.
+    Synthetic inputs come from fixed seeds, so the runs are comparable between commits.
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --output current.json --compare baseline.json --tolerance .2
+"""
+
+import json
+import multiprocessing
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from utils.audio_processor import AudioProcessorWAVE, WAVAudio
+from utils.image_processor import ImageProcessor, RAWImage
+from utils.wavelet import LiftingWavelet
+
+try:
+    import resource
+except ImportError:  # Windows, no peak RSS
+    resource = None
+
+
+KERNELS = ('res/gaussian_blur.kernel', 'res/sharp.kernel', 'res/edge.kernel')
+RES_IMAGES = ('res/figure.pgm', 'res/rose.pgm', 'res/rose.ppm', 'res/pythons.ppm')
+RES_AUDIO = ('res/ahem_x.wav', )
+LZ77_WINDOW = 4096
+
+
+def synthetic_image(size, color_mode, seed=0):
+    ''' a square photo-like image: smooth gradients, flat rectangles and noise '''
+    rng = np.random.default_rng(seed)
+    channels = 3 if color_mode == 3 else 1
+    y, x = np.mgrid[:size, :size] / size
+    pixels = np.empty((size, size, channels))
+    for c in range(channels):
+        phase = rng.uniform(0, 2 * np.pi, 2)
+        pixels[:, :, c] = 128 + 80 * np.sin(3 * x + phase[0]) * np.cos(2 * y + phase[1])
+    for _ in range(8):
+        top, left = rng.integers(0, size, 2)
+        pixels[top:top + size // 6, left:left + size // 5] = rng.uniform(0, 255, channels)
+    pixels += rng.normal(0, 4, pixels.shape)
+    pixels = np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+    return RAWImage(color_mode, size, size, pixels.ravel(), binary=True)
+
+
+def synthetic_audio(seconds, sample_rate=44100, channels=2, seed=0):
+    ''' 16-bit PCM: a few tones with a slow vibrato plus noise '''
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    data = np.empty((len(t), channels))
+    for c in range(channels):
+        tones = rng.uniform(100, 4000, 4)
+        data[:, c] = sum(np.sin(2 * np.pi * f * t + 3 * np.sin(2 * np.pi * .5 * t)) for f in tones) / 4
+    data = .3 * data + rng.normal(0, .01, data.shape)
+    data = np.rint(data * 32767).astype(np.int16).ravel()
+
+    meta_info = {'audio_format': 1, 'num_channels': channels, 'sample_rate': sample_rate, 'bits_per_sample': 16}
+    return WAVAudio(AudioProcessorWAVE.consistent_header(meta_info, data.nbytes), data)
+
+
+def image_bytes(image):
+    ''' the size of the pixels as stored in a binary file, whatever the type of the array '''
+    return image.width * image.height * (3 if image.color_mode == 3 else 1) * (1 if image.maxval < 256 else 2)
+
+
+def file_size(filename):
+    return lambda result: os.path.getsize(filename)
+
+
+def image_cases(proc, image, workdir):
+    '''
+    (operation, run, size) for every operation on the image:
+    run() does the work, size(result) is the number of output bytes or None
+    '''
+    filename = os.path.join(workdir, 'input.' + ('ppm' if image.color_mode == 3 else 'pgm'))
+    proc.write(filename, image, binary=True)
+    output = os.path.join(workdir, 'output')
+
+    yield 'read', lambda: proc.read(filename), None
+    yield 'write', lambda: proc.write(output, image, binary=True), file_size(output)
+
+    def container_size(result):
+        proc.write_container(output, result)
+        return os.path.getsize(output)
+
+    codecs = [
+        ('rle', proc.compress_rle, proc.decompress_rle),
+        ('lz77', lambda image: proc.compress_lz77(image, LZ77_WINDOW),
+         lambda image: proc.decompress_lz77(image, LZ77_WINDOW)),
+        ('huffman', proc.compress_huffman, proc.decompress_huffman),
+        ('huffman_adaptive', lambda image: proc.compress_huffman(image, 'adaptive'), proc.decompress_huffman),
+        ('arith', lambda image: proc.compress_arith(image, 1), proc.decompress_arith),
+        ('wavelet', proc.compress_wavelet, proc.decompress_wavelet),
+    ]
+    for name, compress, decompress in codecs:
+        yield 'compress_' + name, lambda compress=compress: compress(image), container_size
+        compressed = compress(image)
+        proc.write_container(output, compressed)
+        compressed = proc.read_container(output)  # the way it is decoded from a file
+        yield 'decompress_' + name, lambda decompress=decompress, compressed=compressed: decompress(compressed), None
+
+    for kernel_name in KERNELS:
+        with open(kernel_name, 'r') as f:
+            kernel = [[float(value) for value in line.split()] for line in f.readlines()]
+        operation = 'convolve_' + os.path.splitext(os.path.basename(kernel_name))[0]
+        yield operation, lambda kernel=kernel: proc.convolve(image, kernel), None
+
+    for wavelet in LiftingWavelet.KINDS:
+        yield 'haar_encode_' + wavelet, lambda wavelet=wavelet: proc.haar_encode(image, 3, wavelet), None
+        coefficients = proc.haar_encode(image, 3, wavelet)
+        yield 'haar_decode_' + wavelet, lambda wavelet=wavelet, coefficients=coefficients: \
+            proc.haar_decode(coefficients, 3, wavelet), None
+        yield 'haar_preview_' + wavelet, lambda wavelet=wavelet, coefficients=coefficients: \
+            proc.haar_decode(coefficients, 3, wavelet, level=2), None
+
+    side = image.width // 8
+    yield 'crop_image', lambda: proc.crop_image(image, side, side, side, side), None
+    yield 'pad_image', lambda: proc.pad_image(RAWImage.from_planes(image.planes, image.maxval),
+                                              side, side, side, side), None
+
+
+def audio_cases(proc, audio, workdir):
+    filename = os.path.join(workdir, 'input.wav')
+    proc.write(audio, filename)
+    output = os.path.join(workdir, 'output.wav')
+    length = len(audio.data) // audio.meta_info['num_channels']
+
+    yield 'read', lambda: proc.read(filename), None
+    yield 'write', lambda: proc.write(audio, output), file_size(output)
+    yield 'read_frames', lambda: proc.open(filename).read_frames(length // 2, 4096).sum(), None
+
+    yield 'calc_dft', lambda: proc.calc_dft(audio, real=True), None
+    spectrum = WAVAudio(audio.meta_info, proc.calc_dft(audio, real=True))
+    yield 'calc_idft', lambda: proc.calc_idft(spectrum, real=True, length=len(audio.data)), None
+
+    yield 'stft', lambda: sum(1 for _ in proc.stft(filename)), None
+    spectra = list(proc.stft(filename))
+    yield 'istft', lambda: sum(1 for _ in proc.istft(iter(spectra), length=length)), None
+    yield 'apply_hanna_window', lambda: proc.apply_hanna_window(audio), None
+
+    yield 'mu_law', lambda: proc.mu_law(audio), None
+    yield 'alpha_law', lambda: proc.alpha_law(audio), None
+    for law in ('alaw', 'mulaw'):
+        yield 'g711_encode_' + law, lambda law=law: proc.g711(audio, law), lambda result: result.data.nbytes
+        encoded = proc.g711(audio, law)
+        yield 'g711_decode_' + law, lambda law=law, encoded=encoded: proc.g711(encoded, law, encode=False), None
+        yield 'compand_stream_' + law, lambda law=law: proc.compand_stream(filename, output, law, g711=True), \
+            file_size(output)
+
+
+def peak_rss():
+    ''' the peak resident set size of this process, MB '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == 'darwin' else rss / 1e3  # bytes on macOS, KB elsewhere
+
+
+def time_case(run, size, repeat):
+    start_rss = peak_rss()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+    end_rss = peak_rss()
+    growth = None if start_rss is None else end_rss - start_rss
+    return times, size(result) if size else None, end_rss, growth
+
+
+def isolated(run, size, repeat):
+    '''
+    Runs the case in a forked child, so the peak RSS belongs to this operation only.
+    The child starts with the RSS of the parent at the fork, the growth over it is reported as well.
+    '''
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return time_case(run, size, repeat)
+
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+
+    def child():
+        try:
+            sender.send(time_case(run, size, repeat))
+        except Exception as error:
+            sender.send(error)
+
+    process = context.Process(target=child)
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'commit': commit,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def inputs(options, proc):
+    ''' (kind, name, object, bytes in) of every input of the run '''
+    for size in map(int, filter(None, options.sizes.split(','))):
+        for color_mode, extension in ((2, 'pgm'), (3, 'ppm')):
+            image = synthetic_image(size, color_mode)
+            yield 'image', 'synthetic_{}.{}'.format(size, extension), image, image_bytes(image)
+    for seconds in map(float, filter(None, options.durations.split(','))):
+        audio = synthetic_audio(seconds)
+        yield 'audio', 'synthetic_{:g}s.wav'.format(seconds), audio, audio.data.nbytes
+    if options.res:
+        for filename in RES_IMAGES:
+            image = proc.read(filename)
+            yield 'image', filename, image, image_bytes(image)
+        for filename in RES_AUDIO:
+            audio = AudioProcessorWAVE().read(filename)
+            yield 'audio', filename, audio, audio.data.nbytes
+
+
+def run_suite(options):
+    image_processor, audio_processor = ImageProcessor(), AudioProcessorWAVE()
+    only = [name for name in options.only.split(',') if name]
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for kind, name, data, bytes_in in inputs(options, image_processor):
+            cases = (image_cases(image_processor, data, workdir) if kind == 'image'
+                     else audio_cases(audio_processor, data, workdir))
+            for operation, run, size in cases:
+                if only and not any(pattern in operation for pattern in only):
+                    continue
+                times, bytes_out, rss, growth = isolated(run, size, options.repeat)
+                best = min(times)
+                results.append({
+                    'operation': operation, 'input': name, 'bytes_in': bytes_in, 'bytes_out': bytes_out,
+                    'ratio': bytes_out / bytes_in if bytes_out is not None else None,
+                    'seconds': best, 'median_seconds': float(np.median(times)),
+                    'mb_per_s': bytes_in / best / 1e6 if best else None,
+                    'peak_rss_mb': rss, 'rss_growth_mb': growth,
+                })
+                print_result(results[-1])
+    return results
+
+
+def print_result(result):
+    print('{:<26} {:<22} {:>10.4f} {:>9.2f} {:>9} {:>9} {:>7}'.format(
+        result['operation'], result['input'], result['seconds'], result['mb_per_s'] or 0,
+        '{:.1f}'.format(result['peak_rss_mb']) if result['peak_rss_mb'] is not None else '-',
+        '{:.1f}'.format(result['rss_growth_mb']) if result['rss_growth_mb'] is not None else '-',
+        '{:.3f}'.format(result['ratio']) if result['ratio'] is not None else '-'))
+
+
+def compare(results, baseline, tolerance, min_seconds=1e-3, min_megabytes=1.):
+    '''
+    Regressions against the baseline results: slower than (1 + tolerance) times and by more than min_seconds,
+    RSS growth larger by the same factor and by more than min_megabytes, any worse compression ratio
+    '''
+    previous = {(result['operation'], result['input']): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result['operation'], result['input']))
+        if base is None:
+            continue
+        checks = [
+            ('time, s', result['seconds'], base['seconds'],
+             result['seconds'] > base['seconds'] * (1 + tolerance) + min_seconds),
+            ('RSS growth, MB', result['rss_growth_mb'], base['rss_growth_mb'],
+             None not in (result['rss_growth_mb'], base['rss_growth_mb'])
+             and result['rss_growth_mb'] > base['rss_growth_mb'] * (1 + tolerance) + min_megabytes),
+            ('ratio', result['ratio'], base['ratio'],
+             None not in (result['ratio'], base['ratio']) and result['ratio'] > base['ratio'] * (1 + 1e-9)),
+        ]
+        for metric, value, base_value, regressed in checks:
+            if regressed:
+                regressions.append((result['operation'], result['input'], metric, base_value, value))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--sizes', dest='sizes', action='store', default='64,256,512', type='str',
+                      help='стороны синтетических изображений через запятую')
+    parser.add_option('--durations', dest='durations', action='store', default='1,10', type='str',
+                      help='длительности синтетических WAV через запятую, с')
+    parser.add_option('--no_res', dest='res', action='store_false', default=True,
+                      help='не использовать файлы из res/')
+    parser.add_option('--only', dest='only', action='store', default='', type='str',
+                      help='только операции, содержащие одну из подстрок через запятую')
+    parser.add_option('--repeat', dest='repeat', action='store', default=3, type='int',
+                      help='число повторов каждой операции, берется лучшее время')
+    parser.add_option('--output', dest='output', action='store', default='benchmark.json', type='str',
+                      help='JSON-файл для результатов')
+    parser.add_option('--compare', dest='compare', action='store', default='', type='str',
+                      help='JSON-файл с результатами, с которыми сравнить')
+    parser.add_option('--tolerance', dest='tolerance', action='store', default=.2, type='float',
+                      help='допустимое относительное ухудшение времени и памяти')
+
+    options, args = parser.parse_args()
+
+    print('{:<26} {:<22} {:>10} {:>9} {:>9} {:>9} {:>7}'.format(
+        'operation', 'input', 'time, s', 'MB/s', 'RSS, MB', '+RSS, MB', 'ratio'))
+    results = run_suite(options)
+    with open(options.output, 'w') as f:
+        json.dump({'environment': environment(), 'options': vars(options), 'results': results}, f, indent=1)
+    print('Результаты записаны в {}.'.format(options.output))
+
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], options.tolerance)
+        if not regressions:
+            print('Ухудшений относительно {} нет.'.format(options.compare))
+        else:
+            print('Ухудшения относительно {}:'.format(options.compare))
+            for operation, name, metric, base_value, value in regressions:
+                print('{:<26} {:<22} {:<15} {:>10.4f} -> {:.4f}'.format(operation, name, metric, base_value, value))
+            sys.exit(1)
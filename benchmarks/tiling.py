@@ -0,0 +1,74 @@
+"""
+    Tiled convolution and wavelet decomposition on a process pool: MB/s for every number of processes.
+    The image is repeated --scale times along both axes to get a large one.
+
+    python -m benchmarks.tiling --image res/pythons.ppm --scale 8 --processes 1,2,4,8
+"""
+
+import optparse
+import time
+
+import numpy as np
+
+from utils.convolution import Convolution
+from utils.image_processor import ImageProcessor
+from utils.tiling import TileScheduler
+from utils.wavelet import LiftingWavelet
+
+
+def read_kernel(filename):
+    with open(filename, 'r') as f:
+        return [[float(value) for value in line.split()] for line in f.readlines()]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--image', dest='image', action='store', default='res/pythons.ppm', type='str',
+                      help='путь к *.ppm или *.pgm файлу')
+    parser.add_option('--scale', dest='scale', action='store', default=8, type='int',
+                      help='во сколько раз увеличить изображение по каждой оси')
+    parser.add_option('--kernels', dest='kernels', action='store',
+                      default='res/gaussian_blur.kernel,res/sharp.kernel,res/edge.kernel', type='str',
+                      help='список файлов с ядрами через запятую')
+    parser.add_option('--processes', dest='processes', action='store', default='1,2,4', type='str',
+                      help='список чисел процессов через запятую')
+    parser.add_option('--tile_size', dest='tile_size', action='store', default=256, type='int',
+                      help='размер плитки')
+    parser.add_option('--check', dest='check', action='store_true', default=False,
+                      help='сравнить с обработкой целиком в одном процессе')
+
+    options, args = parser.parse_args()
+
+    image = ImageProcessor().read(options.image).to_matrix()
+    image = np.tile(image, (options.scale, options.scale) + (1, ) * (image.ndim - 2))
+    megabytes = image.nbytes / 1e6
+    wavelet = LiftingWavelet('cdf97')
+    jobs = [(filename, Convolution(read_kernel(filename))) for filename in options.kernels.split(',')]
+
+    print('image {}, {:.1f} MB'.format(image.shape, megabytes))
+    print('{:<28} {:>9} {:>8} {:>8}'.format('job', 'processes', 'MB/s', 'speedup'))
+    for name, convolution in jobs + [('cdf97, 5 levels', None)]:
+        serial = None
+        for processes in map(int, options.processes.split(',')):
+            with TileScheduler(processes, options.tile_size) as scheduler:
+                if convolution is None:
+                    scheduler.decompose(image[::16, ::16], wavelet, 1)  # starts the pool
+                    result, elapsed = timed(scheduler.decompose, image, wavelet, 5)
+                    expected = wavelet.decompose(image, 5) if options.check else result
+                    same = np.allclose(result, expected)
+                else:
+                    scheduler.convolve(image[::16, ::16], convolution)
+                    result, elapsed = timed(scheduler.convolve, image, convolution)
+                    expected = convolution(image) if options.check else result
+                    same = np.array_equal(result, expected)
+
+            serial = serial or elapsed
+            if not same:
+                raise AssertionError('{}: tiled result differs with {} processes'.format(name, processes))
+            print('{:<28} {:>9} {:>8.2f} {:>8.2f}'.format(name, processes, megabytes / elapsed, serial / elapsed))
@@ -0,0 +1,72 @@
+"""
+    Lossy wavelet codec: bits per pixel, PSNR and encode / decode speed on the images
+    for a list of quantization steps (or PSNR / bpp targets).
+
+    python -m benchmarks.wavelet_codec --wavelets cdf97,cdf53 --steps 4,8,16,32
+    python -m benchmarks.wavelet_codec --psnr 30,35,40
+"""
+
+import glob
+import optparse
+import time
+
+from utils.image_processor import ImageProcessor
+from utils.wavelet_codec import WaveletCompressor
+
+
+def benchmark(proc, image, wavelet, levels, step, psnr=None, bpp=None):
+    mtrx = image.to_matrix()
+    size_in = mtrx.size * (1 if image.maxval < 256 else 2)
+
+    start = time.perf_counter()
+    compressed = proc.compress_wavelet(image, wavelet, levels, step, psnr=psnr, bpp=bpp)
+    size_out = WaveletCompressor.channels_size(compressed.channels)
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    restored = proc.decompress_wavelet(compressed)
+    decode = time.perf_counter() - start
+
+    return (compressed.params[2] / WaveletCompressor.FIXED_POINT,
+            size_out * 8 / (image.width * image.height),
+            WaveletCompressor.psnr(mtrx, restored.to_matrix(), image.maxval),
+            size_in / encode / 1e6, size_in / decode / 1e6)
+
+
+def floats(value):
+    return [float(item) for item in value.split(',')] if value else []
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
+    parser.add_option('--images', dest='images', action='store', default='', type='str',
+                      help='список изображений через запятую (по умолчанию все *.ppm и *.pgm из res/)')
+    parser.add_option('--wavelets', dest='wavelets', action='store', default='cdf97', type='str',
+                      help='список вейвлетов через запятую')
+    parser.add_option('--levels', dest='levels', action='store', default=5, type='int',
+                      help='число уровней разложения')
+    parser.add_option('--steps', dest='steps', action='store', default='4,8,16,32', type='str',
+                      help='список шагов квантования через запятую')
+    parser.add_option('--psnr', dest='psnr', action='store', default='', type='str',
+                      help='список целевых PSNR через запятую, шаг подбирается')
+    parser.add_option('--bpp', dest='bpp', action='store', default='', type='str',
+                      help='список целевых бит на пиксель через запятую, шаг подбирается')
+
+    options, args = parser.parse_args()
+
+    images = options.images.split(',') if options.images else sorted(glob.glob('res/*.p[pg]m'))
+    runs = ([dict(psnr=target) for target in floats(options.psnr)] + [dict(bpp=target) for target in floats(options.bpp)]
+            or [dict(step=step) for step in floats(options.steps)])
+
+    proc = ImageProcessor()
+    print('{:<20} {:<6} {:<12} {:>8} {:>6} {:>7} {:>9} {:>9}'.format(
+        'image', 'wavelet', 'target', 'step', 'bpp', 'PSNR', 'enc MB/s', 'dec MB/s'))
+    for filename in images:
+        image = proc.read(filename)
+        for wavelet in options.wavelets.split(','):
+            for run in runs:
+                target = ' '.join('{}={:g}'.format(*item) for item in run.items())
+                step, bpp, psnr, encode, decode = benchmark(proc, image, wavelet, options.levels,
+                                                            run.get('step', 8.), run.get('psnr'), run.get('bpp'))
+                print('{:<20} {:<6} {:<12} {:>8.3f} {:>6.3f} {:>7.2f} {:>9.3f} {:>9.3f}'.format(
+                    filename, wavelet, target, step, bpp, psnr, encode, decode))
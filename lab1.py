@@ -1,95 +1,174 @@
 import optparse
+import os
 import sys
+from utils import prediction, profiling
 from utils.image_processor import ImageProcessor
 
 
+def select_rows(proc, image, result, rows):
+    """ the rows (start, stop) of the decompressed image, it may hold more of them (whole stripes) """
+
+    if rows is None:
+        return result
+    top = max(rows[0] - image.first_row, 0)
+    bottom = max(image.first_row + result.height - rows[1], 0)
+    return proc.crop_image(result, top=top, bottom=bottom)
+
+
 if __name__ == '__main__':
     parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
     parser.add_option('--input', dest='input', action='store', default='', type='str',
                       help='путь к *.ppm или *.pgm файлу')
     parser.add_option('--output', dest='output', action='store', default='', type='str',
                       help='путь к файлу, который следует записать.')
+    parser.add_option('--binary', dest='binary', action='store_true', default=False,
+                      help='записать результат в двоичном формате P5/P6')
     parser.add_option('--compressor', dest='compressor', action='store', default='', type='str',
-                      help='алгоритм сжатия: rle | lz77 | huffman.')
+                      help='алгоритм сжатия: rle | lz77 | huffman | arith.')
     parser.add_option('--compress', dest='compress', action='store_true', default=False,
                       help='используйте этот флаг, если нужно сжать файл')
     parser.add_option('--window', dest='window_size', action='store', default=64, type='int',
                       help='размер окна для сжатия LZ77')
+    parser.add_option('--match_finder', dest='match_finder', action='store', default='hash', type='str',
+                      help='поиск совпадений для LZ77: hash | suffix | legacy')
+    parser.add_option('--chain_depth', dest='chain_depth', action='store', default=16, type='int',
+                      help='сколько кандидатов проверять при поиске совпадения LZ77')
+    parser.add_option('--packbits', dest='packbits', action='store_true', default=False,
+                      help='RLE в режиме PackBits: короткие серии хранятся как есть')
+    parser.add_option('--order', dest='order', action='store', default=0, type='int',
+                      help='порядок модели для arith: 0 - частоты по всему каналу, 1 - по левому соседу')
+    parser.add_option('--predictor', dest='predictor', action='store', default=None, type='choice',
+                      choices=list(prediction.PREDICTORS) + [prediction.ADAPTIVE],
+                      help='сжимать остатки предсказания пикселей: {} или {} (свой для каждой строки)'.format(
+                          ' | '.join(prediction.PREDICTORS), prediction.ADAPTIVE))
+    parser.add_option('--stripe_rows', dest='stripe_rows', action='store', default=0, type='int',
+                      help='сжимать каналы полосами по столько строк независимо друг от друга (0 - целиком)')
+    parser.add_option('--processes', dest='processes', action='store', default=1, type='int',
+                      help='число процессов для каналов и полос при сжатии и декомпрессии (0 - все ядра)')
+    parser.add_option('--rows', dest='rows', action='store', default='', type='str',
+                      help='декомпрессия только строк start:stop, из файла читаются лишь нужные полосы')
+    parser.add_option('--text', dest='text', action='store_true', default=False,
+                      help='записать сжатый файл в старом текстовом формате')
+
+    profiling.add_options(parser)
 
     options, args = parser.parse_args()
 
     filename = ''.join(options.input.split('.')[:-1])
     type = options.input.split('.')[-1]
     proc = ImageProcessor()
-
-    try:
-        if options.compressor:
-            compressor_name = options.compressor.lower()
-            if options.compress:
-                image = proc.read(options.input)
-                print(image.to_matrix().shape)
-                if compressor_name == 'rle':
-                    print('Сжатие изображения при помощи алгоритма RLE.')
-                    result = proc.compress_rle(image)
-                elif compressor_name == 'lz77':
-                    print('Сжатие изображения при помощи алгоритма LZ77.')
-                    result = proc.compress_lz77(image, options.window_size)
-                elif compressor_name == 'huffman':
-                    print('Сжатие изображения при помощи алгоритма Хаффмана.')
-                    result = proc.compress_huffman(image)
-                if not options.output:
-                    filename_output = filename + '.' + type + '.' + options.compressor.lower()
-                else:
-                    filename_output = options.output
-                proc.write_compressed(filename_output, result)
-
-                length_old = len(' '.join([str(value) for value in image.pixels_raw]).strip())
-                print('Длина оригинала:', length_old)
-                length_new = len(' '.join([str(value) for value in result.pixels_raw]).strip())
-                print('Длина сжатого изображения:', length_new)
-                print('Коэффициент сжатия:', length_new / length_old)
-
-            else:
-                image = proc.read(options.input, compressed=True)
-
-                if options.compressor.lower() == 'rle':
-                    print('Декомпрессия изображения при помощи алгоритма RLE.')
-                    result = proc.decompress_rle(image)
+    stripe_rows = options.stripe_rows or None
+    processes = options.processes or None
+    rows = None
+    if options.rows:
+        try:
+            rows = tuple(int(row) for row in options.rows.split(':'))
+        except ValueError:
+            rows = ()
+        if len(rows) != 2 or not 0 <= rows[0] < rows[1]:
+            parser.error('--rows задается как start:stop, 0 <= start < stop')
+
+    with profiling.profiled(options):
+        try:
+            if options.compressor:
+                compressor_name = options.compressor.lower()
+                if options.compress:
+                    image = proc.read(options.input)
+                    print(image.to_matrix().shape)
+                    if compressor_name == 'rle':
+                        print('Сжатие изображения при помощи алгоритма RLE.')
+                        result = proc.compress_rle(image, options.packbits, options.predictor, stripe_rows, processes)
+                    elif compressor_name == 'lz77':
+                        print('Сжатие изображения при помощи алгоритма LZ77.')
+                        result = proc.compress_lz77(image, options.window_size, options.match_finder, options.chain_depth,
+                                                    options.predictor, stripe_rows, processes)
+                    elif compressor_name == 'huffman':
+                        print('Сжатие изображения при помощи алгоритма Хаффмана.')
+                        result = proc.compress_huffman(image, options.predictor, stripe_rows, processes)
+                    elif compressor_name == 'arith':
+                        print('Сжатие изображения арифметическим кодированием.')
+                        result = proc.compress_arith(image, options.order, options.predictor, stripe_rows, processes)
                     if not options.output:
-                        filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        filename_output = filename + '.' + type + '.' + options.compressor.lower()
                     else:
                         filename_output = options.output
-
-                    proc.write(filename_output, result)
-
-                if options.compressor.lower() == 'lz77':
-                    print('Декомпрессия изображения при помощи алгоритма LZ77.')
-                    result = proc.decompress_lz77(image, options.window_size)
-                    if not options.output:
-                        filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                    if options.text:
+                        proc.write_compressed(filename_output, result)
                     else:
-                        filename_output = options.output
+                        proc.write_container(filename_output, result)
 
-                    proc.write(filename_output, result)
-
-                if options.compressor.lower() == 'huffman':
-                    print('Декомпрессия изображения при помощи алгоритма Хаффмана.')
-                    result = proc.decompress_huffman(image)
-                    if not options.output:
-                        filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
-                    else:
-                        filename_output = options.output
+                    length_old = image.to_matrix().size * (1 if image.maxval < 256 else 2)
+                    print('Размер оригинала, байт:', length_old)
+                    length_new = os.path.getsize(filename_output)
+                    print('Размер сжатого файла, байт:', length_new)
+                    print('Коэффициент сжатия:', length_new / length_old)
 
-                    proc.write(filename_output, result)
+                else:
+                    image = proc.read(options.input, compressed=True, rows=rows)
+                    if rows is not None and rows[0] >= image.height:
+                        parser.error('--rows: строк в изображении {}'.format(image.height))
+                    if image.compressor:
+                        options.compressor = image.compressor  # the container knows its compressor
+
+                    if options.compressor.lower() == 'rle':
+                        print('Декомпрессия изображения при помощи алгоритма RLE.')
+                        result = select_rows(proc, image, proc.decompress_rle(image, processes), rows)
+                        if not options.output:
+                            filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        else:
+                            filename_output = options.output
+
+                        proc.write(filename_output, result, binary=options.binary or None)
+
+                    if options.compressor.lower() == 'lz77':
+                        print('Декомпрессия изображения при помощи алгоритма LZ77.')
+                        result = proc.decompress_lz77(image, options.window_size, processes)
+                        result = select_rows(proc, image, result, rows)
+                        if not options.output:
+                            filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        else:
+                            filename_output = options.output
+
+                        proc.write(filename_output, result, binary=options.binary or None)
+
+                    if options.compressor.lower() == 'huffman':
+                        print('Декомпрессия изображения при помощи алгоритма Хаффмана.')
+                        result = select_rows(proc, image, proc.decompress_huffman(image, processes), rows)
+                        if not options.output:
+                            filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        else:
+                            filename_output = options.output
+
+                        proc.write(filename_output, result, binary=options.binary or None)
+
+                    if options.compressor.lower() == 'arith':
+                        print('Декомпрессия изображения, сжатого арифметическим кодированием.')
+                        result = select_rows(proc, image, proc.decompress_arith(image, processes), rows)
+                        if not options.output:
+                            filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        else:
+                            filename_output = options.output
+
+                        proc.write(filename_output, result, binary=options.binary or None)
+
+                    if options.compressor.lower() == 'wavelet':
+                        print('Декомпрессия изображения, сжатого вейвлет-кодеком (lab3.py --compress).')
+                        result = proc.decompress_wavelet(image)
+                        if not options.output:
+                            filename_output = ''.join(options.input.split('.')[:-2] + ['.'] + options.input.split('.')[-2:-1])
+                        else:
+                            filename_output = options.output
+
+                        proc.write(filename_output, result, binary=options.binary or None)
 
-        else:
-            image = proc.read(options.input)
-            result = image
-            filename_output = filename+'_tmp.'+type
-            proc.write(filename_output, result)
+            else:
+                image = proc.read(options.input)
+                result = image
+                filename_output = options.output or filename + '_tmp.' + type
+                proc.write(filename_output, result, binary=options.binary or None)
 
-        print('Файл {} успешно записан.'.format(filename_output))
+            print('Файл {} успешно записан.'.format(filename_output))
 
-    except FileNotFoundError:
-        print('Проверьте путь к файлу.')
-        sys.exit(1)
+        except FileNotFoundError:
+            print('Проверьте путь к файлу.')
+            sys.exit(1)
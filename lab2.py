@@ -1,39 +1,57 @@
 import optparse
 import sys
+from utils import cache, profiling
 from utils.image_processor import ImageProcessor
 
+
+def convolve(proc, image, kernel, processes=1):
+    """ convolution without the rows and columns at the top and the left that wrap around the borders """
+
+    result = proc.convolve(image, kernel, processes)
+    return proc.crop_image(result, top=len(kernel), left=len(kernel))
+
+
 if __name__ == '__main__':
     parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
     parser.add_option('--input', dest='input', action='store', default='', type='str',
                       help='путь к *.ppm или *.pgm файлу')
     parser.add_option('--output', dest='output', action='store', default='', type='str',
                       help='путь к файлу, который следует записать.')
+    parser.add_option('--binary', dest='binary', action='store_true', default=False,
+                      help='записать результат в двоичном формате P5/P6')
     parser.add_option('--kernel', dest='kernel', action='store', default=None,
                       help='Путь к текстовому файлу с ядром.')
+    parser.add_option('--processes', dest='processes', action='store', default=1, type='int',
+                      help='число процессов, изображение обрабатывается по частям (0 - все ядра)')
+
+    cache.add_options(parser)
+    profiling.add_options(parser)
 
     options, args = parser.parse_args()
 
     filename = ''.join(options.input.split('.')[:-1])
     type = options.input.split('.')[-1]
-    proc = ImageProcessor()
+    results_cache = cache.from_options(options)
+    proc = ImageProcessor(results_cache)
 
-    try:
-        image = proc.read(options.input)
+    with profiling.profiled(options):
+        try:
+            image = proc.read(options.input)
 
-        with open(options.kernel, 'r') as f:
-            kernel = [[float(value) for value in line.split()] for line in f.readlines()]
+            with open(options.kernel, 'r') as f:
+                kernel = [[float(value) for value in line.split()] for line in f.readlines()]
 
-        result = proc.convolve(image, kernel)
-        result = proc.crop_image(result, top=len(kernel), left=len(kernel))
-        if not options.output:
-            filename_output = filename + '_tmp.' + type
-        else:
-            filename_output = options.output
+            result = convolve(proc, image, kernel, options.processes or None)
+            if not options.output:
+                filename_output = filename + '_tmp.' + type
+            else:
+                filename_output = options.output
 
-        proc.write(filename_output, result)
+            proc.write(filename_output, result, binary=options.binary or None)
 
-        print('Файл {} успешно записан.'.format(filename_output))
+            print('Файл {} успешно записан.'.format(filename_output))
+            cache.report(results_cache)
 
-    except FileNotFoundError:
-        print('Проверьте путь к файлу.')
-        sys.exit(1)
+        except FileNotFoundError:
+            print('Проверьте путь к файлу.')
+            sys.exit(1)
@@ -1,6 +1,10 @@
 import optparse
+import os
 import sys
+from utils import cache, profiling
 from utils.image_processor import ImageProcessor
+from utils.wavelet import LiftingWavelet
+from utils.wavelet_codec import WaveletCompressor
 
 if __name__ == '__main__':
     parser = optparse.OptionParser(usage='Usage: %prog [options] [args]')
@@ -12,37 +16,91 @@ if __name__ == '__main__':
                       help='режим кодирования')
     parser.add_option('--decode', dest='decode', action='store_true', default=False,
                       help='режим декодирования')
-    parser.add_option('--times', dest='times', action='store', default=1, type='int',
-                      help='сколько раз выполнить преобразование')
+    parser.add_option('--compress', dest='compress', action='store_true', default=False,
+                      help='сжатие с потерями: квантование вейвлет-коэффициентов и кодирование Хаффмана')
+    parser.add_option('--decompress', dest='decompress', action='store_true', default=False,
+                      help='восстановление изображения из сжатого файла')
+    parser.add_option('--times', dest='times', action='store', default=None, type='int',
+                      help='число уровней разложения, каждый следующий уровень преобразует только LL-область '
+                           '(1 для --encode, 5 для --compress)')
+    parser.add_option('--wavelet', dest='wavelet', action='store', default=None, type='choice',
+                      choices=list(LiftingWavelet.KINDS),
+                      help='вейвлет: haar, cdf53 или cdf97 (haar для --encode, cdf97 для --compress)')
+    parser.add_option('--reversible', dest='reversible', action='store_true', default=False,
+                      help='целочисленное обратимое преобразование (haar и cdf53)')
+    parser.add_option('--processes', dest='processes', action='store', default=1, type='int',
+                      help='число процессов, изображение обрабатывается по частям (0 - все ядра)')
+    parser.add_option('--step', dest='step', action='store', default=8., type='float',
+                      help='шаг квантования, больше шаг - меньше файл и хуже качество')
+    parser.add_option('--threshold', dest='threshold', action='store', default=.6, type='float',
+                      help='коэффициенты меньше threshold * шаг обнуляются')
+    parser.add_option('--preview', dest='preview', action='store', default=0, type='int',
+                      help='для --decode и --decompress: остановиться за столько уровней до конца, '
+                           'изображение меньше примерно в 2^preview раз')
+    parser.add_option('--psnr', dest='psnr', action='store', default=None, type='float',
+                      help='подобрать наибольший шаг, при котором PSNR не ниже заданного, дБ')
+    parser.add_option('--bpp', dest='bpp', action='store', default=None, type='float',
+                      help='подобрать наименьший шаг, при котором файл не больше заданного числа бит на пиксель')
+
+    cache.add_options(parser)
+    profiling.add_options(parser)
 
     options, args = parser.parse_args()
 
     filename = ''.join(options.input.split('.')[:-1])
     type = options.input.split('.')[-1]
-    proc = ImageProcessor()
-
-    try:
-        if options.encode or options.decode:
+    results_cache = cache.from_options(options)
+    proc = ImageProcessor(results_cache)
 
-            if options.encode:
+    with profiling.profiled(options):
+        try:
+            if options.compress:
                 image = proc.read(options.input)
-                result = proc.haar_encode(image, options.times)
-            else:
+                result = proc.compress_wavelet(image, options.wavelet or 'cdf97', options.times or 5, options.step,
+                                               options.threshold, options.psnr, options.bpp)
+                filename_output = options.output or filename + '.' + type + '.wavelet'
+                proc.write_container(filename_output, result)
+
+                restored = proc.decompress_wavelet(result)
+                length_new = os.path.getsize(filename_output)
+                print('Шаг квантования:', result.params[2] / WaveletCompressor.FIXED_POINT)
+                print('Размер сжатого файла, байт:', length_new)
+                print('Бит на пиксель:', length_new * 8 / (image.width * image.height))
+                print('PSNR, дБ:', WaveletCompressor.psnr(image.to_matrix(), restored.to_matrix(), image.maxval))
+                print('Файл {} успешно записан.'.format(filename_output))
+
+            elif options.decompress:
                 image = proc.read(options.input, compressed=True)
-                result = proc.haar_decode(image, options.times)
+                result = proc.decompress_wavelet(image, options.preview)
+                filename_output = options.output or ''.join(options.input.split('.')[:-2] + ['_tmp.']
+                                                            + options.input.split('.')[-2:-1])
+                proc.write(filename_output, result)
+                print('Файл {} успешно записан.'.format(filename_output))
+
+            elif options.encode or options.decode:
+
+                if options.encode:
+                    image = proc.read(options.input)
+                    result = proc.haar_encode(image, options.times or 1, options.wavelet or 'haar', options.reversible,
+                                             options.processes or None)
+                else:
+                    image = proc.read(options.input)
+                    result = proc.haar_decode(image, options.times or 1, options.wavelet or 'haar', options.reversible,
+                                             options.processes or None, options.preview)
 
-            if not options.output:
-                filename_output = filename + '_tmp.' + type
-            else:
-                filename_output = options.output
+                if not options.output:
+                    filename_output = filename + '_tmp.' + type
+                else:
+                    filename_output = options.output
 
 
-            print('>>>', result.pixels_raw.shape)
+                print('>>>', result.pixels_raw.shape)
 
-            proc.write(filename_output, result)
+                proc.write(filename_output, result)
 
-            print('Файл {} успешно записан.'.format(filename_output))
+                print('Файл {} успешно записан.'.format(filename_output))
+                cache.report(results_cache)
 
-    except FileNotFoundError:
-        print('Проверьте путь к файлу.')
-        sys.exit(1)
+        except FileNotFoundError:
+            print('Проверьте путь к файлу.')
+            sys.exit(1)
@@ -1,19 +1,54 @@
+from utils import cache, profiling
 from utils.audio_processor import AudioProcessorWAVE
+from utils.windows import WINDOW_TYPES
+import numpy as np
 import sys
 import optparse
 
 
+def short_time(processor, options, filename):
+    """ STFT frame by frame: a spectrogram in .npy or, with --itransform, the restored *.wav """
+
+    with open(options.input, 'rb') as audio_file:
+        meta_info = processor.read_header(audio_file)
+    length = meta_info['subchunk_2_size'] // meta_info['block_align']
+    spectra = processor.stft(options.input, options.frame_size, options.hop,
+                             window_type=options.window_type)
+
+    if options.itransform:
+        filename_output = options.output or filename + '_tmp.wav'
+        blocks = processor.istft(spectra, options.frame_size, options.hop, length,
+                                 window_type=options.window_type)
+        processor.write_blocks(filename_output, meta_info, blocks)
+        return filename_output
+
+    filename_output = options.output or filename + '_stft.npy'
+    shape = (processor.stft_frames(length, options.frame_size, options.hop),
+             meta_info['num_channels'], options.frame_size // 2 + 1)
+    spectrogram = np.lib.format.open_memmap(filename_output, mode='w+', dtype=np.float32, shape=shape)
+    for i, spectrum in enumerate(spectra):
+        spectrogram[i] = np.abs(spectrum)
+    spectrogram.flush()
+    return filename_output
+
+
 def main(options):
 
     filename = ''.join(options.input.split('.')[:-1])
     extension = options.input.split('.')[-1]
-    processor = AudioProcessorWAVE()
+    results_cache = cache.from_options(options)
+    processor = AudioProcessorWAVE(results_cache)
 
     try:
+        if options.stft:
+            filename_output = short_time(processor, options, filename)
+            print('Файл {} успешно записан.'.format(filename_output))
+            return
+
         audio = processor.read(options.input)
 
         if options.apply_window:
-            audio.data = processor.apply_hanna_window(audio)
+            audio.data = processor.apply_hanna_window(audio, options.window_type)
 
         if options.transform:
             audio.data = processor.calc_dft(audio)
@@ -29,6 +64,7 @@ def main(options):
         processor.write(audio, filename_output)
 
         print('Файл {} успешно записан.'.format(filename_output))
+        cache.report(results_cache)
 
     except FileNotFoundError:
         print('Проверьте путь к файлу.')
@@ -46,9 +82,25 @@ if __name__ == '__main__':
     parser.add_option('--itransform', dest='itransform', action='store_true', default=False,
                       help='применить обратное преобразование')
     parser.add_option('--apply_window', dest='apply_window', action='store_true', default=False,
-                      help='применить оконную функцию Ханна')
+                      help='применить оконную функцию (по умолчанию Ханна)')
+    parser.add_option('--window_type', dest='window_type', action='store', default='hann', type='choice',
+                      choices=list(WINDOW_TYPES),
+                      help='оконная функция: {}'.format(', '.join(WINDOW_TYPES)))
+    parser.add_option('--stft', dest='stft', action='store_true', default=False,
+                      help='оконное преобразование по кадрам: спектрограмма в *.npy, '
+                           'с --itransform - восстановленный *.wav')
+    parser.add_option('--frame_size', dest='frame_size', action='store', default=1024, type='int',
+                      help='размер кадра для --stft')
+    parser.add_option('--hop', dest='hop', action='store', default=256, type='int',
+                      help='шаг между кадрами для --stft')
     parser.add_option('--test', dest='test', action='store_true', default=False,
                       help='тестовый режим')
 
+    cache.add_options(parser)
+    profiling.add_options(parser)
+
     options, args = parser.parse_args()
-    main(options)
+    if options.stft and not 0 < options.hop < options.frame_size:
+        parser.error('шаг --hop должен быть меньше размера кадра --frame_size')
+    with profiling.profiled(options):
+        main(options)
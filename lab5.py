@@ -1,5 +1,7 @@
+from utils import profiling
 from utils.audio_processor import AudioProcessorWAVE
 import sys
+import time
 import optparse
 
 
@@ -10,29 +12,18 @@ def main(options):
     processor = AudioProcessorWAVE()
 
     try:
-        audio = processor.read(options.input)
-
-        if options.encode:
-            if options.apply_mu:
-                new_audio = processor.mu_law(audio, encode=True)
-                #new_audio = processor.mu_law(new_audio, encode=False)
-            elif options.apply_alpha:
-                new_audio = processor.alpha_law(audio, encode=True)
-                #new_audio = processor.alpha_law(new_audio, encode=False)
-
-        if options.decode:
-            if options.apply_mu:
-                new_audio = processor.mu_law(audio, encode=False)
-            elif options.apply_alpha:
-                new_audio = processor.alpha_law(audio, encode=False)
-
+        law = 'mulaw' if options.apply_mu else 'alaw'
         if not options.output:
             filename_output = filename + '_tmp.' + extension
         else:
             filename_output = options.output
 
-        processor.write(new_audio, filename_output)
+        start = time.time()
+        samples = processor.compand_stream(options.input, filename_output, law, encode=not options.decode,
+                                           g711=options.g711, block_size=options.block_size)
+        elapsed = time.time() - start
 
+        print('Обработано отсчетов: {}, {:.0f} отсчетов/с'.format(samples, samples / max(elapsed, 1e-9)))
         print('Файл {} успешно записан.'.format(filename_output))
 
     except FileNotFoundError:
@@ -54,6 +45,14 @@ if __name__ == '__main__':
                       help='применить мю-закон')
     parser.add_option('--alpha', dest='apply_alpha', action='store_true', default=False,
                       help='применить альфа-закон')
+    parser.add_option('--g711', dest='g711', action='store_true', default=False,
+                      help='8-битное кодирование G.711 по таблицам (с --alpha или --mu): '
+                           'сжатие в 8-битный *.wav, с --decode - обратно в 16-битный PCM')
+    parser.add_option('--block_size', dest='block_size', action='store', default=65536, type='int',
+                      help='число кадров, обрабатываемых за раз')
+
+    profiling.add_options(parser)
 
     options, args = parser.parse_args()
-    main(options)
+    with profiling.profiled(options):
+        main(options)
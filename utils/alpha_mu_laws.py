@@ -1,42 +1,130 @@
+from functools import lru_cache
+
 import numpy as np
 
 
 class MuLaw:
+    """ out, if given, is a float array the result is written to, otherwise a new one is returned """
+
     def __init__(self):
         self.mu = 255.
 
-    def encode(self, array):
-        out = np.sign(array) * np.log(1. + self.mu * np.abs(array)) / np.log(1. + self.mu)
-        out = out.astype('float64')
-        return out
+    def encode(self, array, out=None):
+        out = np.abs(array, out=out, dtype='float64')
+        out *= self.mu
+        np.log1p(out, out=out)
+        out /= np.log1p(self.mu)
+        return np.copysign(out, array, out=out)
+
+    def decode(self, array, out=None):
+        """ integer samples, written to out as floats or returned as an int array """
 
-    def decode(self, array):
-        array = np.array(array)
-        out = np.sign(array) / self.mu * ((1. + self.mu) ** np.abs(array) - 1.)
-        out = np.where(np.equal(array, 0), array, out)
-        return tuple(int(value) for value in np.around(out, decimals=1))  # to avoid 127.999... pruning to 127
+        result = np.abs(array, out=out, dtype='float64')
+        np.power(1. + self.mu, result, out=result)
+        result -= 1.
+        result /= self.mu
+        np.copysign(result, array, out=result)
+        np.around(result, decimals=1, out=result)  # to avoid 127.999... pruning to 127
+        np.trunc(result, out=result)
+        return result if out is not None else result.astype(int)
 
 
 class AlphaLaw:
+    """ out, if given, is a float array the result is written to, otherwise a new one is returned """
+
     def __init__(self):
         self.A = 87.6
 
-    def encode(self, array):
-        def f(x):
-            if np.abs(x) < 1./self.A:
-                return np.sign(x) * self.A * np.abs(x) / (1. + np.log(self.A))
-            else:
-                return (1. + np.log(self.A * np.abs(x))) / (1. + np.log(self.A))
-
-        y = np.sign(array) * list(map(f, array))
-        return y.astype('float64')
-
-    def decode(self, array):
-        def f_(x):
-            if np.abs(x) < 1./(1. + np.log(self.A)):
-                return np.abs(x) * (1. + np.log(self.A)) / self.A
-            else:
-                return np.exp(np.abs(x) * (1. + np.log(self.A)) - 1) / self.A
-
-        x = np.sign(array) * list(map(f_, array))
-        return tuple(int(value) for value in np.around(x, decimals=1))
+    def encode(self, array, out=None):
+        out = np.abs(array, out=out, dtype='float64')
+        large = out >= 1. / self.A
+        out *= self.A
+        np.log(out, out=out, where=large)
+        np.add(out, 1., out=out, where=large)
+        out /= 1. + np.log(self.A)
+        return np.copysign(out, array, out=out)
+
+    def decode(self, array, out=None):
+        """ integer samples, written to out as floats or returned as an int array """
+
+        result = np.abs(array, out=out, dtype='float64')
+        result *= 1. + np.log(self.A)
+        large = result >= 1.
+        np.subtract(result, 1., out=result, where=large)
+        np.exp(result, out=result, where=large)
+        result /= self.A
+        np.around(result, decimals=1, out=result)  # to avoid 127.999... pruning to 127
+        np.copysign(result, array, out=result)
+        np.trunc(result, out=result)
+        return result if out is not None else result.astype(int)
+
+
+def _segments(values, ends):
+    """ number of the segment every value falls into, 8 if it is above the last one """
+
+    return np.searchsorted(np.asarray(ends), values, side='left')
+
+
+@lru_cache(maxsize=2)
+def _g711_tables(law):
+    """ (encoding table indexed by 16-bit PCM as uint16, decoding table indexed by the 8-bit code) """
+
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int64)
+    codes = np.arange(256, dtype=np.int64)
+
+    if law == 'alaw':
+        value = pcm >> 3  # 13-bit magnitude
+        mask = np.where(value >= 0, 0xD5, 0x55)
+        value = np.where(value >= 0, value, -value - 1)
+        segment = _segments(value, [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+        mantissa = np.where(segment < 2, value >> 1, value >> np.minimum(segment, 7)) & 0xF
+        encoded = np.where(segment >= 8, 0x7F, (segment << 4) | mantissa) ^ mask
+
+        code = codes ^ 0x55
+        segment = (code & 0x70) >> 4
+        magnitude = ((code & 0xF) << 4) + np.where(segment == 0, 8, 0x108)
+        magnitude = np.where(segment > 1, magnitude << np.maximum(segment - 1, 0), magnitude)
+        decoded = np.where(code & 0x80, magnitude, -magnitude)
+    else:
+        bias, clip = 0x84, 8159
+        value = pcm >> 2  # 14-bit magnitude
+        mask = np.where(value < 0, 0x7F, 0xFF)
+        value = np.minimum(np.abs(value), clip) + (bias >> 2)
+        segment = _segments(value, [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+        mantissa = (value >> np.minimum(segment + 1, 8)) & 0xF
+        encoded = np.where(segment >= 8, 0x7F, (segment << 4) | mantissa) ^ mask
+
+        code = ~codes
+        magnitude = (((code & 0xF) << 3) + bias) << ((code & 0x70) >> 4)
+        decoded = np.where(code & 0x80, bias - magnitude, magnitude - bias)
+
+    encoded = encoded.astype(np.uint8)
+    decoded = decoded.astype(np.int16)
+    encoded.flags.writeable = decoded.flags.writeable = False
+    return encoded, decoded
+
+
+class G711:
+    """
+    8-bit G.711 companding of 16-bit PCM (A-law or mu-law), one table lookup per sample:
+    a 65536-entry table for encoding, a 256-entry one for decoding.
+    """
+
+    LAWS = ('alaw', 'mulaw')
+    WAVE_FORMATS = {'alaw': 6, 'mulaw': 7}
+
+    def __init__(self, law='alaw'):
+        if law not in self.LAWS:
+            raise ValueError('unknown G.711 law: {}'.format(law))
+        self.law = law
+        self.encoding_table, self.decoding_table = _g711_tables(law)
+
+    def encode(self, array, out=None):
+        """ int16 samples to uint8 codes """
+
+        return np.take(self.encoding_table, np.asarray(array, dtype=np.int16).view(np.uint16), out=out)
+
+    def decode(self, array, out=None):
+        """ uint8 codes to int16 samples """
+
+        return np.take(self.decoding_table, np.asarray(array, dtype=np.uint8), out=out)
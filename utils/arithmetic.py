@@ -0,0 +1,196 @@
+"""
+    Range coder (the carryless coder of D. Subbotin, 32-bit) with adaptive models:
+    the symbol frequencies start equal and are updated after every symbol, the decoder repeats the updates,
+    so the data is coded in one pass and no table is stored.
+
+    order 0  one frequency table for the channel
+    order 1  a table for every value of the previous sample (the left neighbour in a row of pixels),
+             smooth images put most of the probability on a few symbols near it
+
+    Samples above 255 (16-bit images) are coded as two bytes, the high one first, each with its own tables.
+"""
+
+import numpy as np
+
+
+class FrequencyModel:
+    """ adaptive frequencies of the symbols 0..size-1, the cumulative ones are kept in a Fenwick tree """
+
+    INCREMENT = 24
+    LIMIT = 1 << 16  # the total must stay below the bottom of the range
+
+    def __init__(self, size=256):
+        self.size = size
+        self.frequencies = [1] * size
+        self.total = size
+        self.top = 1 << (size.bit_length() - 1)  # the highest power of two in the tree
+        self.build_()
+
+    def build_(self):
+        tree = [0] + self.frequencies
+        for index in range(1, self.size + 1):
+            parent = index + (index & -index)
+            if parent <= self.size:
+                tree[parent] += tree[index]
+        self.tree = tree
+
+    def cumulative(self, symbol):
+        ''' frequency of the symbols below the given one '''
+        tree, total = self.tree, 0
+        while symbol:
+            total += tree[symbol]
+            symbol &= symbol - 1
+        return total
+
+    def find(self, value):
+        ''' (symbol, its cumulative frequency) with cumulative <= value < cumulative + frequency '''
+        tree, size = self.tree, self.size
+        position, mask, rest = 0, self.top, value
+        while mask:
+            following = position + mask
+            if following <= size and tree[following] <= rest:
+                position = following
+                rest -= tree[following]
+            mask >>= 1
+        return position, value - rest
+
+    def update(self, symbol):
+        self.frequencies[symbol] += self.INCREMENT
+        self.total += self.INCREMENT
+        if self.total >= self.LIMIT:
+            self.frequencies = [(frequency + 1) >> 1 for frequency in self.frequencies]
+            self.total = sum(self.frequencies)
+            self.build_()
+            return
+
+        tree, size, index = self.tree, self.size, symbol + 1
+        while index <= size:
+            tree[index] += self.INCREMENT
+            index += index & -index
+
+
+class RangeEncoder:
+    TOP = 1 << 24
+    BOTTOM = 1 << 16
+    MASK = 0xFFFFFFFF
+
+    def __init__(self):
+        self.low = 0
+        self.range = self.MASK
+        self.output = bytearray()
+
+    def encode(self, cumulative, frequency, total):
+        step = self.range // total
+        low = self.low + step * cumulative
+        current = step * frequency
+        while True:
+            if low ^ (low + current) >= self.TOP:
+                if current >= self.BOTTOM:
+                    break
+                current = -low & (self.BOTTOM - 1)  # the range is cut to the next multiple of BOTTOM
+            self.output.append(low >> 24)
+            low = (low << 8) & self.MASK
+            current = (current << 8) & self.MASK
+        self.low, self.range = low, current
+
+    def finish(self):
+        for _ in range(4):
+            self.output.append(self.low >> 24)
+            self.low = (self.low << 8) & self.MASK
+        return bytes(self.output)
+
+
+class RangeDecoder:
+    TOP, BOTTOM, MASK = RangeEncoder.TOP, RangeEncoder.BOTTOM, RangeEncoder.MASK
+
+    def __init__(self, data):
+        self.data = bytes(data) + b'\x00' * 4  # the encoder may stop before the last bytes are needed
+        self.position = 4
+        self.code = int.from_bytes(self.data[:4], 'big')
+        self.low = 0
+        self.range = self.MASK
+
+    def target(self, total):
+        ''' the cumulative frequency the next symbol covers '''
+        self.range //= total
+        return min((self.code - self.low) // self.range, total - 1)
+
+    def decode(self, cumulative, frequency):
+        data, position, code = self.data, self.position, self.code
+        low = self.low + self.range * cumulative
+        current = self.range * frequency
+        while True:
+            if low ^ (low + current) >= self.TOP:
+                if current >= self.BOTTOM:
+                    break
+                current = -low & (self.BOTTOM - 1)
+            code = ((code << 8) | data[position]) & self.MASK
+            position += 1
+            low = (low << 8) & self.MASK
+            current = (current << 8) & self.MASK
+        self.low, self.range, self.code, self.position = low, current, code, position
+
+
+class ArithmeticCompressor:
+    ORDERS = (0, 1)
+
+    def __init__(self, order=0, maxval=255):
+        if order not in self.ORDERS:
+            raise ValueError('unknown model order: {}'.format(order))
+        self.order = order
+        self.width = 1 if maxval < 256 else 2  # bytes per sample
+
+    def models_(self):
+        ''' tables of every byte of a sample, by context (the same byte of the previous sample for order 1) '''
+        contexts = 256 if self.order else 1
+        return [[None] * contexts for _ in range(self.width)]
+
+    def bytes_(self, array):
+        array = np.asarray(array, dtype=np.int64).ravel()
+        if self.width == 1:
+            return array[:, None].tolist()
+        return np.stack([array >> 8, array & 0xFF], axis=-1).tolist()
+
+    def compress(self, array):
+        '''
+        Return: (payload bytes, number of samples)
+        '''
+        samples = self.bytes_(array)
+        models = self.models_()
+        encoder = RangeEncoder()
+        encode = encoder.encode
+        previous = [0] * self.width
+        for sample in samples:
+            for position, symbol in enumerate(sample):
+                context = previous[position] if self.order else 0
+                model = models[position][context]
+                if model is None:
+                    model = models[position][context] = FrequencyModel()
+                encode(model.cumulative(symbol), model.frequencies[symbol], model.total)
+                model.update(symbol)
+            previous = sample
+        return encoder.finish(), len(samples)
+
+    def decompress(self, channel):
+        payload, count = channel
+        models = self.models_()
+        decoder = RangeDecoder(payload)
+        target, decode = decoder.target, decoder.decode
+        result = np.empty((count, self.width), dtype=np.int64)
+        previous = [0] * self.width
+        for index in range(count):
+            sample = []
+            for position in range(self.width):
+                context = previous[position] if self.order else 0
+                model = models[position][context]
+                if model is None:
+                    model = models[position][context] = FrequencyModel()
+                symbol, cumulative = model.find(target(model.total))
+                decode(cumulative, model.frequencies[symbol])
+                model.update(symbol)
+                sample.append(symbol)
+            result[index] = sample
+            previous = sample
+        if self.width == 1:
+            return result[:, 0]
+        return (result[:, 0] << 8) | result[:, 1]
@@ -3,94 +3,434 @@
 """
 
 import numpy as np
+import os
 import struct
 from .fourier_transform import Fourier
 import copy
-from .alpha_mu_laws import AlphaLaw, MuLaw
+from .alpha_mu_laws import AlphaLaw, G711, MuLaw
+from numpy.lib.stride_tricks import sliding_window_view
+from .windows import apply_window, get_window
+from .profiling import payload_size, stage, traced
+from .cache import cached
+
+
+def _batches(iterable, size):
+    group = []
+    for item in iterable:
+        group.append(item)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
 
 
 class WAVAudio:
-    def __init__(self, meta_info, *data):
+    """ data is a NumPy array of interleaved samples: left, right, left, right, ... """
+
+    def __init__(self, meta_info, data):
         self.meta_info = meta_info
         self.data = data
 
     def __repr__(self):
         return str(self.meta_info)
 
+    def read_frames(self, start, count):
+        """ (count, channels) samples from frame start on, a memmap is read only there """
+
+        channels = self.meta_info['num_channels']
+        return np.asarray(self.data[start * channels:(start + count) * channels]).reshape(-1, channels)
+
     def separate_channels(self):
-        if self.meta_info['num_channels'] == 2:
-            return np.array([self.data[::2], self.data[1::2]])
+        """ (channels, frames) view of the data, nothing is copied """
+
+        return np.asarray(self.data).reshape(-1, self.meta_info['num_channels']).T
 
     def channels_to_row(self, separate_channels):
-        flatten = lambda l: [item for sublist in l for item in sublist]
-        return flatten([[channel[i] for channel in separate_channels] for i in range(len(separate_channels[0]))])
+        return np.asarray(separate_channels).T.ravel()
 
 
 class AudioProcessorWAVE:
-    def __init__(self):
-        self.fields = {
-            'chunk_id': (4, False),
-            'chunk_size': (4, True),
-            'format': (4, False),
-            'subchunk_1_id': (4, False),
-            'subchunk_1_size': (4, True),
-            'audio_format': (2, True),
-            'num_channels': (2, True),
-            'sample_rate': (4, True),
-            'byte_rate': (4, True),
-            'block_align': (2, True),
-            'bits_per_sample': (2, True),
-            'subchunk_2_id': (4, False),
-            'subchunk_2_size': (4, True)}
-        self.integers = ['chunk_size', 'subchunk_1_size', 'audio_format', 'num_channels', 'sample_rate', 'byte_rate',
-                         'block_align', 'bits_per_sample']
+    """
+    RIFF and RF64 WAVE files. The reader walks the chunks, so LIST, fact, JUNK and other chunks
+    before or between 'fmt ' and 'data' are skipped, WAVE_FORMAT_EXTENSIBLE is reduced to its sub-format.
+    The writer always produces the canonical header: RIFF, 'fmt ', 'data', or RF64 with 'ds64' over 4 GB.
+    """
+
+    WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+    RF64_LIMIT = 0xFFFFFFFF - 80  # larger data chunks do not fit the 32-bit RIFF sizes
+    DS64_SIZE = 28
+
+    def __init__(self, cache=None):
+        """ cache: utils.cache.ResultCache of the results of calc_dft and calc_idft """
+        self.cache = cache
+
+    def read_header(self, audio_file):
+        """ walks the chunks up to 'data', the file is left at the first sample """
+
+        chunk_id, chunk_size, form = struct.unpack('<4sI4s', audio_file.read(12))
+        if chunk_id not in (b'RIFF', b'RF64') or form != b'WAVE':
+            raise ValueError('not a RIFF WAVE file')
+
+        meta_info = {'chunk_id': chunk_id, 'chunk_size': chunk_size, 'format': form}
+        sizes_64 = {}
+        while True:
+            header = audio_file.read(8)
+            if len(header) < 8:
+                raise ValueError('no data chunk in the file')
+            subchunk_id, size = struct.unpack('<4sI', header)
+
+            if subchunk_id == b'ds64':
+                riff_size, data_size, _ = struct.unpack('<QQQ', audio_file.read(24))
+                sizes_64 = {'chunk_size': riff_size, 'subchunk_2_size': data_size}
+                audio_file.seek(size - 24 + size % 2, 1)
+            elif subchunk_id == b'fmt ':
+                fmt = audio_file.read(size + size % 2)
+                meta_info['subchunk_1_id'], meta_info['subchunk_1_size'] = subchunk_id, size
+                (meta_info['audio_format'], meta_info['num_channels'], meta_info['sample_rate'],
+                 meta_info['byte_rate'], meta_info['block_align'], meta_info['bits_per_sample']) = \
+                    struct.unpack_from('<HHIIHH', fmt)
+                if meta_info['audio_format'] == self.WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                    # the first two bytes of the sub-format GUID are the actual format code
+                    meta_info['channel_mask'], meta_info['audio_format'] = struct.unpack_from('<IH', fmt, 20)
+            elif subchunk_id == b'data':
+                if 'audio_format' not in meta_info:
+                    raise ValueError('no fmt chunk before the data chunk')
+                meta_info['subchunk_2_id'] = subchunk_id
+                meta_info['subchunk_2_size'] = size
+                meta_info.update(sizes_64)
+                meta_info['data_offset'] = audio_file.tell()
+
+                # size of a file that is still being written or was cut short may be wrong
+                available = os.fstat(audio_file.fileno()).st_size - meta_info['data_offset']
+                meta_info['subchunk_2_size'] = min(meta_info['subchunk_2_size'], available)
+                return meta_info
+            else:
+                audio_file.seek(size + size % 2, 1)  # LIST, fact, JUNK, cue, ...
+
+    def write_header(self, audio_file, meta_info, reserve_ds64=False):
+        """
+        reserve_ds64 puts a JUNK chunk where 'ds64' goes, so the header can be rewritten
+        in place as RF64 once the size of the data is known
+        """
+
+        size = meta_info['subchunk_2_size']
+        rf64 = size > self.RF64_LIMIT
+        extra = 8 + self.DS64_SIZE if rf64 or reserve_ds64 else 0
+        riff_size = 4 + extra + 24 + 8 + size + size % 2
+
+        if rf64:
+            header = (struct.pack('<4sI4s', b'RF64', 0xFFFFFFFF, b'WAVE')
+                      + struct.pack('<4sIQQQI', b'ds64', self.DS64_SIZE, riff_size, size,
+                                    size // max(meta_info['block_align'], 1), 0))
+        else:
+            header = struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+            if reserve_ds64:
+                header += struct.pack('<4sI', b'JUNK', self.DS64_SIZE) + bytes(self.DS64_SIZE)
+
+        header += struct.pack('<4sIHHIIHH', b'fmt ', 16, meta_info['audio_format'], meta_info['num_channels'],
+                              meta_info['sample_rate'], meta_info['byte_rate'], meta_info['block_align'],
+                              meta_info['bits_per_sample'])
+        header += struct.pack('<4sI', b'data', 0xFFFFFFFF if rf64 else size)
+        audio_file.write(header)
+
+    @staticmethod
+    def sample_dtype(meta_info):
+        """ NumPy type of the samples in memory, 24-bit ones are kept in int32 """
+
+        bits = meta_info['bits_per_sample']
+        if meta_info['audio_format'] == 3:
+            if bits in (32, 64):
+                return np.dtype('<f{}'.format(bits // 8))
+        elif bits == 8:
+            return np.dtype(np.uint8)
+        elif bits in (16, 24, 32):
+            return np.dtype('<i{}'.format(2 if bits == 16 else 4))
+        raise ValueError('unsupported sample format: {} bits, format {}'.format(bits, meta_info['audio_format']))
+
+    @staticmethod
+    def to_pcm16(data, meta_info):
+        """ samples of any PCM format as 16-bit signed ones """
+
+        data = np.asarray(data)
+        bits = meta_info['bits_per_sample']
+        if data.dtype == np.int16:
+            return data
+        if data.dtype.kind == 'f':
+            return np.rint(np.clip(data, -1., 1.) * 32767).astype(np.int16)
+        if bits == 8:
+            return ((data.astype(np.int16) - 128) << 8).astype(np.int16)
+        return (data.astype(np.int64) >> (bits - 16)).astype(np.int16)
 
+    @staticmethod
+    def decode_samples(buffer, meta_info):
+        """ bytes of the data chunk to a flat array of samples """
+
+        if meta_info['bits_per_sample'] != 24:
+            return np.frombuffer(buffer, dtype=AudioProcessorWAVE.sample_dtype(meta_info))
+
+        raw = np.frombuffer(buffer, dtype=np.uint8)[:len(buffer) // 3 * 3].reshape(-1, 3).astype(np.int32)
+        samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        return (samples << 8) >> 8  # sign extension of the 24-bit values
+
+    @staticmethod
+    def encode_samples(data, meta_info):
+        """ samples to bytes of the data chunk, integer formats are rounded and clipped to their range """
+
+        bits = meta_info['bits_per_sample']
+        dtype = AudioProcessorWAVE.sample_dtype(meta_info)
+        data = np.asarray(data)
+        if dtype.kind != 'f':
+            if bits == 24:
+                low, high = -(1 << 23), (1 << 23) - 1
+            else:
+                low, high = np.iinfo(dtype).min, np.iinfo(dtype).max
+            if data.dtype.kind in 'fc':
+                data = np.rint(np.real(data))
+            data = np.clip(data, low, high)
+
+        data = np.ascontiguousarray(data, dtype=dtype)
+        if bits == 24:
+            return data.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        return data.tobytes()
+
+    @staticmethod
+    def consistent_header(meta_info, data_size):
+        """ a copy of the header with the sizes and rates derived from the sample format """
+
+        meta_info = dict(meta_info)
+        meta_info['block_align'] = meta_info['num_channels'] * meta_info['bits_per_sample'] // 8
+        meta_info['byte_rate'] = meta_info['sample_rate'] * meta_info['block_align']
+        meta_info['subchunk_2_size'] = data_size
+        meta_info['chunk_size'] = data_size + 36
+        meta_info.pop('data_offset', None)
+        return meta_info
+
+    @traced(files=('in', ))
     def read(self, filename):
         with open(filename, 'rb') as audio_file:
-            lines = audio_file.read()
+            meta_info = self.read_header(audio_file)
+            data = audio_file.read(meta_info['subchunk_2_size'])
 
-        offset = 0
-        meta_info = {}
-        for key in self.fields.keys():
-            meta_info[key] = lines[offset:offset + self.fields[key][0]]
-            if self.fields[key][1]:
-                meta_info[key] = int.from_bytes(meta_info[key], 'little')
-            offset += self.fields[key][0]
-
-        data = lines[offset:offset + meta_info['subchunk_2_size']]
-        new_audio = WAVAudio(meta_info, *data)
+        data = data[:len(data) - len(data) % meta_info['block_align']]
+        new_audio = WAVAudio(meta_info, self.decode_samples(data, meta_info))
 
         return new_audio
 
+    @traced
+    def open(self, filename):
+        """
+        WAVAudio whose data is a read-only np.memmap of the data chunk:
+        only the pages that are actually sliced are read from the disk
+        """
+
+        with open(filename, 'rb') as audio_file:
+            meta_info = self.read_header(audio_file)
+        if meta_info['bits_per_sample'] == 24:
+            raise ValueError('24-bit samples cannot be mapped, use read_frames')
+
+        dtype = self.sample_dtype(meta_info)
+        count = meta_info['subchunk_2_size'] // meta_info['block_align'] * meta_info['num_channels']
+        data = np.memmap(filename, dtype=dtype, mode='r', offset=meta_info['data_offset'], shape=(count,))
+        return WAVAudio(meta_info, data)
+
+    @traced
+    def read_frames(self, filename, start, count):
+        """ (count, channels) samples from frame start on, the rest of the file is not read """
+
+        with open(filename, 'rb') as audio_file:
+            meta_info = self.read_header(audio_file)
+            block_align = meta_info['block_align']
+            frames = meta_info['subchunk_2_size'] // block_align
+            start = min(max(start, 0), frames)
+            count = min(max(count, 0), frames - start)
+
+            audio_file.seek(meta_info['data_offset'] + start * block_align)
+            data = audio_file.read(count * block_align)
+
+        return self.decode_samples(data, meta_info).reshape(-1, meta_info['num_channels'])
+
+    @traced(files=('out', ))
     def write(self, audio: WAVAudio, filename):
+        """ float samples of an integer format (after windowing or companding) are written as 32-bit float """
+
+        data = np.asarray(audio.data)
+        meta_info = dict(audio.meta_info)
+        if data.dtype.kind in 'fc' and self.sample_dtype(meta_info).kind != 'f':
+            meta_info['audio_format'], meta_info['bits_per_sample'] = 3, 32
+            data = np.real(data)
+
+        buffer = self.encode_samples(data, meta_info)
         with open(filename, 'wb') as audio_file:
-            for key in audio.meta_info:
-                value = audio.meta_info[key]
-                fmt = 'i' if self.fields[key][0] == 4 else 'h'
-
-                if type(value) == int:
-                    audio_file.write(struct.pack(fmt, value))
-                elif type(value) == bytes:
-                    audio_file.write(value)
-
-            if type(audio.data[0]) == int:
-                for byte in audio.data:
-                    audio_file.write(struct.pack('B', byte))
+            self.write_header(audio_file, self.consistent_header(meta_info, len(buffer)))
+            audio_file.write(buffer)
+            if len(buffer) % 2:
+                audio_file.write(b'\x00')  # chunks are word aligned
+
+    @traced
+    def calc_dft(self, audio, real=False):
+        """ spectrum of the samples, only the non-negative frequencies if real """
+
+        data = np.asarray(audio.data)
+        if real:
+            return cached(self.cache, 'rfft', lambda: Fourier.rfft(data), (data, ))
+        return cached(self.cache, 'dft', lambda: Fourier.dft(data), (data, ))
+
+    @traced
+    def calc_idft(self, audio, real=False, length=None):
+        """ samples from a spectrum, length is the number of samples for a real (rfft) spectrum """
+
+        def compute():
+            if real:
+                idft = Fourier.irfft(audio.data, length)
             else:
-                audio_file.write(struct.pack('f' * len(audio.data), *audio.data))
+                idft = Fourier.idft(audio.data)
+            return np.rint(np.real(idft)).astype(int)
+
+        return cached(self.cache, 'idft', compute, (audio.data, ), real=real, length=length)
+
+    @traced
+    def read_blocks(self, filename, frames):
+        """ generator of (frames, channels) arrays of samples, the data chunk is read piece by piece """
+
+        with open(filename, 'rb') as audio_file:
+            meta_info = self.read_header(audio_file)
+            block_align = meta_info['block_align']
+
+            remaining = meta_info['subchunk_2_size']
+            while remaining > 0:
+                chunk = audio_file.read(min(frames * block_align, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                samples = self.decode_samples(chunk[:len(chunk) - len(chunk) % block_align], meta_info)
+                yield samples.reshape(-1, meta_info['num_channels'])
+
+    @traced(files=('out', ))
+    def write_blocks(self, filename, meta_info, blocks):
+        """ writes the header and the (frames, channels) blocks of samples one by one """
+
+        size = 0
+        with open(filename, 'wb') as audio_file:
+            self.write_header(audio_file, self.consistent_header(meta_info, 0), reserve_ds64=True)
+            for block in blocks:
+                with stage('encode samples', payload_size(block)):
+                    data = self.encode_samples(block, meta_info)
+                audio_file.write(data)
+                size += len(data)
+
+            # sizes are known only now
+            if size % 2:
+                audio_file.write(b'\x00')  # chunks are word aligned
+            audio_file.seek(0)
+            self.write_header(audio_file, self.consistent_header(meta_info, size), reserve_ds64=True)
+
+    @staticmethod
+    def stft_frames(length, frame_size, hop):
+        """ number of frames stft yields for a signal of the given number of samples """
+
+        if not length:
+            return 0
+        return (frame_size - hop + length - 1) // hop + 1
+
+    @staticmethod
+    def _stft_normalization(window, hop):
+        """ sum of the squared window over all frames covering a sample, periodic with the hop """
+
+        squares = np.zeros(hop)
+        for start in range(0, len(window), hop):
+            piece = window[start:start + hop] ** 2
+            squares[:len(piece)] += piece
+        if squares.min() < 1e-8:
+            raise ValueError('the hop {} is too large for frames of {} samples'.format(hop, len(window)))
+        return squares
+
+    def stft(self, filename, frame_size=1024, hop=256, batch=64, window_type='hann'):
+        """
+        Generator of the spectra of windowed frames, each one is (channels, frame_size // 2 + 1).
+        Frame t starts at sample t * hop - (frame_size - hop), the missing samples are zeros,
+        so every sample is covered by the same number of frames and istft restores it exactly.
+        Only batch * hop samples are in memory at once.
+        """
+
+        if not 0 < hop <= frame_size:
+            raise ValueError('the hop must be in 1..frame_size')
+
+        carry = None
+        length, emitted = 0, 0
+        for block in self.read_blocks(filename, batch * hop):
+            if carry is None:
+                carry = np.zeros((frame_size - hop, block.shape[1]))
+            length += len(block)
+            buffer = np.concatenate([carry, block])
+            count = max(0, (len(buffer) - frame_size) // hop + 1)
+            yield from self._stft_frames(buffer, count, frame_size, hop, window_type)
+            emitted += count
+            carry = buffer[count * hop:]
+
+        # trailing frames over the zeros after the last sample
+        count = self.stft_frames(length, frame_size, hop) - emitted
+        if count > 0:
+            buffer = np.zeros(((count - 1) * hop + frame_size, carry.shape[1]))
+            buffer[:len(carry)] = carry
+            yield from self._stft_frames(buffer, count, frame_size, hop, window_type)
+
+    @staticmethod
+    def _stft_frames(buffer, count, frame_size, hop, window_type):
+        if not count:
+            return
+        frames = sliding_window_view(buffer, frame_size, axis=0)[:(count - 1) * hop + 1:hop]
+        with stage('window frames'):
+            frames = apply_window(frames.astype(np.float32), window_type)
+        with stage('rfft', frames.nbytes):
+            spectra = Fourier.rfft(frames)
+        for spectrum in spectra:
+            yield spectrum
+
+    @traced
+    def istft(self, spectra, frame_size=1024, hop=256, length=None, batch=64, window_type='hann'):
+        """
+        Generator of (samples, channels) blocks restored from the stft spectra by weighted overlap-add.
+        length cuts off the zeros stft appended after the last sample.
+        """
+
+        normalization = self._stft_normalization(get_window(window_type, frame_size), hop)
 
-    def calc_dft(self, audio):
-        dft = Fourier.dft(audio.data)
-        return dft
+        tail = None
+        skip = frame_size - hop  # the zeros stft put before the first sample
+        remaining = length
+        for group in _batches(spectra, batch):
+            with stage('irfft'):
+                frames = apply_window(Fourier.irfft(np.array(group), frame_size), window_type)
+            frames = frames.transpose(0, 2, 1)  # (count, frame_size, channels)
+            if tail is None:
+                tail = np.zeros((frame_size - hop, frames.shape[2]))
 
-    def calc_idft(self, audio):
-        idft = Fourier.idft(audio.data)
-        return np.real(idft).astype(int)
+            count = len(frames)
+            segment = np.zeros((count * hop + frame_size - hop, frames.shape[2]))
+            segment[:len(tail)] = tail
+            for i, frame in enumerate(frames):
+                segment[i * hop:i * hop + frame_size] += frame
 
-    def apply_hanna_window(self, audio):
-        window = Fourier._hanna_window(audio.data)
-        return window
+            done = segment[:count * hop] / np.tile(normalization, count)[:, None]
+            tail = segment[count * hop:]
 
+            done = done[skip:]
+            skip -= min(skip, count * hop)
+            if remaining is not None:
+                done = done[:remaining]
+                remaining -= len(done)
+            if len(done):
+                yield done
+
+    @traced
+    def apply_hanna_window(self, audio, window_type='hann'):
+        """ the samples of every channel multiplied by the (symmetric) window, as float32 """
+
+        data = np.array(audio.data, dtype=np.float32).reshape(-1, audio.meta_info['num_channels'])
+        return apply_window(data, window_type, axis=0, periodic=False).ravel()
+
+    @traced
     def mu_law(self, audio, encode=True):
         new_audio = copy.copy(audio)
         processor = MuLaw()
@@ -100,6 +440,7 @@ class AudioProcessorWAVE:
             new_audio.data = processor.decode(audio.data)
         return new_audio
 
+    @traced
     def alpha_law(self, audio, encode=True):
         new_audio = copy.copy(audio)
         processor = AlphaLaw()
@@ -108,3 +449,84 @@ class AudioProcessorWAVE:
         else:
             new_audio.data = processor.decode(audio.data)
         return new_audio
+
+    @traced
+    def g711(self, audio, law='alaw', encode=True):
+        """
+        encode: PCM audio to 8-bit G.711 codes (WAVE format 6 for A-law, 7 for mu-law),
+        decode: G.711 audio to 16-bit PCM
+        """
+
+        new_audio = copy.copy(audio)
+        processor = G711(law)
+        meta_info = dict(audio.meta_info)
+        if encode:
+            new_audio.data = processor.encode(self.to_pcm16(audio.data, meta_info))
+            meta_info['audio_format'], meta_info['bits_per_sample'] = G711.WAVE_FORMATS[law], 8
+        else:
+            new_audio.data = processor.decode(audio.data)
+            meta_info['audio_format'], meta_info['bits_per_sample'] = 1, 16
+        new_audio.meta_info = self.consistent_header(meta_info, new_audio.data.nbytes)
+        return new_audio
+
+    def compand_block_(self, codec, samples, meta_info, g711, encode, work, out):
+        if g711 and encode:
+            codec.encode(self.to_pcm16(samples, meta_info), out=out)
+        elif g711:
+            codec.decode(samples, out=out)
+        else:
+            if encode:
+                codec.encode(samples, out=work)
+            else:
+                codec.decode(samples, out=work)
+            out[...] = work
+
+    @traced(files=('in', 'out'))
+    def compand_stream(self, input_filename, output_filename, law='mulaw', encode=True, g711=False,
+                       block_size=1 << 16):
+        """
+        Companding block by block: every block of samples is read into a preallocated buffer,
+        companded into another one and written out right away, so the memory does not depend on the length.
+        The continuous laws write 32-bit float samples, G.711 the same formats as g711().
+        Returns the number of samples processed.
+        """
+
+        with open(input_filename, 'rb') as audio_file:
+            meta_info = self.read_header(audio_file)
+            channels = meta_info['num_channels']
+            block_align = meta_info['block_align']
+
+            output_meta = dict(meta_info)
+            if g711:
+                codec = G711(law)
+                output_meta['audio_format'], output_meta['bits_per_sample'] = \
+                    (G711.WAVE_FORMATS[law], 8) if encode else (1, 16)
+            else:
+                codec = MuLaw() if law == 'mulaw' else AlphaLaw()
+                output_meta['audio_format'], output_meta['bits_per_sample'] = 3, 32
+            output_meta = self.consistent_header(output_meta, 0)
+
+            raw = bytearray(block_size * block_align)
+            work = np.empty(block_size * channels, dtype=np.float64)
+            out = np.empty(block_size * channels, dtype=self.sample_dtype(output_meta))
+            processed = [0]
+
+            def blocks():
+                remaining = meta_info['subchunk_2_size']
+                view = memoryview(raw)
+                while remaining > 0:
+                    size = audio_file.readinto(view[:min(len(raw), remaining)])
+                    if not size:
+                        break
+                    remaining -= size
+                    samples = self.decode_samples(view[:size - size % block_align], meta_info)
+
+                    count = len(samples)
+                    with stage('compand block', samples.nbytes):
+                        self.compand_block_(codec, samples, meta_info, g711, encode, work[:count], out[:count])
+                    processed[0] += count
+                    yield out[:count]
+
+            self.write_blocks(output_filename, output_meta, blocks())
+
+        return processed[0]
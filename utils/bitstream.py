@@ -0,0 +1,101 @@
+"""
+    Bit-level I/O over NumPy arrays. Bits are packed MSB first, codes are at most 57 bits long.
+"""
+
+import numpy as np
+
+
+MAX_CODE_LENGTH = 57
+
+
+def pack_codes(codes, lengths):
+    """
+    Args: codes and their lengths in bits
+    Return: (bytes, number of bits, bit position of every code)
+
+    Codes never overlap, so the ones falling into the same 64-bit word are simply summed,
+    a code crossing a word boundary spills its low bits into the next word.
+    """
+
+    codes = np.asarray(codes, dtype=np.uint64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if lengths.size and lengths.max() > MAX_CODE_LENGTH:
+        raise ValueError('codes longer than {} bits are not supported'.format(MAX_CODE_LENGTH))
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    bit_length = int(ends[-1]) if len(ends) else 0
+    words = np.zeros(bit_length // 64 + 2, dtype=np.uint64)
+    if not bit_length:
+        return b'', 0, starts
+
+    nonempty = lengths > 0
+    codes, lengths, positions = codes[nonempty], lengths[nonempty], starts[nonempty]
+    index = positions >> 6
+    free = 64 - (positions & 63) - lengths  # bits left in the word after the code
+
+    fits = free >= 0
+    high = np.where(fits,
+                    codes << np.where(fits, free, 0).astype(np.uint64),
+                    codes >> np.where(fits, 0, -free).astype(np.uint64))
+    groups = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    words[index[groups]] = np.add.reduceat(high, groups)
+
+    spills = np.flatnonzero(~fits)
+    words[index[spills] + 1] += codes[spills] << (64 + free[spills]).astype(np.uint64)
+
+    data = words.astype('>u8').tobytes()[:(bit_length + 7) // 8]
+    return data, bit_length, starts
+
+
+class BitWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pending = 0  # bits of the last incomplete byte
+        self.pending_bits = 0
+
+    @property
+    def bit_length(self):
+        return len(self.buffer) * 8 + self.pending_bits
+
+    def write(self, codes, lengths):
+        """ appends the codes, returns the bit position of each one """
+
+        offset = self.bit_length - self.pending_bits
+        codes = np.concatenate([[self.pending], np.asarray(codes, dtype=np.uint64)]).astype(np.uint64)
+        lengths = np.concatenate([[self.pending_bits], np.asarray(lengths, dtype=np.int64)])
+
+        data, bit_length, starts = pack_codes(codes, lengths)
+        complete = bit_length // 8
+        self.buffer += data[:complete]
+        self.pending_bits = bit_length % 8
+        self.pending = data[complete] >> (8 - self.pending_bits) if self.pending_bits else 0
+
+        return starts[1:] + offset
+
+    def getvalue(self):
+        """ the written bits, the last byte is padded with zeros """
+
+        if self.pending_bits:
+            return bytes(self.buffer) + bytes([(self.pending << (8 - self.pending_bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class BitReader:
+    def __init__(self, data):
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        self.bit_length = len(data) * 8
+
+        # words[i] holds the 8 bytes starting at byte i, so any 57 bits can be read with one lookup
+        padded = np.zeros(len(data) + 8, dtype=np.uint64)
+        padded[:len(data)] = data
+        self.words = np.zeros(len(data) + 1, dtype=np.uint64)
+        for k in range(8):
+            self.words |= padded[k:k + len(data) + 1] << np.uint64(56 - 8 * k)
+
+    def peek(self, positions, count):
+        """ the next count bits at every bit position, vectorized """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        words = self.words[positions >> 3] << (positions & 7).astype(np.uint64)
+        return (words >> np.uint64(64 - count)).astype(np.int64)
@@ -0,0 +1,135 @@
+"""
+    On-disk cache of the results of expensive operations (convolution, wavelet decomposition, DFT).
+    The key is a hash of the operation, its parameters (kernel values, levels, wavelet, ...)
+    and the bytes of the input arrays, so the same input gives the same key whatever file it came from.
+    Every result is an .npy file, a hit maps it read-only instead of reading it.
+
+    cache = ResultCache('.cache', max_bytes=1 << 30)
+    ImageProcessor(cache).convolve(image, kernel)  # computed and stored
+    ImageProcessor(cache).convolve(image, kernel)  # mapped from .cache/<key>.npy
+
+    Several processes can share the directory: a result is written to a temporary file and renamed
+    into place (os.replace is atomic), so a reader sees either no file or the complete one.
+    Above max_bytes the least recently used files are deleted, a hit updates the modification time.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+class ResultCache:
+    EXTENSION = '.npy'
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.size = None  # bytes in the directory, counted on the first store
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(operation, arrays=(), **params):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((operation, sorted(params.items()))).encode())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(repr((array.dtype.str, array.shape)).encode())
+            digest.update(memoryview(array).cast('B'))
+        return digest.hexdigest()
+
+    def path_(self, key):
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def get(self, key):
+        ''' the stored array mapped read-only, None on a miss '''
+        path = self.path_(key)
+        try:
+            result = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError):  # not stored, or evicted by another process meanwhile
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, array):
+        array = np.asarray(array)
+        if array.size == 0 or array.dtype.hasobject:  # can not be mapped
+            return
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                np.save(f, array)
+            stored = os.path.getsize(temporary)
+            os.replace(temporary, self.path_(key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        if self.size is None:
+            self.size = self.scan_()[1]
+        else:
+            self.size += stored
+        if self.size > self.max_bytes:
+            self.evict_()
+
+    def scan_(self):
+        ''' ([(modification time, size, path)] of the stored results, their total size) '''
+        entries = []
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                if entry.name.endswith(self.EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+
+    def evict_(self):
+        # other processes store into the same directory, so the sizes are counted again
+        entries, self.size = self.scan_()
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def cached(self, operation, compute, arrays=(), **params):
+        key = self.key(operation, arrays, **params)
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+
+def cached(cache, operation, compute, arrays=(), **params):
+    ''' compute() through the cache, or just compute() without one '''
+    if cache is None:
+        return compute()
+    return cache.cached(operation, compute, arrays, **params)
+
+
+def add_options(parser):
+    ''' --cache and --cache_size of the lab scripts '''
+    parser.add_option('--cache', dest='cache', action='store', default='', type='str',
+                      help='папка кэша результатов (свертка, вейвлет-разложение, ДПФ)')
+    parser.add_option('--cache_size', dest='cache_size', action='store', default=1024, type='int',
+                      help='предельный размер кэша, МБ')
+
+
+def from_options(options):
+    return ResultCache(options.cache, options.cache_size << 20) if options.cache else None
+
+
+def report(cache):
+    if cache is not None:
+        print('Кэш: попаданий {}, промахов {}, удалено файлов {}.'.format(cache.hits, cache.misses, cache.evictions))
@@ -1,44 +1,215 @@
 import heapq
 import pickle
 
+import numpy as np
+
+from .bitstream import BitReader, BitWriter
+from .match_finder import HashChainMatchFinder, SuffixArrayMatchFinder
+
 class RLECompressor:
+    """
+    Run-length coding on NumPy run boundaries.
+
+    Plain mode: compress returns (values, lengths) of the runs.
+    PackBits mode: compress returns bytes of mixed packets, a header n < 128 is followed by n + 1 literal bytes,
+    a header n > 128 by one byte repeated 257 - n times. Noisy data grows by at most one byte per 128.
+    """
+
+    MAX_PACKET = 128
+    MIN_REPEAT = 3  # shorter runs are cheaper inside a literal packet
+
+    def __init__(self, packbits=False):
+        self.packbits = packbits
+
+    @staticmethod
+    def runs(array):
+        array = np.asarray(array).ravel()
+        if not len(array):
+            return array[:0], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        starts = np.r_[0, np.flatnonzero(np.diff(array)) + 1]
+        lengths = np.diff(np.r_[starts, len(array)])
+        return array[starts], lengths, starts
+
     def compress(self, array):
-        result = []
-        counter = 1
-        for i in range(1, len(array)):
-            if array[i - 1] == array[i]:
-                counter += 1
-            else:
-                if counter == 1:
-                    result.append(array[i - 1])
-                else:
-                    result.append("%d.%s" % (counter, array[i - 1]))
-                counter = 1
+        if self.packbits:
+            return self.compress_packbits(array)
 
-        if counter == 1:
-            result.append(array[i])
-        else:
-            result.append("%d.%s" % (counter, array[i]))
-        return result
+        values, lengths, _ = self.runs(array)
+        return values, lengths
 
     def decompress(self, array):
-        result = []
-        for i in array:
-            if '.' in i:
-                counter, unit = i.split('.')
+        if self.packbits:
+            return self.decompress_packbits(array)
+
+        if isinstance(array, tuple):
+            values, lengths = array
+        else:
+            values, lengths = self.parse_tokens(array)
+        return np.repeat(np.asarray(values), np.asarray(lengths, dtype=np.int64))
+
+    @staticmethod
+    def parse_tokens(tokens):
+        """ legacy text tokens: "value" or "counter.value" """
+
+        runs = [tuple(map(int, str(token).split('.'))) for token in tokens]
+        values = np.array([run[-1] for run in runs], dtype=np.int64)
+        lengths = np.array([run[0] if len(run) == 2 else 1 for run in runs], dtype=np.int64)
+        return values, lengths
+
+    @staticmethod
+    def format_tokens(values, lengths):
+        return [str(value) if length == 1 else '%d.%d' % (length, value)
+                for value, length in zip(values.tolist(), lengths.tolist())]
+
+    @staticmethod
+    def split_packets_(starts, lengths, last_two=False):
+        """
+        Splits the segments into packets of at most MAX_PACKET elements.
+        With last_two a remainder of 1 is avoided: 128 + 1 becomes 127 + 2.
+        """
+
+        size = RLECompressor.MAX_PACKET
+        counts = (lengths + size - 1) // size
+        owner = np.repeat(np.arange(len(lengths)), counts)
+        first = np.r_[0, np.cumsum(counts)[:-1]]
+        rank = np.arange(len(owner)) - first[owner]
+
+        packet_lengths = np.full(len(owner), size, dtype=np.int64)
+        last = first + counts - 1
+        packet_lengths[last] = lengths - (counts - 1) * size
+
+        if last_two:
+            single = np.flatnonzero((packet_lengths[last] == 1) & (counts > 1))
+            packet_lengths[last[single] - 1] = size - 1
+            packet_lengths[last[single]] = 2
+
+        packet_starts = starts[owner] + rank * size
+        return packet_starts, packet_lengths
+
+    def compress_packbits(self, array):
+        array = np.asarray(array).ravel()
+        if len(array) and (array.min() < 0 or array.max() > 255):
+            raise ValueError('PackBits works on 8-bit data only')
+        array = array.astype(np.uint8)
+        if not len(array):
+            return b''
+
+        values, lengths, starts = self.runs(array)
+        repeat = lengths >= self.MIN_REPEAT
+
+        # literal segments are the maximal groups of neighbouring short runs
+        literal_runs = np.flatnonzero(~repeat)
+        if len(literal_runs):
+            new_segment = np.r_[True, np.diff(literal_runs) > 1]
+            segment_first = literal_runs[new_segment]
+            segment_last = literal_runs[np.r_[new_segment[1:], True]]
+            segment_starts = starts[segment_first]
+            segment_lengths = starts[segment_last] + lengths[segment_last] - segment_starts
+        else:
+            segment_starts = segment_lengths = np.zeros(0, dtype=np.int64)
+
+        literal_starts, literal_lengths = self.split_packets_(segment_starts, segment_lengths)
+        repeat_starts, repeat_lengths = self.split_packets_(starts[repeat], lengths[repeat], last_two=True)
+
+        packet_starts = np.r_[literal_starts, repeat_starts]
+        packet_lengths = np.r_[literal_lengths, repeat_lengths]
+        is_literal = np.r_[np.ones(len(literal_starts), dtype=bool), np.zeros(len(repeat_starts), dtype=bool)]
+        order = np.argsort(packet_starts, kind='stable')
+        packet_starts, packet_lengths, is_literal = packet_starts[order], packet_lengths[order], is_literal[order]
+
+        sizes = np.where(is_literal, packet_lengths + 1, 2)
+        offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+        out = np.empty(int(sizes.sum()), dtype=np.uint8)
+        out[offsets] = np.where(is_literal, packet_lengths - 1, 257 - packet_lengths)
+
+        out[offsets[~is_literal] + 1] = array[packet_starts[~is_literal]]
+        literal_out, literal_in = self.expand_ranges_(offsets[is_literal] + 1, packet_starts[is_literal],
+                                                      packet_lengths[is_literal])
+        out[literal_out] = array[literal_in]
+
+        return out.tobytes()
+
+    @staticmethod
+    def expand_ranges_(out_starts, in_starts, lengths):
+        """ element-wise indices of the ranges [start, start + length) """
+
+        owner = np.repeat(np.arange(len(lengths)), lengths)
+        rank = np.arange(len(owner)) - np.r_[0, np.cumsum(lengths)[:-1]][owner]
+        return out_starts[owner] + rank, in_starts[owner] + rank
+
+    def decompress_packbits(self, data):
+        data = bytes(data)
+
+        # headers have to be visited one by one, the copying is vectorized
+        positions, lengths, is_literal = [], [], []
+        i = 0
+        while i < len(data):
+            header = data[i]
+            if header < 128:
+                positions.append(i + 1)
+                lengths.append(header + 1)
+                is_literal.append(True)
+                i += header + 2
+            elif header > 128:
+                positions.append(i + 1)
+                lengths.append(257 - header)
+                is_literal.append(False)
+                i += 2
             else:
-                counter, unit = 1, i
-            result += [unit] * int(counter)
+                i += 1
+
+        source = np.frombuffer(data, dtype=np.uint8)
+        positions = np.array(positions, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+        is_literal = np.array(is_literal, dtype=bool)
+
+        out_starts = np.r_[0, np.cumsum(lengths)[:-1]].astype(np.int64)
+        result = np.empty(int(lengths.sum()), dtype=np.uint8)
+
+        repeats = ~is_literal
+        result[:] = np.repeat(np.where(repeats, source[np.minimum(positions, len(source) - 1)], 0), lengths)
+        literal_out, literal_in = self.expand_ranges_(out_starts[is_literal], positions[is_literal],
+                                                      lengths[is_literal])
+        result[literal_out] = source[literal_in]
+
         return result
 
 
 class LZ77Compressor:
     DEFAULT_WINDOW_SIZE = 64
+    DEFAULT_CHAIN_DEPTH = 16
+    MATCH_FINDERS = ('legacy', 'hash', 'suffix')
+
+    def __init__(self, window_size=DEFAULT_WINDOW_SIZE, match_finder='hash', chain_depth=DEFAULT_CHAIN_DEPTH):
+        if match_finder not in self.MATCH_FINDERS:
+            raise ValueError('unknown match finder: {}'.format(match_finder))
 
-    def __init__(self, window_size=DEFAULT_WINDOW_SIZE):
         self.window_size_ = window_size
         self.look_ahead_buf_size = self.window_size_ // 3
         self.search_buf_size = self.window_size_ - self.look_ahead_buf_size
+        self.match_finder = match_finder
+        self.chain_depth = chain_depth
+
+    def make_match_finder_(self):
+        if self.match_finder == 'hash':
+            return HashChainMatchFinder(self.window_size_, self.look_ahead_buf_size, self.chain_depth)
+        return SuffixArrayMatchFinder(self.window_size_, self.look_ahead_buf_size, self.chain_depth)
+
+    @staticmethod
+    def to_bytes_(array):
+        if isinstance(array, (bytes, bytearray)):
+            return bytes(array)
+        if isinstance(array, str):
+            try:
+                return array.encode('latin-1')
+            except UnicodeEncodeError:
+                raise ValueError('LZ77 match finders work on 8-bit data only')
+
+        array = np.asarray(array)
+        if array.size and (array.min() < 0 or array.max() > 255):
+            raise ValueError('LZ77 match finders work on 8-bit data only')
+        return array.astype(np.uint8).tobytes()
 
     def find_in_buffer_(self, data, current_position):
         end_of_buffer = min(current_position + self.look_ahead_buf_size, len(data) + 1)
@@ -74,6 +245,9 @@ class LZ77Compressor:
         return None
 
     def compress(self, array):
+        if self.match_finder != 'legacy':
+            return self.compress_with_finder_(array)
+
         i = 0
         output_buffer = []
         while i < len(array):
@@ -89,22 +263,41 @@ class LZ77Compressor:
                 i += 1
         return output_buffer
 
+    def compress_with_finder_(self, array):
+        data = self.to_bytes_(array)
+        finder = self.make_match_finder_()
+        finder.reset(data)
+
+        i = 0
+        output_buffer = []
+        while i < len(data):
+            match = finder.find(i)
+            if match:
+                (bestMatchDistance, bestMatchLength) = match
+                output_buffer.append('{}.{}'.format(bestMatchDistance, bestMatchLength))
+                i += bestMatchLength
+            else:
+                output_buffer.append('{}.{}.{}'.format(0, 0, data[i]))
+                i += 1
+        return output_buffer
+
     def decompress(self, array):
         result = []
-        ar = list(array)
-        counter = 0
-        while len(ar):
-            current_symbol = ar.pop(0).split('.')
-            counter += 1
+        for token in array:
+            current_symbol = token if isinstance(token, tuple) else token.split('.')
             if len(current_symbol) == 3:
                 distance, length, symbol = current_symbol
                 if int(distance) == 0 and int(length) == 0:
-                    result += [symbol]
+                    result.append(symbol)
             else:
                 distance, length = list(map(int, current_symbol))
-                max = len(result)
-                symbol = result[max - distance: min(max, max - distance + length)]
-                result += symbol
+                start = len(result) - distance
+                if length <= distance:
+                    result += result[start:start + length]
+                else:
+                    # the match overlaps the data it produces, e.g. a long run of one value
+                    for k in range(length):
+                        result.append(result[start + k])
 
         return result
 
@@ -126,18 +319,40 @@ class HeapNode:
 
 
 class HuffmanCompressor:
+    """
+    Canonical Huffman coder over integer symbols.
+
+    The payload is bit-packed MSB first, its first byte holds the number of padding bits
+    at the end (1..8), which is the layout of the text format as well.
+    Decoding is table driven: ROOT_BITS bits are looked up at once, longer codes go
+    through a second-level table. When the bit position of every block_size-th symbol is known,
+    all blocks are decoded simultaneously, one NumPy step per symbol of a block. A step costs about
+    as much as 20 symbols decoded one after another, so the block is sized to give about LANES blocks
+    (short streams, e.g. stripes, get short blocks), and streams of fewer than MIN_BLOCKS blocks
+    are decoded one symbol after another.
+    """
+
+    ROOT_BITS = 11
+    BLOCK_SIZE = 4096  # the longest block
+    MIN_BLOCK_SIZE = 256  # a bit offset costs about 2 bytes, 1% of a block of 8-bit symbols
+    LANES = 64
+    MIN_BLOCKS = 16
+
     def __init__(self, root=None):
         self.heap = []
         self.codes = {}
         self.reverse_mapping = {}
+        self.block_size = self.BLOCK_SIZE
+        self.offsets = None  # bit positions of every block_size-th symbol after compress
+
+    def make_frequency_dict(self, array):
+        if len(array) and 0 <= array.min() and array.max() < 1 << 20:
+            counts = np.bincount(array)
+            symbols = np.flatnonzero(counts)
+            return dict(zip(symbols.tolist(), counts[symbols].tolist()))
 
-    def make_frequency_dict(self, text):
-        frequency = {}
-        for character in text:
-            if character not in frequency:
-                frequency[character] = 0
-            frequency[character] += 1
-        return frequency
+        symbols, counts = np.unique(array, return_counts=True)
+        return dict(zip(symbols.tolist(), counts.tolist()))
 
     def make_heap(self, frequency_dict):
         for key in frequency_dict.keys():
@@ -155,91 +370,206 @@ class HuffmanCompressor:
 
     def make_codes_helper(self, root, current_code):
         if root:
-            if root.char:
+            if root.left is None and root.right is None:
                 self.codes[root.char] = current_code
-                self.reverse_mapping[current_code] = root.char
                 return
 
             self.make_codes_helper(root.left, current_code + "0")
             self.make_codes_helper(root.right, current_code + "1")
 
     def make_codes(self):
+        self.codes = {}
+        self.reverse_mapping = {}
         root = heapq.heappop(self.heap)
         current_code = ""
         self.make_codes_helper(root, current_code)
 
-    def get_encoded_text(self, array):
-        encoded_text = ""
-        for character in array:
-            encoded_text += self.codes[character]
-        return encoded_text
-
-    def pad_encoded_text(self, encoded_text):
-        extra_padding = 8 - len(encoded_text) % 8
-        for i in range(extra_padding):
-            encoded_text += "0"
-
-        padded_info = "{0:08b}".format(extra_padding)
-        encoded_text = padded_info + encoded_text
-        return encoded_text
-
-    def get_byte_array(self, padded_encoded_text):
-        if len(padded_encoded_text) % 8 != 0:
-            exit(0)
-
-        b = []
-        for i in range(0, len(padded_encoded_text), 8):
-            byte = padded_encoded_text[i:i + 8]
-            b.append(int(byte, 2))
-
-        return b
+        # only the code lengths have to be stored, the codes are restored from them
+        lengths = {char: max(1, len(code)) for char, code in self.codes.items()}
+        self.set_code_lengths(lengths)
+
+    @staticmethod
+    def canonical_codes(code_lengths):
+        """ canonical Huffman codes: shorter codes first, symbols of the same length in ascending order """
+
+        codes = {}
+        code, previous_length = 0, 0
+        for symbol, length in sorted(code_lengths.items(), key=lambda item: (item[1], item[0])):
+            code <<= length - previous_length
+            codes[symbol] = format(code, '0{}b'.format(length))
+            code += 1
+            previous_length = length
+        return codes
+
+    def set_code_lengths(self, code_lengths):
+        self.codes = self.canonical_codes(code_lengths)
+        self.reverse_mapping = {code: symbol for symbol, code in self.codes.items()}
+
+    @staticmethod
+    def to_symbols_(array):
+        if isinstance(array, str):
+            return np.frombuffer(array.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        return np.asarray(array, dtype=np.int64).ravel()
 
     def compress(self, array):
-        frequency = self.make_frequency_dict(array)
-        self.make_heap(frequency)
+        """
+        Args: sequence of non-negative integers (a string is taken as its character codes)
+        Return: (payload bytes, {code: symbol})
+        """
+
+        array = self.to_symbols_(array)
+        self.heap = []
+        self.make_heap(self.make_frequency_dict(array))
         self.merge_nodes()
         self.make_codes()
 
-        encoded_text = self.get_encoded_text(array)
-        padded_encoded_text = self.pad_encoded_text(encoded_text)
-
-        result = self.get_byte_array(padded_encoded_text)
-        inv_map = {v: k for k, v in self.codes.items()}
-
-        return (result, inv_map)
-
-    def remove_padding(self, padded_encoded_text):
-        padded_info = padded_encoded_text[:8]
-        extra_padding = int(padded_info, 2)
-
-        padded_encoded_text = padded_encoded_text[8:]
-        encoded_text = padded_encoded_text[:-1 * extra_padding]
-
-        return encoded_text
-
-    def decode_text(self, encoded_text):
-        current_code = ""
-        decoded_text = []
-
-        for bit in encoded_text:
-            current_code += bit
-            if (current_code in self.reverse_mapping):
-                character = self.reverse_mapping[current_code]
-                decoded_text.append(character)
-                current_code = ""
-
-        return decoded_text
-
-    def decompress(self, array):
-        bit_string = ""
-        i = 0
-        while i < len(array):
-            byte = int(array[i])
-            bits = bin(byte)[2:].rjust(8, '0')
-            bit_string += bits
-            i += 1
+        symbols = np.array(sorted(self.codes), dtype=np.int64)
+        codes = np.array([int(self.codes[symbol], 2) for symbol in symbols.tolist()], dtype=np.uint64)
+        lengths = np.array([len(self.codes[symbol]) for symbol in symbols.tolist()], dtype=np.int64)
+        if symbols[-1] < 1 << 20:
+            lookup = np.zeros(symbols[-1] + 1, dtype=np.int64)
+            lookup[symbols] = np.arange(len(symbols))
+            index = lookup[array]
+        else:
+            index = np.searchsorted(symbols, array)
+
+        writer = BitWriter()
+        starts = writer.write(codes[index], lengths[index])
+        extra_padding = 8 - writer.bit_length % 8
+        self.block_size = self.block_size_for(len(array))
+        self.offsets = starts[::self.block_size]
+
+        result = bytes([extra_padding]) + writer.getvalue()
+        if extra_padding == 8:
+            result += bytes(1)
+
+        return (result, dict(self.reverse_mapping))
+
+    @classmethod
+    def block_size_for(cls, count):
+        """ the block size that cuts count symbols into about LANES blocks """
+        return int(min(cls.BLOCK_SIZE, max(cls.MIN_BLOCK_SIZE, -(-count // cls.LANES))))
+
+    def make_tables_(self):
+        """ root table for codes up to ROOT_BITS bits, second-level tables for the longer ones """
+
+        items = [(int(code, 2), len(code), symbol) for code, symbol in self.reverse_mapping.items()]
+        max_length = max(length for _, length, _ in items)
+        root_bits = min(self.ROOT_BITS, max_length)
+        sub_bits = max_length - root_bits
+
+        root_symbol = np.zeros(1 << root_bits, dtype=np.int64)
+        root_length = np.zeros(1 << root_bits, dtype=np.int64)
+        root_sub = np.full(1 << root_bits, -1, dtype=np.int64)
+        subtables = {}
+
+        for code, length, symbol in items:
+            if length <= root_bits:
+                first = code << (root_bits - length)
+                root_symbol[first:first + (1 << (root_bits - length))] = symbol
+                root_length[first:first + (1 << (root_bits - length))] = length
+            else:
+                prefix = code >> (length - root_bits)
+                if prefix not in subtables:
+                    subtables[prefix] = len(subtables)
+                    root_sub[prefix] = subtables[prefix]
+
+        sub_symbol = np.zeros(len(subtables) << sub_bits, dtype=np.int64)
+        sub_length = np.zeros(len(subtables) << sub_bits, dtype=np.int64)
+        for code, length, symbol in items:
+            if length > root_bits:
+                rest_bits = length - root_bits
+                base = subtables[code >> rest_bits] << sub_bits
+                first = base + ((code & ((1 << rest_bits) - 1)) << (sub_bits - rest_bits))
+                sub_symbol[first:first + (1 << (sub_bits - rest_bits))] = symbol
+                sub_length[first:first + (1 << (sub_bits - rest_bits))] = length
+
+        return root_bits, sub_bits, root_symbol, root_length, root_sub, sub_symbol, sub_length
+
+    def decode_blocks_(self, reader, tables, offsets, count, block_size):
+        root_bits, sub_bits, root_symbol, root_length, root_sub, sub_symbol, sub_length = tables
+
+        # one lookup per step: symbol and length packed together, zero marks a long code
+        root_entry = np.where(root_sub >= 0, 0, (root_symbol << 6) | root_length)
+        words = reader.words
+        root_shift, three, seven = np.uint64(64 - root_bits), np.uint64(3), np.uint64(7)
+
+        positions = np.array(offsets, dtype=np.uint64)
+        lanes = len(positions)
+        last_count = count - (lanes - 1) * block_size
+        result = np.zeros((block_size, lanes), dtype=np.int64)
+
+        for step in range(block_size):
+            if step == last_count:
+                lanes -= 1
+                positions = positions[:lanes]
+                if not lanes:
+                    break
+
+            window = ((words[positions >> three] << (positions & seven)) >> root_shift).astype(np.int64)
+            entry = root_entry[window]
+
+            long = np.flatnonzero(entry == 0)
+            if len(long):
+                sub_positions = positions[long].astype(np.int64) + root_bits
+                sub_entry = (root_sub[window[long]] << sub_bits) + reader.peek(sub_positions, sub_bits)
+                entry[long] = (sub_symbol[sub_entry] << 6) | sub_length[sub_entry]
+
+            result[step, :lanes] = entry >> 6
+            positions += (entry & 63).astype(np.uint64)
+
+        return result.T.ravel()[:count]
+
+    def decode_stream_(self, data, tables, bit_length):
+        """ one symbol after another, for streams without block offsets """
+
+        root_bits, sub_bits, root_symbol, root_length, root_sub, sub_symbol, sub_length = tables
+        root_symbol, root_length, root_sub = root_symbol.tolist(), root_length.tolist(), root_sub.tolist()
+        sub_symbol, sub_length = sub_symbol.tolist(), sub_length.tolist()
+        max_length = root_bits + sub_bits
+        root_mask, sub_mask = (1 << root_bits) - 1, (1 << sub_bits) - 1
 
-        encoded_text = self.remove_padding(bit_string)
-        decompressed_text = self.decode_text(encoded_text)
+        result = []
+        buffer, buffered, i, position = 0, 0, 0, 0
+        while position < bit_length:
+            while buffered < max_length:
+                buffer = (buffer << 8) | (data[i] if i < len(data) else 0)
+                buffered += 8
+                i += 1
 
-        return decompressed_text
+            window = (buffer >> (buffered - root_bits)) & root_mask
+            length = root_length[window]
+            if length:
+                result.append(root_symbol[window])
+            else:
+                if root_sub[window] < 0:
+                    raise ValueError('corrupted Huffman stream')
+                entry = (root_sub[window] << sub_bits) + ((buffer >> (buffered - max_length)) & sub_mask)
+                length = sub_length[entry]
+                if not length:
+                    raise ValueError('corrupted Huffman stream')
+                result.append(sub_symbol[entry])
+
+            buffered -= length
+            buffer &= (1 << buffered) - 1
+            position += length
+
+        return np.array(result, dtype=np.int64)
+
+    def decompress(self, array, count=None, offsets=None, block_size=BLOCK_SIZE):
+        """
+        Args: payload bytes, reverse_mapping must be set;
+              count and offsets (see compress) enable the parallel block decoder
+        Return: array of symbols
+        """
+
+        data = bytes(bytearray(array))
+        extra_padding = data[0]
+        data = data[1:]
+        bit_length = len(data) * 8 - extra_padding
+        tables = self.make_tables_()
+
+        if count is not None and offsets is not None and len(offsets) >= self.MIN_BLOCKS:
+            return self.decode_blocks_(BitReader(data), tables, offsets, count, block_size)
+
+        return self.decode_stream_(data, tables, bit_length)
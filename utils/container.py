@@ -0,0 +1,302 @@
+"""
+    Binary container for compressed images.
+
+    Layout, all integers are unsigned LEB128 varints unless noted:
+        magic            4 bytes, b'AOMC'
+        version          1 byte
+        flags            1 byte, a reader must reject bits it does not know, see FLAG_*
+        method           1 byte, see METHODS
+        color_mode       1 byte, 2 for PGM, 3 for PPM
+        width, height, maxval
+        params count, params...
+        channels count
+        for every channel: section length, section bytes
+
+    Sections:
+        rle      runs count, run lengths, run values;
+                 with params [1] the section is PackBits packets as they are
+        lz77     tokens count, (distance, length) pairs, a literal is stored as (0, value)
+        huffman  symbols count, symbols, canonical code lengths,
+                 [FLAG_HUFFMAN_INDEX: symbols decoded, block size, blocks count, deltas of block bit offsets]
+                 payload length, payload bytes (the first byte holds the padding size)
+        wavelet  length of the first part, huffman section of the run values, huffman section of the run lengths
+                 of the quantized coefficients, both with the index under FLAG_HUFFMAN_INDEX; params: wavelet, levels, step * 256, threshold * 256,
+                 color transform, see utils/wavelet_codec.py
+        arith    samples count, range coder payload; params: model order, see utils/arithmetic.py
+
+    With FLAG_PREDICTION the pixels were replaced by prediction residuals (utils/prediction.py) and every
+    channel section starts with: length of the predictors part, rle section of the predictor of every row.
+
+    With FLAG_STRIPES every channel is cut into stripes of rows coded independently, a channel section is:
+        rows per stripe, stripes count, section length of every stripe (the offsets table),
+        the sections of the stripes, each one as a channel section above
+"""
+
+import io
+import struct
+
+import numpy as np
+
+
+MAGIC = b'AOMC'
+VERSION = 1
+METHODS = {'rle': 1, 'lz77': 2, 'huffman': 3, 'wavelet': 4, 'arith': 5}
+METHOD_NAMES = {value: key for key, value in METHODS.items()}
+FLAG_HUFFMAN_INDEX = 0x01  # huffman sections carry the bit offset of every block of symbols
+FLAG_PREDICTION = 0x02  # sections carry the row predictors, the channels are residuals
+FLAG_STRIPES = 0x04  # channels are split into stripes of rows with a table of their offsets
+KNOWN_FLAGS = FLAG_HUFFMAN_INDEX | FLAG_PREDICTION | FLAG_STRIPES
+HEADER_SIZE = 256  # read at once, the fields before the sections take less
+
+
+def encode_varints(values):
+    """ LEB128 encoding of a sequence of non-negative integers """
+
+    values = np.asarray(values, dtype=np.uint64).ravel()
+    if values.size == 0:
+        return b''
+
+    sizes = np.ones(values.size, dtype=np.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= np.uint64(1 << shift)
+
+    starts = np.zeros(values.size, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+
+    for k in range(int(sizes.max())):
+        mask = sizes > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = np.where(sizes[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[mask] + k] = (chunk | more).astype(np.uint8)
+
+    return out.tobytes()
+
+
+def decode_varints(buffer, offset, count):
+    """ returns (array of count integers, offset after the last one) """
+
+    if count == 0:
+        return np.zeros(0, dtype=np.int64), offset
+
+    data = np.frombuffer(buffer, dtype=np.uint8, offset=offset)[:10 * count]  # at most 10 bytes per value
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) < count:
+        raise ValueError('truncated container')
+    ends = ends[:count]
+    data = data[:ends[-1] + 1].astype(np.uint64)
+
+    starts = np.zeros(count, dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    group = np.repeat(np.arange(count), ends - starts + 1)
+    shift = (np.arange(len(data)) - starts[group]) * 7
+    values = np.add.reduceat((data & np.uint64(0x7F)) << shift.astype(np.uint64), starts)
+
+    return values.astype(np.int64), offset + len(data)
+
+
+def decode_varint(buffer, offset):
+    values, offset = decode_varints(buffer, offset, 1)
+    return int(values[0]), offset
+
+
+def write_rle_section(runs):
+    lengths, values = runs
+    return encode_varints([len(lengths)]) + encode_varints(lengths) + encode_varints(values)
+
+
+def read_rle_section(buffer):
+    count, offset = decode_varint(buffer, 0)
+    lengths, offset = decode_varints(buffer, offset, count)
+    values, offset = decode_varints(buffer, offset, count)
+    return lengths, values
+
+
+def write_lz77_section(pairs):
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return encode_varints([len(pairs)]) + encode_varints(pairs)
+
+
+def read_lz77_section(buffer):
+    count, offset = decode_varint(buffer, 0)
+    pairs, offset = decode_varints(buffer, offset, 2 * count)
+    return pairs.reshape(-1, 2)
+
+
+def write_huffman_section(code_lengths, payload, index=None):
+    """ index is (symbols decoded, block size, block bit offsets), written with FLAG_HUFFMAN_INDEX """
+
+    symbols = sorted(code_lengths)
+    section = (encode_varints([len(symbols)]) + encode_varints(symbols)
+               + encode_varints([code_lengths[symbol] for symbol in symbols]))
+    if index is not None:
+        count, block_size, offsets = index
+        section += encode_varints([count, block_size, len(offsets)]) + encode_varints(np.diff(offsets, prepend=0))
+    return section + encode_varints([len(payload)]) + bytes(bytearray(payload))
+
+
+def read_huffman_section(buffer, indexed=False):
+    """ returns (code lengths, payload, index or None) """
+
+    count, offset = decode_varint(buffer, 0)
+    symbols, offset = decode_varints(buffer, offset, count)
+    lengths, offset = decode_varints(buffer, offset, count)
+
+    index = None
+    if indexed:
+        (decoded, block_size, blocks), offset = decode_varints(buffer, offset, 3)
+        deltas, offset = decode_varints(buffer, offset, blocks)
+        index = int(decoded), int(block_size), np.cumsum(deltas)
+
+    size, offset = decode_varint(buffer, offset)
+    payload = buffer[offset:offset + size]
+    return dict(zip(symbols.tolist(), lengths.tolist())), payload, index
+
+
+def write_wavelet_section(values, lengths, indexed=False):
+    """ values and lengths are (payload, {code: symbol}, index) of the Huffman coded runs """
+
+    values_section, lengths_section = [
+        write_huffman_section({symbol: len(code) for code, symbol in mapping.items()}, payload,
+                              index if indexed else None)
+        for payload, mapping, index in (values, lengths)]
+    return encode_varints([len(values_section)]) + values_section + lengths_section
+
+
+def read_wavelet_section(buffer, indexed=False):
+    """ returns (code lengths, payload, index or None) of the run values and of the run lengths """
+
+    size, offset = decode_varint(buffer, 0)
+    values = read_huffman_section(buffer[offset:offset + size], indexed)
+    lengths = read_huffman_section(buffer[offset + size:], indexed)
+    return values, lengths
+
+
+def write_arith_section(payload, count):
+    return encode_varints([count]) + payload
+
+
+def read_arith_section(buffer):
+    """ returns (payload, samples count) """
+
+    count, offset = decode_varint(buffer, 0)
+    return buffer[offset:], count
+
+
+def write_prediction_section(runs, section):
+    """ runs (lengths, values) of the predictors of the rows, then the section of the channel """
+
+    predictors = write_rle_section(runs)
+    return encode_varints([len(predictors)]) + predictors + section
+
+
+def read_prediction_section(buffer):
+    """ returns (predictor of every row, the section of the channel) """
+
+    size, offset = decode_varint(buffer, 0)
+    lengths, values = read_rle_section(buffer[offset:offset + size])
+    return np.repeat(values, lengths), buffer[offset + size:]
+
+
+def write_striped_section(stripe_rows, sections):
+    return (encode_varints([stripe_rows, len(sections)]) + encode_varints([len(section) for section in sections])
+            + b''.join(sections))
+
+
+def read_varints_(stream, count, limit):
+    """ count integers from the stream, at most limit bytes are read, the stream is left right after them """
+
+    position = stream.tell()
+    values, offset = decode_varints(stream.read(min(limit, 10 * count)), 0, count)
+    stream.seek(position + offset)
+    return values.tolist()
+
+
+def read_striped_section(stream, size, rows=None):
+    """
+    Reads the striped section of size bytes at the position of the stream.
+    rows: (start, stop) of the rows needed, only the stripes over them are read, the others are skipped
+    returns (rows per stripe, index of the first stripe returned, sections of the stripes)
+    """
+
+    end = stream.tell() + size
+    stripe_rows, count = read_varints_(stream, 2, size)
+    sizes = read_varints_(stream, count, end - stream.tell())
+    offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+
+    first, last = 0, count
+    if rows is not None:
+        first = min(max(rows[0], 0) // stripe_rows, count)
+        last = max(min(-(-rows[1] // stripe_rows), count), first)
+    stream.seek(offsets[first], io.SEEK_CUR)
+    data = stream.read(offsets[last] - offsets[first])
+    offsets -= offsets[first]
+    return stripe_rows, first, [data[offsets[index]:offsets[index + 1]] for index in range(first, last)]
+
+
+def is_container(filename):
+    with open(filename, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+
+def write(stream, method, color_mode, width, height, maxval, params, sections, flags=0):
+    """ sections are already encoded channel sections (bytes) """
+
+    stream.write(MAGIC)
+    stream.write(struct.pack('BBBB', VERSION, flags, METHODS[method], color_mode))
+    stream.write(encode_varints([width, height, maxval, len(params)] + list(params) + [len(sections)]))
+    for section in sections:
+        stream.write(encode_varints([len(section)]))
+        stream.write(section)
+
+
+def read(stream, rows=None):
+    """
+    returns a dict with the header fields and the list of raw channel sections;
+    with FLAG_STRIPES a channel is the list of the sections of its stripes, and rows (start, stop)
+    reads only the stripes over these rows: the offsets tables are read, the other stripes are skipped
+    """
+
+    start = stream.tell()
+    buffer = stream.read(HEADER_SIZE)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a compressed image container')
+
+    offset = len(MAGIC)
+    version, flags, method, color_mode = struct.unpack_from('BBBB', buffer, offset)
+    offset += 4
+    if version > VERSION:
+        raise ValueError('unsupported container version: {}'.format(version))
+    if flags & ~KNOWN_FLAGS:
+        raise ValueError('unsupported container flags: {:#x}'.format(flags))
+    if method not in METHOD_NAMES:
+        raise ValueError('unknown compression method: {}'.format(method))
+
+    (width, height, maxval, params_count), offset = decode_varints(buffer, offset, 4)
+    params, offset = decode_varints(buffer, offset, params_count)
+    channels_count, offset = decode_varint(buffer, offset)
+
+    stream.seek(start + offset)
+    sections, stripe_rows, first_stripe = [], None, 0
+    for _ in range(channels_count):
+        size, = read_varints_(stream, 1, 10)
+        end = stream.tell() + size
+        if flags & FLAG_STRIPES:
+            stripe_rows, first_stripe, stripes = read_striped_section(stream, size, rows)
+            sections.append(stripes)
+        else:
+            sections.append(stream.read(size))
+        stream.seek(end)
+
+    return {
+        'method': METHOD_NAMES[method],
+        'flags': flags,
+        'color_mode': color_mode,
+        'width': int(width),
+        'height': int(height),
+        'maxval': int(maxval),
+        'params': params.tolist(),
+        'sections': sections,
+        'stripe_rows': stripe_rows,
+        'first_stripe': first_stripe,
+    }
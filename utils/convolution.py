@@ -1,37 +1,197 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .fourier_transform import Fourier
 
 
 class Convolution:
-    def __init__(self, kernel):
+    """
+    Circular 2D convolution: image[i - m][j - n] wraps around the top and left borders.
+    The image is either a (height, width) matrix or a (height, width, channels) array,
+    in which case all channels are processed in one batched operation.
+    """
+
+    STRATEGIES = ('auto', 'direct', 'separable', 'fft')
+    DIRECT_MAX_TAPS = 49  # up to 7x7 the exact tap-by-tap accumulation is the fastest
+    SEPARABLE_TOLERANCE = 1e-9
+    NEAR_INTEGER_TOLERANCE = 1e-6  # separable and FFT results this close to an integer are summed again tap by tap
+
+    def __init__(self, kernel, strategy='auto'):
+        if strategy not in self.STRATEGIES:
+            raise ValueError('unknown convolution strategy: {}'.format(strategy))
+
         self.kernel = kernel
+        self.strategy = strategy
 
         if max([max(line) for line in self.kernel]) > 1. or min([min(line) for line in self.kernel]) < 1.:
             self.normalize_kernel()
 
     def __call__(self, image):
-        def get_pixel(image, i, j):
-            res = 0
-            for m in range(len(self.kernel)):
-                for n in range(len(self.kernel[0])):
-                    res += self.kernel[m][n] * image[i - m][j - n]
-            return int(res)
-
-        shift = np.min(self.kernel) < 0
-        res = []
-        for i in range(image.shape[0]):
-            tmp = []
-            for j in range(image.shape[1]):
-                tmp.append(get_pixel(image, i, j))
-            res.append(np.array(tmp))
-
-        res = np.array(res)
-        if shift:
-            res = ((res - res.min()) * (1 / (res.max() - res.min()) * 255)).astype(
-                'uint8')  # in case of negative values in kernel
+        image = np.asarray(image)
+        strategy = self.choose_strategy(image)
+
+        if strategy == 'separable':
+            res = self.convolve_separable(image)
+        elif strategy == 'fft':
+            res = self.convolve_fft(image)
+        else:
+            res = self.convolve_direct(image)
+
+        return self.finish(res)
+
+    def finish(self, res):
+        """ float convolution to integer pixels """
+
+        res = np.trunc(res).astype(np.int64)
+        if np.min(self.kernel) < 0:
+            res = self.rescale(res)  # in case of negative values in kernel
             # res += 128  (another option, loses colors)
 
         return res
 
+    def choose_strategy(self, image):
+        kernel = np.asarray(self.kernel, dtype=float)
+        if kernel.shape[0] > image.shape[0] or kernel.shape[1] > image.shape[1]:
+            return 'direct'
+
+        if self.strategy != 'auto':
+            if self.strategy == 'separable' and self.separate_kernel() is None:
+                return 'direct'
+            return self.strategy
+
+        if kernel.size <= self.DIRECT_MAX_TAPS:
+            return 'direct'
+        if self.separate_kernel() is not None:  # kh + kw taps per pixel instead of kh * kw
+            return 'separable'
+        return 'fft'
+
+    def separate_kernel(self):
+        """ returns (column, row) vectors if the kernel is their outer product, None otherwise """
+
+        kernel = np.asarray(self.kernel, dtype=float)
+        u, s, vt = np.linalg.svd(kernel)
+        if len(s) > 1 and s[1] > self.SEPARABLE_TOLERANCE * s[0]:
+            return None
+        return u[:, 0] * s[0], vt[0]
+
+    @property
+    def halo(self):
+        """ (rows above, columns to the left) of every output pixel the kernel reaches """
+
+        return len(self.kernel) - 1, len(self.kernel[0]) - 1
+
+    @staticmethod
+    def _wrap_pad(image, top, left):
+        pad = [(top, 0), (left, 0)] + [(0, 0)] * (image.ndim - 2)
+        return np.pad(image, pad, mode='wrap')
+
+    def convolve_padded(self, padded, strategy):
+        """
+        Convolution of a block already extended by the halo on the top and the left,
+        the result is the block without the halo. Used for tiles of a larger image.
+        """
+
+        if strategy == 'separable':
+            return self.separable_padded_(padded)
+        if strategy == 'fft':
+            top, left = self.halo
+            res = self.circular_fft_(padded)[top:, left:]  # the circular wrap only reaches the halo
+            return self.exact_near_integers_(res, lambda: padded)
+        return self.direct_padded_(padded)
+
+    def convolve_direct(self, image):
+        return self.direct_padded_(self._wrap_pad(image.astype(float), *self.halo))
+
+    def direct_padded_(self, padded):
+        """
+        Sums kernel taps over shifted views of the wrap-padded image.
+        The taps are accumulated in the same order as the original per-pixel loop,
+        so the result matches it bit for bit.
+        """
+
+        kernel = np.asarray(self.kernel, dtype=float)
+        kh, kw = kernel.shape
+        windows = sliding_window_view(padded.astype(float, copy=False), (kh, kw), axis=(0, 1))
+
+        res = np.zeros(windows.shape[:-2], dtype=float)
+        tap = np.empty(res.shape, dtype=float)
+        for m in range(kh):
+            for n in range(kw):
+                np.multiply(windows[..., kh - 1 - m, kw - 1 - n], self.kernel[m][n], out=tap)
+                res += tap
+        return res
+
+    def convolve_separable(self, image):
+        return self.separable_padded_(self._wrap_pad(image.astype(float), *self.halo))
+
+    def separable_padded_(self, padded):
+        column, row = self.separate_kernel()
+        top, left = self.halo
+        height, width = padded.shape[0] - top, padded.shape[1] - left
+
+        padded = padded.astype(float, copy=False)
+        columns = np.zeros((height, ) + padded.shape[1:], dtype=float)
+        tap = np.empty(columns.shape, dtype=float)
+        for m, value in enumerate(column):
+            np.multiply(padded[top - m:top - m + height], value, out=tap)
+            columns += tap
+
+        res = np.zeros((height, width) + padded.shape[2:], dtype=float)
+        tap = np.empty(res.shape, dtype=float)
+        for n, value in enumerate(row):
+            np.multiply(columns[:, left - n:left - n + width], value, out=tap)
+            res += tap
+        return self.exact_near_integers_(res, lambda: padded)
+
+    def convolve_fft(self, image):
+        res = self.circular_fft_(image)
+        return self.exact_near_integers_(res, lambda: self._wrap_pad(image.astype(float), *self.halo))
+
+    def circular_fft_(self, image):
+        height, width = image.shape[:2]
+        kernel = np.zeros((height, width), dtype=float)
+        kernel[:len(self.kernel), :len(self.kernel[0])] = self.kernel
+        if image.ndim > 2:
+            kernel = kernel.reshape(kernel.shape + (1,) * (image.ndim - 2))
+
+        spectrum = Fourier.fft2(image.astype(float)) * Fourier.fft2(kernel)
+        return Fourier.ifft2(spectrum, (height, width))
+
+    def exact_near_integers_(self, res, padded):
+        """
+        The separable and FFT results differ from the tap-by-tap sum by ~1e-12 (other summation order,
+        SVD factors), which changes the truncated pixel only next to an integer (12.9999999 or 13.0000001).
+        These pixels are summed again in the order of the direct path, so the output is the same.
+        padded() gives the image extended by the halo.
+        """
+
+        ambiguous = np.nonzero(np.abs(res - np.rint(res)) < self.NEAR_INTEGER_TOLERANCE)
+        if not len(ambiguous[0]):
+            return res
+
+        padded = np.ascontiguousarray(padded(), dtype=float)
+        top, left = self.halo
+        strides = np.array(padded.strides) // padded.itemsize
+        flat = padded.ravel()
+        base = np.ravel_multi_index((ambiguous[0] + top, ambiguous[1] + left) + ambiguous[2:], padded.shape)
+        exact = np.zeros(len(base), dtype=float)
+        tap = np.empty(len(base), dtype=float)
+        for m in range(len(self.kernel)):
+            for n in range(len(self.kernel[0])):
+                np.multiply(flat.take(base - m * strides[0] - n * strides[1]), self.kernel[m][n], out=tap)
+                exact += tap
+        res[ambiguous] = exact
+        return res
+
+    @staticmethod
+    def rescale(res):
+        """ stretches every channel to 0..255 """
+
+        axes = (0, 1)
+        low = res.min(axis=axes, keepdims=True)
+        high = res.max(axis=axes, keepdims=True)
+        return ((res - low) * (1 / (high - low) * 255)).astype('uint8')
+
     def normalize_kernel(self):
         s = np.sum(np.abs(self.kernel))
         self.kernel = [[value / s for value in line] for line in self.kernel]
@@ -1,42 +1,181 @@
 import numpy as np
-from functools import partial
-from multiprocessing import Pool
 
 
-def _idft_calc(u, data):
-    return sum([data[x] * (np.cos(2 * np.pi * u * x / len(data)) + np.sin(2 * np.pi * u * x / len(data)) * 1j) for x in range(len(data))])
+def _smallest_factor(n):
+    factor = 2
+    while factor * factor <= n:
+        if n % factor == 0:
+            return factor
+        factor += 1
+    return n
 
 
-def _hanna_func(n, data):
-    return .5 * (1 - np.cos(2. * np.pi * data[n] / len(data)))
+def _twiddles(rows, columns, n):
+    """ exp(-2j pi r c / n) for r < rows, c < columns; the product is reduced mod n to keep the precision """
+
+    exponent = np.outer(np.arange(rows), np.arange(columns)) % n
+    return np.exp(-2j * np.pi * exponent / n)
+
+
+def _direct(x):
+    """ O(n^2) transform of every row, only for short rows """
+
+    return x @ _twiddles(x.shape[-1], x.shape[-1], x.shape[-1])
+
+
+def _radix2(x):
+    """ iterative radix-2 transform of every row, the length is a power of two """
+
+    batch, n = x.shape
+    first = min(n, Fourier.DIRECT_SIZE)
+
+    # transforms of length `first` of every decimated subsequence, then butterflies
+    result = np.einsum('kn,bnm->bkm', _twiddles(first, first, first), x.reshape(batch, first, n // first))
+    while result.shape[1] < n:
+        half = result.shape[2] // 2
+        even, odd = result[:, :, :half], result[:, :, half:]
+        factor = np.exp(-1j * np.pi * np.arange(result.shape[1]) / result.shape[1])[None, :, None]
+        odd = odd * factor
+        result = np.concatenate([even + odd, even - odd], axis=1)
+
+    return result.reshape(batch, n)
+
+
+def _mixed_radix(x, factor):
+    """ one decimation-in-time step: `factor` interleaved transforms of length n / factor """
+
+    batch, n = x.shape
+    m = n // factor
+
+    sub = x.reshape(batch, m, factor).transpose(0, 2, 1).reshape(batch * factor, m)
+    sub = _fft(sub).reshape(batch, factor, m)
+    sub *= _twiddles(factor, m, n)[None]
+    return np.einsum('qr,brk->bqk', _twiddles(factor, factor, factor), sub).reshape(batch, n)
+
+
+def _bluestein(x):
+    """ transform of any length as a convolution with a chirp, computed by power-of-two transforms """
+
+    batch, n = x.shape
+    size = 1 << (2 * n - 2).bit_length()
+
+    k = np.arange(n)
+    chirp = np.exp(-1j * np.pi * ((k * k) % (2 * n)) / n)
+
+    a = np.zeros((batch, size), dtype=complex)
+    a[:, :n] = x * chirp
+    b = np.zeros((1, size), dtype=complex)
+    b[0, :n] = np.conj(chirp)
+    b[0, size - n + 1:] = np.conj(chirp[1:])[::-1]
+
+    spectrum = _radix2(a) * _radix2(b)
+    convolution = np.conj(_radix2(np.conj(spectrum))) / size
+    return convolution[:, :n] * chirp
+
+
+def _fft(x):
+    """ transform of every row of a 2D complex array """
+
+    n = x.shape[-1]
+    if n <= Fourier.DIRECT_SIZE:
+        return _direct(x)
+    if n & (n - 1) == 0:
+        return _radix2(x)
+
+    factor = _smallest_factor(n)
+    if factor > Fourier.MAX_RADIX:
+        return _bluestein(x)
+    return _mixed_radix(x, factor)
 
 
 class Fourier:
+    DIRECT_SIZE = 16  # rows up to this length are multiplied by the DFT matrix
+    MAX_RADIX = 13  # larger prime factors go through Bluestein's algorithm
+
+    @staticmethod
+    def fft(data, axis=-1):
+        """ fast fourier transform, O(N log N) for any length """
+
+        data = np.moveaxis(np.asarray(data, dtype=complex), axis, -1)
+        shape = data.shape
+        if not shape[-1]:
+            return np.moveaxis(data.copy(), -1, axis)
+
+        result = _fft(data.reshape(-1, shape[-1]))
+        return np.moveaxis(result.reshape(shape), -1, axis)
+
+    @staticmethod
+    def ifft(data, axis=-1):
+        """ inversed fast fourier transform """
+
+        data = np.asarray(data, dtype=complex)
+        return np.conj(Fourier.fft(np.conj(data), axis)) / data.shape[axis]
+
+    @staticmethod
+    def rfft(data, axis=-1):
+        """ transform of real data, returns the N // 2 + 1 non-negative frequencies """
+
+        data = np.moveaxis(np.asarray(data, dtype=float), axis, -1)
+        n = data.shape[-1]
+        if n % 2 or n < 2:
+            return np.moveaxis(Fourier.fft(data)[..., :n // 2 + 1], -1, axis)
+
+        # even and odd samples packed into one complex transform of half the length
+        half = Fourier.fft(data[..., 0::2] + 1j * data[..., 1::2])
+        k = np.arange(n // 2 + 1)
+        z = half[..., k % (n // 2)]
+        z_mirror = np.conj(half[..., (-k) % (n // 2)])
+        even = (z + z_mirror) / 2
+        odd = (z - z_mirror) / 2j
+        return np.moveaxis(even + np.exp(-2j * np.pi * k / n) * odd, -1, axis)
+
+    @staticmethod
+    def irfft(data, n=None, axis=-1):
+        """ inversed transform of rfft output, n is the length of the signal """
+
+        data = np.moveaxis(np.asarray(data, dtype=complex), axis, -1)
+        if n is None:
+            n = 2 * (data.shape[-1] - 1)
+
+        if n % 2 or n < 2:
+            k = np.arange(n)
+            mirror = np.minimum((n - k) % n, n // 2)
+            full = np.where(k <= n // 2, data[..., np.minimum(k, n // 2)], np.conj(data[..., mirror]))
+            return np.moveaxis(np.real(Fourier.ifft(full)), -1, axis)
+
+        k = np.arange(n // 2)
+        x = data[..., k]
+        x_mirror = np.conj(data[..., n // 2 - k])
+        even = (x + x_mirror) / 2
+        odd = (x - x_mirror) / 2 * np.exp(2j * np.pi * k / n)
+        z = Fourier.ifft(even + 1j * odd)
+
+        result = np.empty(data.shape[:-1] + (n,))
+        result[..., 0::2] = np.real(z)
+        result[..., 1::2] = np.imag(z)
+        return np.moveaxis(result, -1, axis)
+
     @staticmethod
     def dft(data):
         """ discrete fourier transform """
 
-        data = np.array(data).astype(float)
-        N = len(data)
-        n = np.arange(N)
-        k = n.reshape((N, 1))
-        M = np.exp(-2j * np.pi * k * n / N)
-        return np.dot(M, data)
+        return Fourier.fft(data)
 
     @staticmethod
     def idft(data):
         """ inversed discrete fourier transform """
 
-        with Pool() as pool:
-            result = pool.map(partial(_idft_calc, data=data), range(len(data)))
+        return Fourier.ifft(data)
+
+    @staticmethod
+    def fft2(data):
+        """ 2D fast fourier transform of real data over the first two axes """
 
-        return result
+        return np.fft.rfft2(data, axes=(0, 1))
 
     @staticmethod
-    def _hanna_window(data):
-        """ applies hanna window function """
+    def ifft2(data, shape):
+        """ inversed 2D fast fourier transform, returns real data of the given (height, width) """
 
-        with Pool() as pool:
-            result = pool.map(partial(_hanna_func, data=data), range(len(data)))
+        return np.fft.irfft2(data, s=shape, axes=(0, 1))
 
-        return result
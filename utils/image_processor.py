@@ -1,335 +1,693 @@
+import multiprocessing
+
 import numpy as np
 
+from . import container, prediction
+from .arithmetic import ArithmeticCompressor
+from .cache import cached
 from .compression import RLECompressor, LZ77Compressor, HuffmanCompressor
 from .convolution import Convolution
-from .wavelet import HaarWavelet
+from .profiling import stage, traced
+from .tiling import TileScheduler
+from .wavelet import LiftingWavelet, WaveletPyramid
+from .wavelet_codec import WaveletCompressor
 
 
 class RAWImage:
-    def __init__(self, color_mode, height, width, pixels_raw):
+    '''
+    Pixels are kept as planes: a (channels, height, width) array, one channel for PGM, three for PPM.
+    The planes are either contiguous (results of the operations) or a strided view of interleaved
+    [y][x][c] pixels (a binary file is mapped as it is), to_matrix() and pixels_raw give
+    the interleaved layout, as views whenever the memory allows.
+    '''
+    def __init__(self, color_mode, height, width, pixels_raw=None, maxval=255, binary=False, planes=None):
         self.color_mode = color_mode
         self.height = height
         self.width = width
-        self.pixels_raw = pixels_raw
+        self.maxval = maxval
+        self.binary = binary
+        if planes is not None:
+            self.planes = planes
+        else:
+            self.pixels_raw = pixels_raw
+
+    @classmethod
+    def from_planes(cls, planes, maxval=255, binary=False):
+        ''' planes: (channels, height, width) array, not copied '''
+        channels, height, width = planes.shape
+        return cls(3 if channels == 3 else 2, height, width, maxval=maxval, binary=binary, planes=planes)
+
+    @classmethod
+    def from_matrix(cls, matrix, maxval=255, binary=False):
+        ''' matrix: (height, width) or interleaved (height, width, channels) array, not copied '''
+        matrix = np.asarray(matrix)
+        if matrix.ndim == 2:
+            return cls.from_planes(matrix[None], maxval, binary)
+        return cls.from_planes(matrix.transpose(2, 0, 1), maxval, binary)
+
+    @property
+    def channels(self):
+        return 3 if self.color_mode == 3 else 1
+
+    @property
+    def pixels_raw(self):
+        ''' flat interleaved pixels, a copy only if the planes are contiguous and there are several '''
+        return self.to_matrix().ravel()
+
+    @pixels_raw.setter
+    def pixels_raw(self, pixels):
+        self.planes = np.asarray(pixels).reshape(self.height, self.width, self.channels).transpose(2, 0, 1)
 
     def to_matrix(self):
         if self.color_mode == 3:
-            return self.pixels_raw.reshape(self.height, self.width, 3)
+            return self.planes.transpose(1, 2, 0)
         elif self.color_mode == 2:
-            return self.pixels_raw.reshape(self.height, self.width)
+            return self.planes[0]
+
+
+class CompressedImage:
+    def __init__(self, color_mode, height, width, channels, compressor=None, params=(), maxval=255,
+                 predictors=None, stripe_rows=None, first_stripe=0):
+        '''
+        With stripe_rows every channel is a list of independently coded stripes of that many rows
+        (and predictors a list per stripe), first_stripe is the index of the first one kept
+        when only some rows were read
+        '''
+        self.color_mode = color_mode
+        self.height = height
+        self.width = width
+        self.channels = channels  # one token list per color channel
+        self.compressor = compressor  # rle | lz77 | huffman, unknown for legacy text files
+        self.params = list(params)
+        self.maxval = maxval
+        self.predictors = predictors  # (channels, height) predictor of every row if the channels are residuals
+        self.stripe_rows = stripe_rows
+        self.first_stripe = first_stripe
+
+    @property
+    def first_row(self):
+        ''' the row of the image the decompressed pixels start with '''
+        return self.first_stripe * self.stripe_rows if self.stripe_rows else 0
+
+    def stripes(self):
+        ''' [(channel, row predictors or None) of every stripe] of every channel '''
+        result = []
+        for index, channel in enumerate(self.channels):
+            stripes = channel if self.stripe_rows else [channel]
+            if self.predictors is None:
+                kinds = [None] * len(stripes)
+            else:
+                kinds = self.predictors[index] if self.stripe_rows else [self.predictors[index]]
+            result.append(list(zip(stripes, kinds)))
+        return result
+
+
+def _compress_stripe(task):
+    ''' the work of a process: (coded channel, row predictors or None) of one stripe of a channel '''
+    compressor, pixels, maxval, predictor, to_bytes, with_dict = task
+    kinds = None
+    if predictor is not None:
+        with stage('predict', pixels.nbytes):
+            residuals, kinds = prediction.forward(pixels[None], maxval, predictor)
+            pixels, kinds = residuals[0], kinds[0]
+
+    channel = pixels.ravel()  # copies only interleaved pixels
+    with stage('compress channel', channel.nbytes):
+        if with_dict:
+            # Huffman case
+            compressed, mapping = compressor.compress(channel)
+            return (compressed, mapping, (len(channel), compressor.block_size, compressor.offsets)), kinds
+
+        if to_bytes:
+            channel = ''.join(list(map(chr, channel)))
+        return compressor.compress(channel), kinds
+
+
+def _decompress_stripe(task):
+    compressor, channel, with_dict, kinds, shape, maxval = task
+    with stage('decompress channel') as current:
+        if with_dict:
+            # Huffman case
+            payload, mapping, index = channel
+            compr = HuffmanCompressor()
+            compr.reverse_mapping = mapping
+            if index is None:
+                decoded = compr.decompress(payload)
+            else:
+                count, block_size, offsets = index
+                decoded = compr.decompress(payload, count, offsets, block_size)
+        else:
+            decoded = compressor.decompress(channel)
+            if isinstance(decoded, np.ndarray):
+                decoded = decoded.astype(np.int64)
+            else:
+                decoded = np.array(list(map(int, decoded)), dtype=np.int64)
+        current.bytes_out = decoded.nbytes
+
+    pixels = decoded.reshape(shape)
+    if kinds is not None:
+        with stage('unpredict', pixels.nbytes):
+            pixels = prediction.inverse(pixels[None], kinds[None], maxval)[0]
+    return pixels
 
 
 class ImageProcessor:
-    def read(self, filename, compressed=False):
+    MAGIC_NUMBERS = {b'P2': (2, False), b'P3': (3, False), b'P5': (2, True), b'P6': (3, True)}
+
+    def __init__(self, cache=None):
+        ''' cache: utils.cache.ResultCache of the results of convolve, haar_encode and haar_decode '''
+        self.cache = cache
+
+    @staticmethod
+    def read_header(stream):
         '''
-        Args: image name
-        Return: 2D or 3D list of pixels in [y][x][c] format (c is optional)
+        Args: binary stream positioned at the beginning of a PNM file
+        Return: (magic number, width, height, maxval), the stream is left at the first pixel byte
+
+        Comments may appear anywhere in the header, they last till the end of the line.
+        '''
+        tokens = []
+        token = b''
+        while len(tokens) < 4:
+            char = stream.read(1)
+            if not char:
+                raise ValueError('unexpected end of file in the image header')
+
+            if char == b'#':
+                while char not in (b'\n', b'\r', b''):
+                    char = stream.read(1)
+
+            if char.isspace():
+                if token:
+                    tokens.append(token)
+                    token = b''
+            else:
+                token += char
+
+        magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+        if magic not in ImageProcessor.MAGIC_NUMBERS:
+            raise ValueError('unsupported image format: {}'.format(magic.decode('ascii', 'replace')))
+        if not 0 < maxval < 65536:
+            raise ValueError('invalid maxval: {}'.format(maxval))
 
-        Read PPM or PGM image.
+        return magic, width, height, maxval
+
+    @traced(files=('in', ))
+    def read(self, filename, compressed=False, rows=None):
+        '''
+        Args: image name, compressed: the file was written by write_container or write_compressed,
+              rows: (start, stop) rows needed of a striped container, see read_container
+        Return: RAWImage with the flat list of pixels in [y][x][c] order (c is optional),
+                CompressedImage for compressed files
+
+        Read PPM or PGM image, either plain (P2, P3) or binary (P5, P6).
         FOR PGM:
-        Returns 2D matrix, where each value is a greyscale value in 0..255
+        Each value is a greyscale value in 0..maxval
 
         For PPM:
-        Returns 3D matrix, where each value is a color channel value in 0.255
+        Each triple is a color channel value in 0..maxval
         0 for red
         1 for green
         2 for blue
-        '''
-        with open(filename, 'r') as ppm_file:
-            lines = ppm_file.readlines()
-
-        color_mode = int(lines[0][1])  # which matrix to read, 2d or 3d
 
-        if lines[1][0] == "#":
-            offset = 1
-        else:
-            offset = 0
-
-        size = lines[1 + offset].split()
-        width, height = int(size[0]), int(size[1])
-        print("width={}, height={}, colors={}".format(width, height, color_mode))
-        content = lines[3 + offset:]
-
-        if not compressed:
-            allValues = np.array([[int(v) for v in value.split()] for value in content]).flatten()
-            image = RAWImage(color_mode, height, width, allValues)
-            return image
-
-        else:
-            allValues = np.array([[v for v in value.split()] for value in content]).flatten()
-            image = RAWImage(color_mode, height, width, allValues)
-            return image
+        Binary images are memory-mapped, the pixels are not copied until they are modified.
+        '''
+        if compressed and container.is_container(filename):
+            return self.read_container(filename, rows)
+
+        with open(filename, 'rb') as ppm_file:
+            magic, width, height, maxval = self.read_header(ppm_file)
+            offset = ppm_file.tell()
+            color_mode, binary = self.MAGIC_NUMBERS[magic]
+            print("width={}, height={}, colors={}".format(width, height, color_mode))
+
+            if not binary:
+                content = ppm_file.read()
+
+        if binary:
+            dtype = np.uint8 if maxval < 256 else np.dtype('>u2')
+            channels = 3 if color_mode == 3 else 1
+            allValues = np.memmap(filename, dtype=dtype, mode='c', offset=offset,
+                                  shape=(height * width * channels,))
+            return RAWImage(color_mode, height, width, allValues, maxval=maxval, binary=True)
+
+        if compressed:
+            return self.read_compressed_text_(content, color_mode, height, width, maxval)
+
+        with stage('parse pixels', len(content)):
+            dtype = float if b'.' in content or b'e' in content else np.int64
+            allValues = np.fromstring(content, dtype=dtype, sep=' ')
+        image = RAWImage(color_mode, height, width, allValues, maxval=maxval)
+        return image
 
-    def write(self, filename, image):
+    @traced(files=('out', ))
+    def write(self, filename, image, binary=None):
         '''
-        Args: image name, image data, where image in PPM or PGM formats
+        Args: image name, image data, where image in PPM or PGM formats,
+              binary: write P5/P6 instead of P2/P3, defaults to the format the image was read from
         Return: none
         '''
+        if binary is None:
+            binary = image.binary
 
         mtrx = image.to_matrix()
+        channels = 3 if image.color_mode == 3 else 1
+
+        with open(filename, 'wb') as ppm_file:
+            ppm_file.write(b"P%d\n" % (image.color_mode + 3 if binary else image.color_mode))
+            ppm_file.write(b"%d %d\n" % (image.width, image.height))
+            ppm_file.write(b"%d\n" % image.maxval)
+
+            if binary:
+                dtype = np.uint8 if image.maxval < 256 else np.dtype('>u2')
+                with stage('encode pixels', mtrx.nbytes):
+                    content = np.clip(mtrx, 0, image.maxval).astype(dtype).tobytes()
+                ppm_file.write(content)
+            else:
+                fmt = '%d' if np.issubdtype(mtrx.dtype, np.integer) else '%.8g'
+                with stage('format pixels', mtrx.nbytes):
+                    np.savetxt(ppm_file, mtrx.reshape(-1, channels), fmt=fmt)
 
-        if image.color_mode == 3:
-            plain_text = '\n'.join(['\n'.join(
-                [' '.join(str(mtrx[y][x][c]) for c in range(mtrx.shape[2]))
-                 for x in range(mtrx.shape[1])])
-                for y in range(mtrx.shape[0])])
-        else:
-            plain_text = '\n'.join(['\n'.join(
-                [str(mtrx[y][x]) for x in range(mtrx.shape[1])])
-                for y in range(mtrx.shape[0])])
+    def read_compressed_text_(self, content, color_mode, height, width, maxval):
+        lines = [line.split() for line in content.decode('ascii').splitlines()]
 
-        with open(filename, 'w') as ppm_file:
-            ppm_file.write("P%d\n" % image.color_mode)
-            ppm_file.write(str(image.width) + " " + str(image.height) + "\n")
-            ppm_file.write("255\n")
-            ppm_file.write(plain_text)
-            ppm_file.write('\n')
+        if len(lines) > 1 and lines[1] and ':' in lines[1][0]:
+            # Huffman case: every channel is a line of bytes followed by a line of code:value pairs
+            channels = []
+            for payload, dictionary in zip(lines[::2], lines[1::2]):
+                mapping = {item.split(':')[0]: int(item.split(':')[1]) for item in dictionary}
+                channels.append((bytes(map(int, payload)), mapping, None))
+            return CompressedImage(color_mode, height, width, channels, compressor='huffman', maxval=maxval)
+
+        return CompressedImage(color_mode, height, width, lines, maxval=maxval)
 
+    @traced(files=('out', ))
     def write_compressed(self, filename, image):
-        plain_text = ' '.join([str(pixel) for pixel in image.pixels_raw])
-        plain_text = plain_text.replace(' \n ', '\n')
+        '''
+        Legacy plain text format: channels are separated by newlines, tokens by spaces.
+        '''
+        lines = []
+        if image.predictors is not None or image.stripe_rows:
+            raise ValueError('images with prediction or stripes can only be written to the binary container')
+        for channel in image.channels:
+            if image.compressor == 'huffman':
+                payload, mapping = channel[:2]
+                lines.append(' '.join(str(byte) for byte in payload))
+                lines.append(' '.join('{}:{}'.format(code, mapping[code]) for code in mapping))
+            elif isinstance(channel, (bytes, bytearray)):
+                raise ValueError('PackBits images can only be written to the binary container')
+            elif image.compressor in ('arith', 'wavelet'):
+                raise ValueError('{} images can only be written to the binary container'.format(image.compressor))
+            elif isinstance(channel, tuple):
+                # RLE runs
+                lines.append(' '.join(RLECompressor.format_tokens(*channel)))
+            else:
+                lines.append(' '.join(self.format_token_(token) for token in channel))
 
         with open(filename, 'w') as ppm_file:
             ppm_file.write("P%d\n" % image.color_mode)
             ppm_file.write('%d %d\n' % (image.width, image.height))
-            ppm_file.write("255\n")
-            ppm_file.write(plain_text)
+            ppm_file.write("%d\n" % image.maxval)
+            ppm_file.write('\n'.join(lines))
             ppm_file.write('\n')
 
-    def compress_image_(self, image, compressor, to_bytes=False, with_dict=False):
-        def compress_channel(channel):
-            channel = list(channel)
-
-            if with_dict:
-                # Huffman case
-                channel = ''.join(list(map(chr, channel)))
-                compressed, dict = compressor.compress(channel)
-                dict = ['{}:{}'.format(key, ord(dict[key])) for key in dict.keys()]
-                return compressed + ['\n'] + dict
-
-            if to_bytes:
-                channel = ''.join(list(map(chr, channel)))
-                return compressor.compress(channel)
-
-            return compressor.compress(channel)
-
-        if image.color_mode == 2:
-            new_image = RAWImage(
-                color_mode=image.color_mode,
-                height=image.height,
-                width=image.width,
-                pixels_raw=compress_channel(image.pixels_raw)
-            )
-            return new_image
-
-        if image.color_mode == 3:
-            mtrx = image.to_matrix()
-            red_channel = mtrx[:, :, 0].flatten()
-            green_channel = mtrx[:, :, 1].flatten()
-            blue_channel = mtrx[:, :, 2].flatten()
-
-            red_compressed = compress_channel(red_channel)
-            green_compressed = compress_channel(green_channel)
-            blue_compressed = compress_channel(blue_channel)
-
-            encoded = red_compressed + ['\n'] + green_compressed + ['\n'] + blue_compressed
-            new_image = RAWImage(
-                color_mode=image.color_mode,
-                height=image.height,
-                width=image.width,
-                pixels_raw=encoded
-            )
-            return new_image
-
-    def decompress_image_(self, image, compressor, with_dict=False):
-        def decompress_channel(channel, dictionary=None):
-            if dictionary:
-                # Huffman case
-                compr = HuffmanCompressor()
-                compr.reverse_mapping = {item.split(':')[0]: item.split(':')[1] for item in dictionary}
-                actual_pixels = compr.decompress(channel)
-                return list(map(int, actual_pixels))
-
-            channel = list(channel)
-            if type(channel[0]) in (str, np.str_, np.int64):
-                return list(map(int, compressor.decompress(channel)))
-            else:
-                return list(map(ord, compressor.decompress(channel)))
+    @staticmethod
+    def format_token_(token):
+        if isinstance(token, tuple):
+            return '.'.join(str(value) for value in token)
+        return str(token)
+
+    @staticmethod
+    def parse_token_(token):
+        if isinstance(token, tuple):
+            return token
+        if isinstance(token, str):
+            return tuple(int(value) for value in token.split('.'))
+        return (int(token),)
+
+    def channel_to_section_(self, compressor, channel, flags=0):
+        if compressor == 'rle':
+            if isinstance(channel, (bytes, bytearray)):
+                return bytes(channel)  # PackBits packets as they are
+            values, lengths = channel if isinstance(channel, tuple) else RLECompressor.parse_tokens(channel)
+            return container.write_rle_section((lengths, values))
+
+        if compressor == 'lz77':
+            pairs = [token[1:] if len(token) == 3 else token for token in map(self.parse_token_, channel)]
+            return container.write_lz77_section(pairs)
+
+        if compressor == 'wavelet':
+            return container.write_wavelet_section(*channel, indexed=flags & container.FLAG_HUFFMAN_INDEX)
+
+        if compressor == 'arith':
+            return container.write_arith_section(*channel)
+
+        payload, mapping, index = channel
+        code_lengths = {symbol: len(code) for code, symbol in mapping.items()}
+        if not flags & container.FLAG_HUFFMAN_INDEX:
+            index = None
+        return container.write_huffman_section(code_lengths, payload, index)
+
+    def section_to_channel_(self, compressor, section, flags=0, params=()):
+        if compressor == 'rle':
+            if self.is_packbits_(params):
+                return section
+            lengths, values = container.read_rle_section(section)
+            return values, lengths
+
+        if compressor == 'lz77':
+            pairs = container.read_lz77_section(section).tolist()
+            return [(0, 0, second) if first == 0 else (first, second) for first, second in pairs]
+
+        if compressor == 'wavelet':
+            return tuple((payload, {code: symbol for symbol, code in HuffmanCompressor.canonical_codes(lengths).items()},
+                          index)
+                         for lengths, payload, index in container.read_wavelet_section(
+                             section, flags & container.FLAG_HUFFMAN_INDEX))
+
+        if compressor == 'arith':
+            return container.read_arith_section(section)
+
+        code_lengths, payload, index = container.read_huffman_section(section, flags & container.FLAG_HUFFMAN_INDEX)
+        codes = HuffmanCompressor.canonical_codes(code_lengths)
+        return payload, {code: symbol for symbol, code in codes.items()}, index
+
+    @traced(files=('out', ))
+    def write_container(self, filename, image):
+        '''
+        Args: file name, CompressedImage
+        Return: none
 
-        if image.color_mode == 2:
-            if with_dict:
-                pixels_raw = np.array(decompress_channel(image.pixels_raw[0], image.pixels_raw[1]))
-            else:
-                pixels_raw = np.array(decompress_channel(image.pixels_raw))
-
-            new_image = RAWImage(
-                color_mode=image.color_mode,
-                height=image.height,
-                width=image.width,
-                pixels_raw=pixels_raw
-            )
-            return new_image
-
-        if image.color_mode == 3:
-            if with_dict:
-                red_channel, red_dict, green_channel, green_dict, blue_channel, blue_dict = image.pixels_raw
-                red_decoded = decompress_channel(red_channel, red_dict)
-                green_decoded = decompress_channel(green_channel, green_dict)
-                blue_decoded = decompress_channel(blue_channel, blue_dict)
+        Writes the compact binary container, see utils/container.py.
+        '''
+        stripes = image.stripes()
+        flags = 0
+        if image.compressor in ('huffman', 'wavelet'):
+            streams = [channel for channel_stripes in stripes for channel, _ in channel_stripes]
+            if image.compressor == 'wavelet':
+                streams = [stream for channel in streams for stream in channel]  # run values and run lengths
+            if all(stream[2] is not None for stream in streams):
+                flags |= container.FLAG_HUFFMAN_INDEX
+        if image.predictors is not None:
+            flags |= container.FLAG_PREDICTION
+        if image.stripe_rows:
+            flags |= container.FLAG_STRIPES
+
+        with stage('pack sections') as packing:
+            sections = []
+            for channel_stripes in stripes:
+                stripe_sections = []
+                for channel, kinds in channel_stripes:
+                    section = self.channel_to_section_(image.compressor, channel, flags)
+                    if kinds is not None:
+                        values, lengths, _ = RLECompressor.runs(kinds)
+                        section = container.write_prediction_section((lengths, values), section)
+                    stripe_sections.append(section)
+                if image.stripe_rows:
+                    sections.append(container.write_striped_section(image.stripe_rows, stripe_sections))
+                else:
+                    sections.append(stripe_sections[0])
+            packing.bytes_out = sum(map(len, sections))
+        with open(filename, 'wb') as output:
+            container.write(output, image.compressor, image.color_mode, image.width, image.height,
+                            image.maxval, image.params, sections, flags)
+
+    @traced(files=('in', ))
+    def read_container(self, filename, rows=None):
+        '''
+        rows: (start, stop), of a striped container only the stripes over these rows are read,
+              the image decompresses to the rows from its first_row on
+        '''
+        with open(filename, 'rb') as stream:
+            header = container.read(stream, rows)
+
+        print("width={}, height={}, colors={}".format(header['width'], header['height'], header['color_mode']))
+        method, flags, params = header['method'], header['flags'], header['params']
+
+        def unpack(section):
+            kinds = None
+            if flags & container.FLAG_PREDICTION:
+                kinds, section = container.read_prediction_section(section)
+            return self.section_to_channel_(method, section, flags, params), kinds
+
+        stripe_rows, first_stripe = header['stripe_rows'], header['first_stripe']
+        sections = header['sections']
+        striped = flags & container.FLAG_STRIPES
+        with stage('unpack sections', sum(map(len, sum(sections, []) if striped else sections))):
+            if striped:
+                channels, predictors = [], []
+                for stripe_sections in sections:
+                    channel_stripes = [unpack(stripe_section) for stripe_section in stripe_sections]
+                    channels.append([channel for channel, _ in channel_stripes])
+                    predictors.append([kinds for _, kinds in channel_stripes])
             else:
-                red_channel, green_channel, blue_channel = image.pixels_raw
-                red_decoded = decompress_channel(red_channel)
-                green_decoded = decompress_channel(green_channel)
-                blue_decoded = decompress_channel(blue_channel)
-
-            pixels_raw = np.array(
-                [[red_decoded[i], green_decoded[i], blue_decoded[i]] for i in range(len(red_decoded))]).flatten()
-            new_image = RAWImage(
-                color_mode=image.color_mode,
-                height=image.height,
-                width=image.width,
-                pixels_raw=pixels_raw,
-            )
-            return new_image
-
-    def compress_rle(self, image):
-        compressor = RLECompressor()
-        return self.compress_image_(image, compressor)
-
-    def decompress_rle(self, image):
-        compressor = RLECompressor()
-        return self.decompress_image_(image, compressor)
-
-    def compress_lz77(self, image, window_size):
-        compressor = LZ77Compressor(window_size)
-        return self.compress_image_(image, compressor, to_bytes=True)
+                unpacked = [unpack(section) for section in sections]
+                channels = [channel for channel, _ in unpacked]
+                predictors = [kinds for _, kinds in unpacked]
+                if flags & container.FLAG_PREDICTION:
+                    predictors = np.stack(predictors)
+        return CompressedImage(header['color_mode'], header['height'], header['width'], channels,
+                               compressor=method, params=params, maxval=header['maxval'],
+                               predictors=predictors if flags & container.FLAG_PREDICTION else None,
+                               stripe_rows=stripe_rows, first_stripe=first_stripe)
+
+    @staticmethod
+    def map_(function, tasks, processes=1):
+        ''' function over the tasks in order, on a process pool unless processes is 1 (None - all cores) '''
+        if processes == 1 or len(tasks) < 2:
+            return list(map(function, tasks))
+        with multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(tasks))) as pool:
+            return pool.map(function, tasks, chunksize=1)
+
+    def compress_image_(self, image, compressor, name, params=(), to_bytes=False, with_dict=False, predictor=None,
+                        stripe_rows=None, processes=1):
+        '''
+        predictor: one of utils.prediction.PREDICTORS or 'adaptive', the channels are coded as residuals then
+        stripe_rows: every channel is cut into stripes of that many rows coded independently,
+                     so they can be decoded in parallel or alone
+        processes: the channels (or stripes) are coded on a process pool
+        '''
+        rows = stripe_rows or image.height
+        with stage('split channels', image.planes.nbytes):
+            tasks = [(compressor, plane[top:top + rows], image.maxval, predictor, to_bytes, with_dict)
+                     for plane in image.planes for top in range(0, max(image.height, 1), rows)]
+        results = self.map_(_compress_stripe, tasks, processes)
+
+        count = len(results) // len(image.planes)
+        stripes = [results[index:index + count] for index in range(0, len(results), count)]
+        if stripe_rows:
+            channels = [[channel for channel, _ in channel_stripes] for channel_stripes in stripes]
+            predictors = [[kinds for _, kinds in channel_stripes] for channel_stripes in stripes]
+        else:
+            channels = [channel_stripes[0][0] for channel_stripes in stripes]
+            predictors = np.stack([channel_stripes[0][1] for channel_stripes in stripes]) if predictor else None
 
-    def decompress_lz77(self, image, window_size):
+        return CompressedImage(
+            color_mode=image.color_mode,
+            height=image.height,
+            width=image.width,
+            channels=channels,
+            compressor=name,
+            params=params,
+            maxval=image.maxval,
+            predictors=predictors if predictor else None,
+            stripe_rows=stripe_rows or None
+        )
+
+    def decompress_image_(self, image, compressor, with_dict=False, processes=1):
+        '''
+        Return: RAWImage of the rows from image.first_row on that the image holds (all of them unless
+                only some stripes were read)
+        '''
+        rows = image.stripe_rows or image.height
+        stripes = image.stripes()
+        tasks = []
+        for channel_stripes in stripes:
+            for index, (channel, kinds) in enumerate(channel_stripes, image.first_stripe):
+                height = min(rows, image.height - index * rows)
+                tasks.append((compressor, channel, with_dict, kinds, (height, image.width), image.maxval))
+        decoded = self.map_(_decompress_stripe, tasks, processes)
+
+        count = len(stripes[0])
+        planes = np.stack([np.concatenate(decoded[index:index + count])
+                           for index in range(0, len(decoded), count)])
+        return RAWImage.from_planes(planes, image.maxval)
+
+    @staticmethod
+    def is_packbits_(params):
+        return list(params[:1]) == [1]
+
+    @traced
+    def compress_rle(self, image, packbits=False, predictor=None, stripe_rows=None, processes=1):
+        compressor = RLECompressor(packbits)
+        return self.compress_image_(image, compressor, 'rle', params=[int(packbits)], predictor=predictor,
+                                    stripe_rows=stripe_rows, processes=processes)
+
+    @traced
+    def decompress_rle(self, image, processes=1):
+        compressor = RLECompressor(self.is_packbits_(image.params))
+        return self.decompress_image_(image, compressor, processes=processes)
+
+    @traced
+    def compress_lz77(self, image, window_size, match_finder='hash', chain_depth=LZ77Compressor.DEFAULT_CHAIN_DEPTH,
+                      predictor=None, stripe_rows=None, processes=1):
+        compressor = LZ77Compressor(window_size, match_finder, chain_depth)
+        return self.compress_image_(image, compressor, 'lz77', params=[window_size], to_bytes=True,
+                                    predictor=predictor, stripe_rows=stripe_rows, processes=processes)
+
+    @traced
+    def decompress_lz77(self, image, window_size, processes=1):
         compressor = LZ77Compressor(window_size)
-        return self.decompress_image_(image, compressor)
+        return self.decompress_image_(image, compressor, processes=processes)
 
-    def compress_huffman(self, image):
+    @traced
+    def compress_huffman(self, image, predictor=None, stripe_rows=None, processes=1):
         compressor = HuffmanCompressor()
-        return self.compress_image_(image, compressor, with_dict=True)
+        return self.compress_image_(image, compressor, 'huffman', with_dict=True, predictor=predictor,
+                                    stripe_rows=stripe_rows, processes=processes)
 
-    def decompress_huffman(self, image):
+    @traced
+    def decompress_huffman(self, image, processes=1):
         compressor = HuffmanCompressor()
-        return self.decompress_image_(image, compressor, with_dict=True)
-
-    def convolve(self, image, kernel):
-        processor = Convolution(kernel)
-
-        def process(channel):
-            mtrx = np.array(channel).reshape(image.height, image.width)
-            new_mtrx = processor(mtrx)
-            return np.array(new_mtrx).flatten()
-
-        if image.color_mode == 2:
-            pixels_raw = process(image.pixels_raw)
-
-        if image.color_mode == 3:
-            green_channel = [image.pixels_raw[i] for i in range(1, image.height * image.width * 3, 3)]
-            blue_channel = [image.pixels_raw[i] for i in range(2, image.height * image.width * 3, 3)]
-            red_convolved = process(red_channel)
-            green_convolved = process(green_channel)
-            blue_convolved = process(blue_channel)
-            pixels_raw = np.array(
-                [[red_convolved[i], green_convolved[i], blue_convolved[i]] for i in
-                 range(len(red_convolved))]).flatten()
-
-        new_image = RAWImage(
+        return self.decompress_image_(image, compressor, with_dict=True, processes=processes)
+
+    @traced
+    def compress_arith(self, image, order=0, predictor=None, stripe_rows=None, processes=1):
+        '''
+        Range coding with an adaptive model, order 1 predicts from the left neighbour, see utils/arithmetic.py
+        '''
+        compressor = ArithmeticCompressor(order, image.maxval)
+        return self.compress_image_(image, compressor, 'arith', params=[order], predictor=predictor,
+                                    stripe_rows=stripe_rows, processes=processes)
+
+    @traced
+    def decompress_arith(self, image, processes=1):
+        compressor = ArithmeticCompressor(image.params[0], image.maxval)
+        return self.decompress_image_(image, compressor, processes=processes)
+
+    @traced
+    def compress_wavelet(self, image, wavelet='cdf97', levels=5, step=8., threshold=.6, psnr=None, bpp=None):
+        '''
+        Lossy wavelet coding, see utils/wavelet_codec.py.
+        psnr: the largest step that keeps at least that many dB, bpp: the smallest step within that many
+        bits per pixel; both override step.
+        '''
+        compressor = WaveletCompressor(wavelet, levels, step, threshold)
+        mtrx = image.to_matrix()
+        coefficients = None
+        if psnr is not None:
+            coefficients = compressor.fit_psnr(mtrx, image.maxval, psnr)
+        elif bpp is not None:
+            coefficients = compressor.fit_bpp(mtrx, image.maxval, bpp)
+
+        return CompressedImage(
             color_mode=image.color_mode,
             height=image.height,
             width=image.width,
-            pixels_raw=pixels_raw
+            channels=compressor.compress(mtrx, image.maxval, coefficients),
+            compressor='wavelet',
+            params=compressor.params,
+            maxval=image.maxval
         )
 
-        return new_image
-
-    def crop_image(self, image, top=0, right=0, bottom=0, left=0):
-        mtrx = image.to_matrix()
-        if image.color_mode == 2:
-            pixels_raw = mtrx[left:mtrx.shape[0] - right, top:mtrx.shape[1] - bottom]
+    @traced
+    def decompress_wavelet(self, image, level=0):
+        '''
+        level > 0: a preview about 2 ** level times smaller, the finest levels are not synthesized
+        '''
+        compressor = WaveletCompressor.from_params(image.params)
+        mtrx = compressor.decompress(image.channels, image.height, image.width, image.maxval, image.color_mode,
+                                     level)
+        return RAWImage.from_matrix(mtrx, image.maxval)
 
-        if image.color_mode == 3:
-            red = mtrx[left:mtrx.shape[0] - right, top:mtrx.shape[1] - bottom, 0].flatten()
-            green = mtrx[left:mtrx.shape[0] - right, top:mtrx.shape[1] - bottom, 1].flatten()
-            blue = mtrx[left:mtrx.shape[0] - right, top:mtrx.shape[1] - bottom, 2].flatten()
-            pixels_raw = np.array(
-                [[red[i], green[i], blue[i]] for i in range(len(red))]).flatten()
+    @traced
+    def convolve(self, image, kernel, processes=1):
+        '''
+        processes > 1 (None - all cores) splits the image into tiles convolved by a process pool
+        '''
+        def compute():
+            processor = Convolution(kernel)
+            if processes == 1:
+                return processor(image.to_matrix())  # all channels at once
+            with TileScheduler(processes) as scheduler:
+                return scheduler.convolve(image.to_matrix(), processor)
 
-        new_image = RAWImage(
-            color_mode=image.color_mode,
-            height=image.height - top - bottom,
-            width=image.width - left - right,
-            pixels_raw=pixels_raw
-        )
+        result = cached(self.cache, 'convolve', compute, (image.planes, ), kernel=kernel)
+        return RAWImage.from_matrix(result, image.maxval, image.binary)
 
-        return new_image
+    @traced
+    def crop_image(self, image, top=0, right=0, bottom=0, left=0):
+        '''
+        Return: RAWImage whose planes are a view of the original ones, nothing is copied
+        '''
+        planes = image.planes[:, top:image.height - bottom, left:image.width - right]
+        return RAWImage.from_planes(planes, image.maxval, image.binary)
 
+    @traced
     def pad_image(self, image, top=0, right=0, bottom=0, left=0):
-        mtrx = image.to_matrix()
+        image.planes = np.pad(image.planes, ((0, 0), (top, bottom), (left, right)), 'constant')
         image.width += left + right
         image.height += top + bottom
-        if image.color_mode == 2:
-            image.pixels_raw = np.pad(mtrx, ((top, bottom), (left, right)), 'constant')
-
-        if image.color_mode == 3:
-            new_mtrx = np.pad(mtrx, ((top, bottom), (left, right), (0, 0)), 'constant')
-            image.pixels_raw = new_mtrx.flatten()
-
         return image
 
-    def apply_haar(self, function, image, axis):
-        right, bottom = 0, 0
-        if image.width % 2:
-            right = 1
-        if image.height % 2:
-            bottom = 1
-
-        if right or bottom:
-            image = self.pad_image(image, right=right, bottom=bottom)
-
-        if image.color_mode == 2:
-            mtrx = image.to_matrix()
-            pixels_raw = np.apply_along_axis(function, axis, mtrx)
-
-        if image.color_mode == 3:
-            mtrx = image.to_matrix()
-            red_channel = mtrx[:, :, 0]
-            green_channel = mtrx[:, :, 1]
-            blue_channel = mtrx[:, :, 2]
-
-            new_red = np.apply_along_axis(function, axis, red_channel).flatten()
-            new_green = np.apply_along_axis(function, axis, green_channel).flatten()
-            new_blue = np.apply_along_axis(function, axis, blue_channel).flatten()
+    @traced
+    def apply_haar(self, function, image, axis, processes=1):
+        '''
+        Args: function(matrix, axis) transforming the whole (height, width[, channels]) matrix,
+              e.g. LiftingWavelet.forward, axis 0 for the columns, 1 for the rows
+              processes > 1 splits the other axis into bands for a process pool
+        Return: RAWImage with the transformed pixels, all channels are processed at once
+        '''
+        if processes == 1:
+            pixels = function(image.to_matrix(), axis)
+        else:
+            with TileScheduler(processes) as scheduler:
+                pixels = scheduler.transform(image.to_matrix(), function, axis)
 
-            pixels_raw = np.array([[new_red[i], new_green[i], new_blue[i]] for i in range(len(new_red))]).flatten()
+        return RAWImage.from_matrix(pixels, image.maxval)
 
-        new_image = RAWImage(
-            color_mode=image.color_mode,
-            height=image.height,
-            width=image.width,
-            pixels_raw=pixels_raw
-        )
+    @traced
+    def haar_encode(self, image, times, wavelet='haar', reversible=False, processes=1):
+        '''
+        Mallat decomposition on times levels, every level transforms only the LL band of the previous one
+        '''
+        def compute():
+            processor = LiftingWavelet(wavelet, reversible)
+            if processes == 1:
+                return processor.decompose(image.to_matrix(), times)
+            with TileScheduler(processes) as scheduler:
+                return scheduler.decompose(image.to_matrix(), processor, times)
+
+        coefficients = cached(self.cache, 'haar_encode', compute, (image.planes, ),
+                              times=times, wavelet=wavelet, reversible=reversible)
+        return RAWImage.from_matrix(coefficients, image.maxval)
+
+    @traced
+    def haar_pyramid(self, image, times, wavelet='haar', reversible=False):
+        '''
+        Return: WaveletPyramid of the image, pyramid.add_level() goes on from its LL band
+        '''
+        return WaveletPyramid.decompose(LiftingWavelet(wavelet, reversible), image.to_matrix(), times)
 
-        return new_image
-
-    def haar_encode(self, image, times):
-        processor = HaarWavelet()
-        vertically = image
-        while times:
-            horizontally = self.apply_haar(processor.encode, vertically, axis=0)
-            vertically = self.apply_haar(processor.encode, horizontally, axis=1)
-            times -= 1
-        return vertically
-
-    def haar_decode(self, image, times):
-        processor = HaarWavelet()
-        horizontally = image
-        while times:
-            vertically = self.apply_haar(processor.decode, horizontally, axis=1)
-            horizontally = self.apply_haar(processor.decode, vertically, axis=0)
-            times -= 1
-        horizontally.pixels_raw = np.abs(horizontally.pixels_raw).round(0).astype('uint8')
-        return horizontally
+    @traced
+    def haar_decode(self, image, times, wavelet='haar', reversible=False, processes=1, level=0):
+        '''
+        level > 0 stops that many levels early: a preview about 2 ** level times smaller
+        from the coarse bands only
+        '''
+        def compute():
+            processor = LiftingWavelet(wavelet, reversible)
+            if level:
+                levels = len(processor.level_shapes(image.to_matrix().shape, times))
+                pixels = WaveletPyramid(processor, image.to_matrix(), levels).preview(min(level, levels))
+            elif processes == 1:
+                pixels = processor.reconstruct(image.to_matrix(), times)
+            else:
+                with TileScheduler(processes) as scheduler:
+                    pixels = scheduler.reconstruct(image.to_matrix(), processor, times)
+            dtype = np.uint8 if image.maxval < 256 else np.uint16
+            return np.clip(np.rint(pixels), 0, image.maxval).astype(dtype)
+
+        pixels = cached(self.cache, 'haar_decode', compute, (image.planes, ),
+                        times=times, wavelet=wavelet, reversible=reversible, maxval=image.maxval, level=level)
+        return RAWImage.from_matrix(pixels, image.maxval)
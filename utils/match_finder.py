@@ -0,0 +1,203 @@
+import numpy as np
+
+
+def match_length(data, candidate, position, limit):
+    """ length of the common prefix of data[candidate:] and data[position:], at most limit """
+
+    length = 0
+    step = 8
+    while length < limit:
+        step = min(step, limit - length)
+        if data[candidate + length:candidate + length + step] == data[position + length:position + length + step]:
+            length += step
+            step *= 2
+        elif step > 1:
+            step //= 2
+        else:
+            break
+    return length
+
+
+class HashChainMatchFinder:
+    """
+    Keeps a chain of previous positions for every hash of a 3-byte prefix.
+    Every position is inserted once, the search follows at most chain_depth links,
+    so the whole parse is linear in the data length.
+    """
+
+    HASH_BITS = 16
+
+    def __init__(self, window_size, max_length, chain_depth=16, min_length=3):
+        self.window_size = window_size
+        self.max_length = max_length
+        self.chain_depth = chain_depth
+        self.min_length = min_length
+
+    def reset(self, data):
+        self.data = data
+        self.head = [-1] * (1 << self.HASH_BITS)
+        self.prev = [-1] * len(data)
+        self.inserted = 0
+
+        array = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+        if len(array) >= 3:
+            keys = (array[:-2] << 16) | (array[1:-1] << 8) | array[2:]
+            hashes = ((keys * np.uint32(2654435761)) >> np.uint32(32 - self.HASH_BITS)).astype(np.int64)
+            self.hashes = hashes.tolist()
+        else:
+            self.hashes = []
+
+    def insert_until(self, position):
+        """ adds all positions before the given one to the chains """
+
+        hashes, head, prev = self.hashes, self.head, self.prev
+        for i in range(self.inserted, min(position, len(hashes))):
+            h = hashes[i]
+            prev[i] = head[h]
+            head[h] = i
+        self.inserted = max(self.inserted, position)
+
+    def find(self, position):
+        """ returns (distance, length) of the longest match for the position or None """
+
+        self.insert_until(position)
+        if position >= len(self.hashes):
+            return None
+
+        data = self.data
+        limit = min(self.max_length, len(data) - position)
+        best_distance, best_length = 0, self.min_length - 1
+
+        candidate = self.head[self.hashes[position]]
+        depth = self.chain_depth
+        while candidate >= 0 and depth and position - candidate <= self.window_size:
+            if data[candidate + best_length:candidate + best_length + 1] == \
+                    data[position + best_length:position + best_length + 1]:
+                length = match_length(data, candidate, position, limit)
+                if length > best_length:
+                    best_distance, best_length = position - candidate, length
+                    if length == limit:
+                        break
+            candidate = self.prev[candidate]
+            depth -= 1
+
+        if best_distance:
+            return best_distance, best_length
+        return None
+
+
+class SuffixArrayMatchFinder:
+    """
+    Finds the longest match among the suffixes adjacent in the suffix array.
+    Slower than hash chains, but misses fewer matches, so the ratio is better.
+    The data is cut into blocks of window_size positions, the array of a block is built over the block
+    and the window before it, so the neighbours of a position are mostly in its window.
+    Neighbours are followed while the common prefix can still give the longest match,
+    at most depth of them inside the window in each direction.
+    """
+
+    def __init__(self, window_size, max_length, depth=64, min_length=3):
+        self.window_size = window_size
+        self.max_length = max_length
+        self.depth = depth
+        self.min_length = min_length
+
+    @staticmethod
+    def suffix_array(data):
+        """ prefix doubling, O(n log^2 n) in NumPy """
+
+        n = len(data)
+        rank = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+        order = np.argsort(rank, kind='stable')
+        k = 1
+        while k < n:
+            second = np.full(n, -1, dtype=np.int64)
+            second[:n - k] = rank[k:]
+            order = np.lexsort((second, rank))
+
+            first_sorted, second_sorted = rank[order], second[order]
+            new_group = np.ones(n, dtype=bool)
+            new_group[1:] = (first_sorted[1:] != first_sorted[:-1]) | (second_sorted[1:] != second_sorted[:-1])
+            rank = np.empty(n, dtype=np.int64)
+            rank[order] = np.cumsum(new_group) - 1
+            if rank.max() == n - 1:
+                break
+            k *= 2
+        return order
+
+    @staticmethod
+    def lcp_array(data, order, rank):
+        """ Kasai algorithm, lcp[r] is the common prefix of suffixes order[r - 1] and order[r] """
+
+        n = len(data)
+        lcp = [0] * n
+        h = 0
+        for position in range(n):
+            r = rank[position]
+            if r == 0:
+                h = 0
+                continue
+            previous = order[r - 1]
+            while position + h < n and previous + h < n and data[position + h] == data[previous + h]:
+                h += 1
+            lcp[r] = h
+            if h:
+                h -= 1
+        return lcp
+
+    def reset(self, data):
+        self.data = data
+        self.block = None
+
+    def build_(self, block):
+        """ suffix and LCP arrays of the block and the window before it """
+
+        start = block * self.window_size
+        self.first = max(0, start - self.window_size)
+        segment = self.data[self.first:start + self.window_size + self.max_length]
+        order = self.suffix_array(segment)
+        rank = np.empty(len(segment), dtype=np.int64)
+        rank[order] = np.arange(len(segment))
+
+        self.order = order.tolist()
+        self.rank = rank.tolist()
+        self.lcp = self.lcp_array(segment, self.order, self.rank)
+        self.block = block
+
+    def find(self, position):
+        block = position // self.window_size
+        if block != self.block:
+            self.build_(block)
+
+        limit = min(self.max_length, len(self.data) - position)
+        best_distance, best_length = 0, self.min_length - 1
+        r = self.rank[position - self.first]
+
+        for direction in (-1, 1):
+            common = limit
+            neighbour = r
+            depth = self.depth
+            while depth:
+                if direction < 0:
+                    if neighbour == 0:
+                        break
+                    common = min(common, self.lcp[neighbour])
+                    neighbour -= 1
+                else:
+                    if neighbour + 1 >= len(self.order):
+                        break
+                    neighbour += 1
+                    common = min(common, self.lcp[neighbour])
+
+                if common < best_length or common < self.min_length:
+                    break  # the farther neighbours share even less
+
+                distance = position - self.first - self.order[neighbour]
+                if 0 < distance <= self.window_size:
+                    depth -= 1
+                    if common > best_length or distance < best_distance:
+                        best_distance, best_length = distance, common
+
+        if best_distance:
+            return best_distance, best_length
+        return None
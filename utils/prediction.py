@@ -0,0 +1,143 @@
+"""
+    Prediction of pixels from their decoded neighbours before entropy coding (PNG filters and LOCO-I):
+    a channel is replaced by residuals (pixel - prediction) modulo maxval + 1, so they have the range
+    of the pixels, and on smooth images they cluster around 0 and maxval.
+
+        c b      a  left, b  up, c  up-left, 0 outside the image
+        a x
+
+    none     0
+    sub      a
+    up       b
+    average  (a + b) // 2
+    paeth    of a, b, c the one closest to a + b - c (PNG)
+    med      median of a, b and a + b - c (LOCO-I / JPEG-LS)
+
+    Every row of a channel has its own predictor. 'adaptive' picks for every row the one with the smallest
+    sum of the residuals taken as signed numbers, as PNG encoders do; the sums are taken over every
+    SCORE_STEP-th pixel of the row, which costs about 0.1% of the size on res/.
+
+    The forward pass is vectorized over the whole channel: all the neighbours are known. The inverse needs the
+    decoded left and upper neighbours. When no row uses both (none, sub and up only), the rows are decoded
+    one after another, each as a whole; otherwise pixels are decoded by anti-diagonals (a wavefront):
+    every pixel of the diagonal r + c = d depends only on the diagonals d - 1 and d - 2.
+    This is the price of average, paeth, med and adaptive: Huffman coding of pythons.ppm with adaptive
+    is about 2x slower both ways than without prediction.
+"""
+
+import numpy as np
+
+
+PREDICTORS = ('none', 'sub', 'up', 'average', 'paeth', 'med')
+ADAPTIVE = 'adaptive'
+SCORE_STEP = 2
+
+
+def predict(kind, a, b, c):
+    ''' prediction of the kind, an index of PREDICTORS, from the left, upper and upper-left neighbours '''
+    return _PREDICT[kind](a, b, c)
+
+
+def _paeth(a, b, c):
+    estimate = a + b - c
+    distance_a, distance_b, distance_c = np.abs(estimate - a), np.abs(estimate - b), np.abs(estimate - c)
+    return np.where((distance_a <= distance_b) & (distance_a <= distance_c), a,
+                    np.where(distance_b <= distance_c, b, c))
+
+
+def _med(a, b, c):
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    return np.where(c >= high, low, np.where(c <= low, high, a + b - c))
+
+
+_PREDICT = (
+    lambda a, b, c: np.zeros_like(a),
+    lambda a, b, c: a,
+    lambda a, b, c: b,
+    lambda a, b, c: (a + b) >> 1,
+    _paeth,
+    _med,
+)
+
+
+def neighbours_(planes):
+    ''' (a, b, c) of every pixel of (channels, height, width) planes '''
+    padded = np.pad(np.asarray(planes, dtype=np.int64), ((0, 0), (1, 0), (1, 0)))
+    return padded[:, 1:, :-1], padded[:, :-1, 1:], padded[:, :-1, :-1]
+
+
+def forward(planes, maxval, predictor=ADAPTIVE):
+    '''
+    Args: (channels, height, width) pixels, predictor: one of PREDICTORS or 'adaptive'
+    Return: (residuals of the same shape and dtype, (channels, height) predictor of every row)
+    '''
+    modulus = maxval + 1
+    pixels = np.asarray(planes, dtype=np.int64)
+    a, b, c = neighbours_(pixels)
+    if predictor != ADAPTIVE:
+        kinds = np.full(pixels.shape[:2], PREDICTORS.index(predictor), dtype=np.int64)
+        residuals = (pixels - predict(PREDICTORS.index(predictor), a, b, c)) % modulus
+        return residuals.astype(np.asarray(planes).dtype), kinds
+
+    sampled = [array[..., ::SCORE_STEP] for array in (pixels, a, b, c)]
+    costs = []
+    for kind in range(len(PREDICTORS)):
+        candidates = (sampled[0] - predict(kind, *sampled[1:])) % modulus
+        costs.append(np.minimum(candidates, modulus - candidates).sum(axis=-1))  # (channels, height)
+    kinds = np.argmin(costs, axis=0)
+
+    residuals = np.empty(pixels.shape, dtype=np.int64)
+    for kind in np.unique(kinds):
+        rows = kinds == kind
+        residuals[rows] = (pixels[rows] - predict(kind, a[rows], b[rows], c[rows])) % modulus
+    return residuals.astype(np.asarray(planes).dtype), kinds
+
+
+def inverse(residuals, kinds, maxval):
+    ''' pixels from forward(): residuals (channels, height, width), kinds (channels, height) '''
+    modulus = maxval + 1
+    residuals = np.asarray(residuals, dtype=np.int64)
+    kinds = np.asarray(kinds, dtype=np.int64)
+    channels, height, width = residuals.shape
+
+    none, sub, up = (PREDICTORS.index(kind) for kind in ('none', 'sub', 'up'))
+    if np.all(kinds == none):
+        return residuals.copy()
+    if np.all(kinds == sub):
+        return np.cumsum(residuals, axis=2) % modulus
+    if np.all(kinds == up):
+        return np.cumsum(residuals, axis=1) % modulus
+    if np.all(kinds <= up):
+        # every row depends either on the row above or on its own left pixels only
+        pixels = np.empty_like(residuals)
+        previous = np.zeros((channels, width), dtype=np.int64)
+        for row in range(height):
+            kind = kinds[:, row, None]
+            current = residuals[:, row]
+            current = np.where(kind == sub, np.cumsum(current, axis=1),
+                               np.where(kind == up, previous + current, current))
+            pixels[:, row] = previous = current % modulus
+        return pixels
+
+    # skewed layout: skewed[d + 2, r + 1] holds the pixel (r, d - r) of every channel, so a diagonal is a slice
+    # and the neighbours are the slices of the previous two; the rows and diagonals outside the image stay 0
+    rows, columns = np.indices((height, width))
+    skewed_residuals = np.zeros((height + width - 1, height, channels), dtype=np.int64)
+    skewed_residuals[rows + columns, rows] = residuals.transpose(1, 2, 0)
+    skewed = np.zeros((height + width + 1, height + 1, channels), dtype=np.int64)
+
+    used = np.unique(kinds)
+    functions = [_PREDICT[kind] for kind in used]
+    choice = np.searchsorted(used, kinds).T  # (height, channels) index into functions
+    for diagonal in range(height + width - 1):
+        first, last = max(0, diagonal - width + 1), min(height, diagonal + 1)
+        a = skewed[diagonal + 1, first + 1:last + 1]
+        b = skewed[diagonal + 1, first:last]
+        c = skewed[diagonal, first:last]
+        if len(functions) == 1:
+            prediction = functions[0](a, b, c)
+        else:
+            prediction = np.choose(choice[first:last], [function(a, b, c) for function in functions])
+        skewed[diagonal + 2, first + 1:last + 1] = (skewed_residuals[diagonal, first:last] + prediction) % modulus
+
+    return skewed[rows + columns + 2, rows + 1].transpose(2, 0, 1)
@@ -0,0 +1,279 @@
+"""
+    Opt-in tracing of the processing stages. Methods of ImageProcessor, AudioProcessorWAVE and the codecs
+    are wrapped by @traced, finer steps (channel splitting, the codec of every channel, interleaving, ...)
+    are marked by `with stage(name):`. Both cost one check while no Tracer is active.
+
+    with Tracer(memory=True) as tracer:
+        ImageProcessor().compress_huffman(image)
+    print(tracer.summary())
+    tracer.write_chrome_trace('trace.json')  # chrome://tracing or https://ui.perfetto.dev
+
+    Every stage records its time, the time of its own (without the nested stages), bytes in and out
+    and, with memory=True, the peak of the memory allocated inside it and what is left allocated (tracemalloc).
+    Stages of other processes (process pools) are not seen.
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+_tracer = None  # the active Tracer
+
+
+class Stage:
+    __slots__ = ('name', 'start', 'duration', 'children', 'depth', 'bytes_in', 'bytes_out',
+                 'memory_start', 'peak', 'allocated', 'retained')
+
+    def __init__(self, name, bytes_in=None):
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.children = 0.  # time of the nested stages
+        self.allocated = self.retained = None
+
+
+class _NullStage:
+    ''' what stage() gives while nothing is traced, the attributes set on it are dropped '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def payload_size(value):
+    ''' bytes of the data in an array, an image, an audio or a buffer, None when unknown '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    for attribute in ('planes', 'data'):  # RAWImage, WAVAudio
+        inner = getattr(value, attribute, None)
+        if isinstance(inner, np.ndarray):
+            return inner.nbytes
+    if isinstance(value, (list, tuple)):
+        sizes = [payload_size(item) for item in value]
+        if any(size is not None for size in sizes):
+            return sum(size or 0 for size in sizes)
+    return None
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return None
+
+
+class Tracer:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []  # finished stages
+        self.stack = []
+        self.origin = self.finish = time.perf_counter()
+        self.previous = None
+        self.started_tracemalloc = False
+
+    def __enter__(self):
+        global _tracer
+        self.previous, _tracer = _tracer, self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.origin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        global _tracer
+        self.finish = time.perf_counter()
+        _tracer = self.previous
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        return False
+
+    @contextmanager
+    def stage(self, name, bytes_in=None):
+        current = Stage(name, bytes_in)
+        self.enter_(current)
+        try:
+            yield current
+        finally:
+            self.exit_(current)
+
+    def enter_(self, current):
+        current.depth = len(self.stack)
+        if self.memory:
+            # the peak is reset for every stage, the enclosing ones take the maximum of their children
+            allocated, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            current.memory_start = current.peak = allocated
+        self.stack.append(current)
+        current.start = time.perf_counter()
+
+    def exit_(self, current):
+        current.duration = time.perf_counter() - current.start
+        self.stack.pop()
+        if self.memory:
+            allocated, peak = tracemalloc.get_traced_memory()
+            current.peak = max(current.peak, peak)
+            current.allocated = current.peak - current.memory_start
+            current.retained = allocated - current.memory_start
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, current.peak)
+        if self.stack:
+            self.stack[-1].children += current.duration
+        self.events.append(current)
+
+    def summary(self):
+        ''' the table of the stages by their total time '''
+        totals = {}
+        for event in self.events:
+            calls, total, own, bytes_in, bytes_out, allocated = totals.get(event.name, (0, 0., 0., 0, 0, None))
+            if event.allocated is not None:
+                allocated = max(allocated or 0, event.allocated)
+            totals[event.name] = (calls + 1, total + event.duration, own + event.duration - event.children,
+                                  bytes_in + (event.bytes_in or 0), bytes_out + (event.bytes_out or 0), allocated)
+
+        wall = max((self.finish if self.finish > self.origin else time.perf_counter()) - self.origin, 1e-9)
+        lines = ['{:<36} {:>7} {:>10} {:>10} {:>6} {:>9} {:>9} {:>8} {:>10}'.format(
+            'stage', 'calls', 'total, ms', 'self, ms', '%', 'in, MB', 'out, MB', 'MB/s', 'alloc, MB')]
+        for name, (calls, total, own, bytes_in, bytes_out, allocated) in sorted(
+                totals.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<36} {:>7} {:>10.2f} {:>10.2f} {:>6.1f} {:>9.3f} {:>9.3f} {:>8} {:>10}'.format(
+                name[:36], calls, total * 1e3, own * 1e3, own / wall * 100, bytes_in / 1e6, bytes_out / 1e6,
+                '{:.1f}'.format(bytes_in / total / 1e6) if bytes_in and total else '-',
+                '{:.3f}'.format(allocated / 1e6) if allocated is not None else '-'))
+        lines.append('wall time: {:.2f} ms'.format(wall * 1e3))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        ''' the Trace Event Format: complete ("X") events in microseconds '''
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        for event in sorted(self.events, key=lambda event: event.start):
+            args = {key: getattr(event, key) for key in ('bytes_in', 'bytes_out', 'allocated', 'retained')
+                    if getattr(event, key) is not None}
+            events.append({'name': event.name, 'ph': 'X', 'pid': pid, 'tid': tid, 'args': args,
+                           'ts': (event.start - self.origin) * 1e6, 'dur': event.duration * 1e6})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def stage(name, bytes_in=None):
+    ''' a stage of the active tracer, does nothing without one; set .bytes_out inside if known '''
+    if _tracer is None:
+        return _NULL_STAGE
+    return _tracer.stage(name, bytes_in)
+
+
+def traced(function=None, files=()):
+    '''
+    Decorator of a method reported as the stage "Class.method".
+    Bytes in are the sizes of the array, image and audio arguments, bytes out the size of the result.
+    files: the role, 'in' or 'out', of every str argument in order - the size of the file is counted then.
+    Generator methods are traced on every step, so the time of the consumer is not counted.
+    '''
+    if function is None:
+        return functools.partial(traced, files=files)
+
+    name = function.__qualname__
+
+    def sizes(args, result=None, done=False):
+        total = None
+        names = [arg for arg in args if isinstance(arg, str)]
+        for role, filename in zip(files, names):
+            if (role == 'out') == done:
+                size = _file_size(filename)
+                if size is not None:
+                    total = (total or 0) + size
+        if not done:
+            for arg in args:
+                size = payload_size(arg)
+                if size is not None:
+                    total = (total or 0) + size
+        elif result is not None:
+            size = payload_size(result)
+            if size is not None:
+                total = (total or 0) + size
+        return total
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator(*args, **kwargs):
+            steps = function(*args, **kwargs)
+            while True:
+                if _tracer is None:  # checked on every step, the generator may outlive the Tracer
+                    try:
+                        item = next(steps)
+                    except StopIteration:
+                        return
+                else:
+                    with _tracer.stage(name) as current:
+                        try:
+                            item = next(steps)
+                        except StopIteration:
+                            return
+                        current.bytes_out = payload_size(item)
+                yield item
+        return generator
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _tracer is None:
+            return function(*args, **kwargs)
+
+        with _tracer.stage(name, sizes(args)) as current:
+            result = function(*args, **kwargs)
+            current.bytes_out = sizes(args, result, done=True)
+        return result
+    return wrapper
+
+
+def add_options(parser):
+    ''' --profile, --profile_memory and --trace of the lab scripts '''
+    parser.add_option('--profile', dest='profile', action='store_true', default=False,
+                      help='напечатать время по этапам обработки')
+    parser.add_option('--profile_memory', dest='profile_memory', action='store_true', default=False,
+                      help='с --profile: учитывать выделения памяти (tracemalloc, работает медленнее)')
+    parser.add_option('--trace', dest='trace', action='store', default='', type='str',
+                      help='записать этапы в JSON-файл формата Chrome trace (chrome://tracing)')
+
+
+@contextmanager
+def profiled(options):
+    ''' traces the block if the options ask for it, then prints the summary and/or writes the trace '''
+    if not (options.profile or options.profile_memory or options.trace):
+        yield None
+        return
+
+    tracer = Tracer(memory=options.profile_memory)
+    try:
+        with tracer:
+            yield tracer
+    finally:
+        if options.profile or options.profile_memory:
+            print(tracer.summary())
+        if options.trace:
+            tracer.write_chrome_trace(options.trace)
+            print('Трассировка записана в {}.'.format(options.trace))
@@ -0,0 +1,176 @@
+"""
+    Tiled multi-process image jobs. Pixels are never pickled: the parent copies the image into
+    multiprocessing.shared_memory once, the workers attach to it by name and write their part
+    of the result into another shared block.
+
+    Convolution: the image is wrap-padded by the kernel halo (the rows above and the columns to the left
+    every output pixel depends on), every tile reads its rows and columns plus the halo
+    and writes its own rows and columns. Rescaling of negative kernels needs the whole result
+    and is done after the tiles are stitched.
+
+    Wavelets: a pass along the columns is independent for every column, a pass along the rows
+    for every row, so each pass is split into bands of the other axis and transformed in place.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+_attached = {}  # shared blocks the worker process is attached to, by name
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+
+
+def _detach(keep=()):
+    for name in list(_attached):
+        if name not in keep:
+            _attached.pop(name).close()
+
+
+def _convolve_tile(task):
+    source, target, convolution, strategy, (top, bottom, left, right) = task
+    _detach((source[0], target[0]))  # blocks of the previous jobs are gone
+    padded, result = _attach(source), _attach(target)
+
+    halo_rows, halo_columns = convolution.halo
+    block = padded[top:bottom + halo_rows, left:right + halo_columns]
+    result[top:bottom, left:right] = convolution.convolve_padded(block, strategy)
+
+
+def _transform_band(task):
+    target, function, axis, (top, bottom, left, right) = task
+    _detach((target[0], ))
+    data = _attach(target)
+    data[top:bottom, left:right] = function(data[top:bottom, left:right], axis)
+
+
+class SharedArray:
+    """ numpy array in a shared memory block, the parent owns and unlinks it """
+
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf)
+        self.spec = self.memory.name, tuple(shape), dtype.str
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        del self.array
+        self.memory.close()
+        self.memory.unlink()
+
+
+class TileScheduler:
+    """
+    Splits images into tiles (convolution) or bands (wavelet passes) and runs them on a process pool.
+    processes=1 runs the same tasks in this process without a pool.
+    The pool is started on the first job and kept until close(), use it as a context manager.
+    """
+
+    def __init__(self, processes=None, tile_size=256):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.tile_size = tile_size
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        _detach()
+
+    def run_(self, function, tasks):
+        if self.processes == 1:
+            for task in tasks:
+                function(task)
+            _detach()
+            return
+
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes)
+        # a few tasks per process, large enough to keep the dispatch cheap
+        chunk_size = max(1, len(tasks) // (self.processes * 4))
+        for _ in self.pool.imap_unordered(function, tasks, chunk_size):
+            pass
+
+    def tiles_(self, height, width):
+        size = self.tile_size
+        return [(top, min(top + size, height), left, min(left + size, width))
+                for top in range(0, height, size) for left in range(0, width, size)]
+
+    def bands_(self, height, width, axis):
+        ''' stripes across the transformed axis, at least one per process '''
+        length = width if axis == 0 else height
+        count = max(self.processes, -(-length // self.tile_size))
+        bounds = np.linspace(0, length, min(count, length) + 1).astype(int)
+        if axis == 0:
+            return [(0, height, start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        return [(start, stop, 0, width) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def convolve(self, matrix, convolution):
+        ''' the same result as convolution(matrix), up to the rounding of the fft strategy (per tile here) '''
+        matrix = np.asarray(matrix)
+        strategy = convolution.choose_strategy(matrix)
+        height, width = matrix.shape[:2]
+        halo_rows, halo_columns = convolution.halo
+
+        # wrap padding as in Convolution, so the tiles on the borders read the opposite side
+        padded_shape = (height + halo_rows, width + halo_columns) + matrix.shape[2:]
+        with SharedArray(padded_shape, matrix.dtype) as padded, SharedArray(matrix.shape, np.float64) as result:
+            if halo_rows > height or halo_columns > width:
+                padded.array[...] = convolution._wrap_pad(matrix, halo_rows, halo_columns)  # wraps several times
+            else:
+                padded.array[halo_rows:, halo_columns:] = matrix
+                padded.array[:halo_rows, halo_columns:] = matrix[height - halo_rows:]
+                padded.array[:, :halo_columns] = padded.array[:, width:]
+
+            tasks = [(padded.spec, result.spec, convolution, strategy, tile) for tile in self.tiles_(height, width)]
+            self.run_(_convolve_tile, tasks)
+            return convolution.finish(result.array)
+
+    def transform(self, matrix, function, axis, dtype=np.float64):
+        '''
+        function(matrix, axis) of a transform that keeps the other axis independent, e.g. LiftingWavelet.forward,
+        dtype is the type of its result
+        '''
+        with SharedArray(matrix.shape, dtype) as data:
+            data.array[...] = matrix
+            self.transform_(data, function, axis, matrix.shape[:2])
+            return data.array.copy()
+
+    def transform_(self, data, function, axis, shape):
+        tasks = [(data.spec, function, axis, band) for band in self.bands_(shape[0], shape[1], axis)]
+        self.run_(_transform_band, tasks)
+
+    def decompose(self, matrix, wavelet, levels=1):
+        ''' LiftingWavelet.decompose with both passes of every level split into bands '''
+        with SharedArray(matrix.shape, wavelet.dtype) as data:
+            data.array[...] = matrix
+            for shape in wavelet.level_shapes(matrix.shape, levels):
+                self.transform_(data, wavelet.forward, 0, shape)
+                self.transform_(data, wavelet.forward, 1, shape)
+            return data.array.copy()
+
+    def reconstruct(self, matrix, wavelet, levels=1):
+        with SharedArray(matrix.shape, wavelet.dtype) as data:
+            data.array[...] = matrix
+            for shape in reversed(wavelet.level_shapes(matrix.shape, levels)):
+                self.transform_(data, wavelet.inverse, 1, shape)
+                self.transform_(data, wavelet.inverse, 0, shape)
+            return data.array.copy()
@@ -1,33 +1,221 @@
 import numpy as np
 
 
-class HaarWavelet:
-    def __init__(self):
-        self.matrix = np.array([
-            [0.5**0.5, 0.5**0.5],
-            [-0.5**0.5, 0.5**0.5]])
-
-    def encode_pair(self, x, y):
-        return np.around(np.dot(self.matrix, np.array([x, y])), 1).tolist()
-
-    def decode_pair(self, x, y):
-        x, y = float(x), float(y)
-        return np.around(np.dot(self.matrix.transpose(), np.array([x, y])), 1).tolist()  #np.dot((self.matrix.transpose()), np.array([x, y])).round(0).astype('uint8').tolist()
-
-    def apply_to_raw(self, function, raw):
-        result = []
-        for i in range(0, len(raw)-1, 2):
-            result += function(raw[i], raw[i+1])
+def _shifted(array, shift, count):
+    """ array[n + shift] for n < count, indices past the borders are clamped (symmetric extension) """
+
+    return np.take(array, np.clip(np.arange(count) + shift, 0, len(array) - 1), axis=0)
+
+
+class LiftingWavelet:
+    """
+    1D wavelet transforms as lifting steps over whole arrays: the even and odd samples along an axis
+    are split by slicing and updated from each other, the result is [low | high] along that axis.
+    Odd lengths are supported, the low half gets the extra sample. The signal is extended symmetrically.
+
+    haar   orthonormal Haar, (x + y) / sqrt 2 and (y - x) / sqrt 2
+    cdf53  LeGall 5/3 of JPEG 2000
+    cdf97  CDF 9/7 of JPEG 2000
+
+    With reversible=True haar (the S-transform) and cdf53 map integers to integers and back exactly.
+    """
+
+    KINDS = ('haar', 'cdf53', 'cdf97')
+    CDF97 = (-1.586134342, -0.05298011854, 0.8829110762, 0.4435068522)
+    CDF97_SCALE = 1.149604398
+
+    def __init__(self, kind='haar', reversible=False):
+        if kind not in self.KINDS:
+            raise ValueError('unknown wavelet: {}'.format(kind))
+        if reversible and kind == 'cdf97':
+            raise ValueError('cdf97 has no integer-reversible form, use cdf53 or haar')
+        self.kind = kind
+        self.reversible = reversible
+
+    @property
+    def dtype(self):
+        return np.int64 if self.reversible else np.float64
+
+    def forward(self, array, axis=0):
+        """ one level along the axis """
+
+        x = np.moveaxis(np.asarray(array), axis, 0)
+        if x.shape[0] < 2:
+            return np.moveaxis(x.astype(self.dtype), 0, axis)
+
+        even, odd = x[0::2].astype(self.dtype), x[1::2].astype(self.dtype)
+        if self.kind == 'haar':
+            # an odd sample without a pair stays in the low band
+            paired = even[:len(odd)]
+            odd -= paired
+            if self.reversible:
+                paired += odd >> 1
+            else:
+                paired += odd / 2
+                even *= 2 ** .5
+                odd /= 2 ** .5
+        elif self.kind == 'cdf53':
+            if self.reversible:
+                odd -= (even[:len(odd)] + _shifted(even, 1, len(odd))) >> 1
+                even += (_shifted(odd, -1, len(even)) + _shifted(odd, 0, len(even)) + 2) >> 2
+            else:
+                odd -= (even[:len(odd)] + _shifted(even, 1, len(odd))) / 2
+                even += (_shifted(odd, -1, len(even)) + _shifted(odd, 0, len(even))) / 4
+        else:
+            for step, coefficient in enumerate(self.CDF97):
+                if step % 2 == 0:
+                    odd += coefficient * (even[:len(odd)] + _shifted(even, 1, len(odd)))
+                else:
+                    even += coefficient * (_shifted(odd, -1, len(even))
+                                           + _shifted(odd, 0, len(even)))
+            even *= self.CDF97_SCALE
+            odd /= self.CDF97_SCALE
+
+        return np.moveaxis(np.concatenate([even, odd]), 0, axis)
+
+    def inverse(self, array, axis=0):
+        """ one level along the axis, [low | high] back to the signal """
+
+        x = np.moveaxis(np.asarray(array), axis, 0)
+        if x.shape[0] < 2:
+            return np.moveaxis(x.astype(self.dtype), 0, axis)
+
+        middle = (x.shape[0] + 1) // 2
+        even, odd = x[:middle].astype(self.dtype), x[middle:].astype(self.dtype)
+        if self.kind == 'haar':
+            paired = even[:len(odd)]
+            if self.reversible:
+                paired -= odd >> 1
+            else:
+                even /= 2 ** .5
+                odd *= 2 ** .5
+                paired -= odd / 2
+            odd += paired
+        elif self.kind == 'cdf53':
+            if self.reversible:
+                even -= (_shifted(odd, -1, len(even)) + _shifted(odd, 0, len(even)) + 2) >> 2
+                odd += (even[:len(odd)] + _shifted(even, 1, len(odd))) >> 1
+            else:
+                even -= (_shifted(odd, -1, len(even)) + _shifted(odd, 0, len(even))) / 4
+                odd += (even[:len(odd)] + _shifted(even, 1, len(odd))) / 2
+        else:
+            even /= self.CDF97_SCALE
+            odd *= self.CDF97_SCALE
+            for step in reversed(range(len(self.CDF97))):
+                coefficient = self.CDF97[step]
+                if step % 2 == 0:
+                    odd -= coefficient * (even[:len(odd)] + _shifted(even, 1, len(odd)))
+                else:
+                    even -= coefficient * (_shifted(odd, -1, len(even))
+                                           + _shifted(odd, 0, len(even)))
+
+        result = np.empty(x.shape, dtype=self.dtype)
+        result[0::2], result[1::2] = even, odd
+        return np.moveaxis(result, 0, axis)
+
+    @property
+    def dc_gain(self):
+        """ what one level does to a constant signal in the low band: sqrt 2 for haar, 1 for the integer forms """
+
+        return float(self.forward(np.ones(8, dtype=self.dtype))[0])
+
+    @staticmethod
+    def level_shapes(shape, levels):
+        """ (height, width) of the LL band transformed on every level """
+
+        height, width = shape[:2]
+        shapes = []
+        for _ in range(levels):
+            if height < 2 and width < 2:
+                break
+            shapes.append((height, width))
+            height, width = (height + 1) // 2, (width + 1) // 2
+        return shapes
+
+    def decompose(self, array, levels=1):
+        """
+        Mallat decomposition of a (height, width) or (height, width, channels) array:
+        every level transforms the columns and the rows of the previous LL band only
+        """
+
+        result = np.array(array, dtype=self.dtype)
+        for height, width in self.level_shapes(result.shape, levels):
+            result[:height, :width] = self.forward(self.forward(result[:height, :width], 0), 1)
+        return result
+
+    def reconstruct(self, array, levels=1):
+        result = np.array(array, dtype=self.dtype)
+        for height, width in reversed(self.level_shapes(result.shape, levels)):
+            result[:height, :width] = self.inverse(self.inverse(result[:height, :width], 1), 0)
         return result
 
-    def encode(self, raw):
-        result = self.apply_to_raw(self.encode_pair, raw)
-        return [result[i] for i in range(0, len(result), 2)] + [result[i] for i in range(1, len(result), 2)]
-
-    def decode(self, raw):
-        reshaped_raw = []
-        middle = len(raw) // 2
-        for i in range(middle):
-            reshaped_raw.append(raw[i])
-            reshaped_raw.append(raw[middle + i])
-        return self.apply_to_raw(self.decode_pair, reshaped_raw)
+
+class WaveletPyramid:
+    """
+    Mallat decomposition kept level by level, coefficients are the usual matrix: the LL band of the last level
+    in the top left corner, the details of every level around it.
+    add_level() transforms only the current LL band. preview(level) undoes the levels down to the given one
+    and returns its LL band scaled to the range of the pixels: the image reduced about 2 ** level times,
+    the work is that of the small bands only.
+    """
+
+    def __init__(self, wavelet, coefficients, levels=0):
+        """ coefficients: pixels with levels=0 or a decomposition of that many levels, copied """
+
+        self.wavelet = wavelet
+        self.coefficients = np.array(coefficients, dtype=wavelet.dtype)
+        self.levels = levels
+
+    @classmethod
+    def decompose(cls, wavelet, array, levels=1):
+        pyramid = cls(wavelet, array)
+        while pyramid.levels < levels and pyramid.add_level():
+            pass
+        return pyramid
+
+    def band_shape(self, level):
+        """ (height, width) of the LL band after level levels """
+
+        height, width = self.coefficients.shape[:2]
+        for _ in range(level):
+            height, width = (height + 1) // 2, (width + 1) // 2
+        return height, width
+
+    @property
+    def ll(self):
+        height, width = self.band_shape(self.levels)
+        return self.coefficients[:height, :width]
+
+    def details(self, level):
+        """ views of the (LH, HL, HH) bands of the level, 1 is the finest: low or high rows, then columns """
+
+        height, width = self.band_shape(level - 1)
+        low_height, low_width = self.band_shape(level)
+        bands = self.coefficients
+        return (bands[:low_height, low_width:width], bands[low_height:height, :low_width],
+                bands[low_height:height, low_width:width])
+
+    def add_level(self):
+        """ one more level from the current LL band, False when it is a single pixel already """
+
+        height, width = self.band_shape(self.levels)
+        if height < 2 and width < 2:
+            return False
+        band = self.coefficients[:height, :width]
+        band[...] = self.wavelet.forward(self.wavelet.forward(band, 0), 1)
+        self.levels += 1
+        return True
+
+    def preview(self, level=0):
+        """ the image at the level: 0 is the full reconstruction, self.levels is the scaled LL band """
+
+        if not 0 <= level <= self.levels:
+            raise ValueError('level must be from 0 to {}'.format(self.levels))
+        height, width = self.band_shape(level)
+        result = self.coefficients[:height, :width].copy()
+        for current in range(self.levels, level, -1):
+            height, width = self.band_shape(current - 1)
+            result[:height, :width] = self.wavelet.inverse(self.wavelet.inverse(result[:height, :width], 1), 0)
+
+        gain = self.wavelet.dc_gain ** (2 * level)  # both axes on every level
+        return result if gain == 1 else result / gain
@@ -0,0 +1,233 @@
+"""
+    Lossy wavelet image codec:
+        level shift and, for color images, the YCbCr transform of JPEG 2000
+        Mallat decomposition (utils/wavelet.py)
+        dead-zone quantization, the step of every subband is scaled by the norm of its synthesis functions,
+        so a unit of quantization error costs the same in every band
+        coefficients in subband order from the coarsest level, zigzag mapped to non-negative integers
+        runs of equal values (RLE), run values and run lengths Huffman coded
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from . import container
+from .compression import HuffmanCompressor, RLECompressor
+from .profiling import traced
+from .wavelet import LiftingWavelet, WaveletPyramid
+
+
+YCBCR = np.array([[0.299, 0.587, 0.114],
+                  [-0.168736, -0.331264, 0.5],
+                  [0.5, -0.418688, -0.081312]])
+
+
+@lru_cache(maxsize=32)
+def _synthesis_norms(kind, levels):
+    """ L2 norms of 1D synthesis functions: (low band after every level, high band of every level) """
+
+    size = 16 << levels
+    wavelet = LiftingWavelet(kind)
+    lows, highs = [], []
+    for level in range(1, levels + 1):
+        for norms, position in ((lows, (size >> level) // 2), (highs, (size >> level) + (size >> level) // 2)):
+            signal = np.zeros(size)
+            signal[position] = 1.
+            for current in range(level, 0, -1):
+                length = size >> (current - 1)
+                signal[:length] = wavelet.inverse(signal[:length])
+            norms.append(np.sqrt(np.sum(signal ** 2)))
+    return lows, highs
+
+
+class WaveletCompressor:
+    WAVELETS = LiftingWavelet.KINDS
+    FIXED_POINT = 256  # step and threshold are stored in the container in 1/256 units
+
+    def __init__(self, wavelet='cdf97', levels=5, step=8., threshold=.6, color_transform=True):
+        '''
+        step: quantization step of a unit-norm subband, larger is smaller and worse
+        threshold: coefficients below threshold * step become zero, .5 is plain rounding
+        '''
+        self.wavelet = LiftingWavelet(wavelet)
+        self.levels = levels
+        self.step = self.fixed_point_(step)
+        self.threshold = self.fixed_point_(threshold)
+        self.color_transform = color_transform
+        self.layouts = {}
+
+    @classmethod
+    def fixed_point_(cls, value):
+        ''' the value as the decoder sees it in the container '''
+        return max(1, int(round(value * cls.FIXED_POINT))) / cls.FIXED_POINT
+
+    @property
+    def params(self):
+        return [self.WAVELETS.index(self.wavelet.kind), self.levels, int(round(self.step * self.FIXED_POINT)),
+                int(round(self.threshold * self.FIXED_POINT)), int(self.color_transform)]
+
+    @classmethod
+    def from_params(cls, params):
+        wavelet, levels, step, threshold, color_transform = params[:5]
+        return cls(cls.WAVELETS[wavelet], levels, step / cls.FIXED_POINT, threshold / cls.FIXED_POINT,
+                   bool(color_transform))
+
+    def bands_(self, shape):
+        '''
+        Return: (weight, key) arrays of the (height, width) shape:
+                the norm of the synthesis function of every coefficient and the order of its subband,
+                coarsest first
+        '''
+        shapes = self.wavelet.level_shapes(shape, self.levels)
+        lows, highs = _synthesis_norms(self.wavelet.kind, max(len(shapes), 1))
+
+        weight = np.ones(shape[:2])
+        key = np.zeros(shape[:2], dtype=np.int64)
+        for level, (height, width) in enumerate(shapes, 1):
+            low_height, low_width = (height + 1) // 2, (width + 1) // 2
+            rows = np.where(np.arange(height) < low_height, lows[level - 1], highs[level - 1])
+            columns = np.where(np.arange(width) < low_width, lows[level - 1], highs[level - 1])
+            weight[:height, :width] = np.outer(rows, columns)
+
+            orientation = (np.arange(height) >= low_height)[:, None] * 2 + (np.arange(width) >= low_width)
+            key[:height, :width] = (len(shapes) - level) * 4 + orientation
+        if shapes:
+            key[:(shapes[-1][0] + 1) // 2, :(shapes[-1][1] + 1) // 2] = -1  # the final LL band
+        return weight, key
+
+    def layout_(self, shape):
+        ''' (weights, scan order) of a channel shape, computed once per shape '''
+        shape = tuple(shape[:2])
+        if shape not in self.layouts:
+            weight, key = self.bands_(shape)
+            self.layouts[shape] = weight, np.argsort(key.ravel(), kind='stable')
+        return self.layouts[shape]
+
+    @traced
+    def analyze(self, matrix, maxval):
+        ''' pixels (height, width[, 3]) to wavelet coefficients (height, width, channels) '''
+        pixels = np.asarray(matrix, dtype=np.float64)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, None]
+        pixels = pixels - (maxval + 1) / 2
+        if pixels.shape[2] == 3 and self.color_transform:
+            pixels = pixels @ YCBCR.T
+        return self.wavelet.decompose(pixels, self.levels)
+
+    @traced
+    def synthesize(self, coefficients, maxval, color_mode, level=0):
+        ''' level > 0 stops the reconstruction that many levels early, the image is about 2 ** level times smaller '''
+        levels = len(self.wavelet.level_shapes(coefficients.shape, self.levels))
+        pixels = WaveletPyramid(self.wavelet, coefficients, levels).preview(min(level, levels))
+        if pixels.shape[2] == 3 and self.color_transform:
+            pixels = pixels @ np.linalg.inv(YCBCR).T
+        pixels = np.clip(np.rint(pixels + (maxval + 1) / 2), 0, maxval)
+        pixels = pixels.astype(np.uint8 if maxval < 256 else np.uint16)
+        return pixels if color_mode == 3 else pixels[:, :, 0]
+
+    @traced
+    def quantize(self, coefficients):
+        steps = self.step / self.layout_(coefficients.shape)[0][:, :, None]
+        magnitude = np.floor(np.abs(coefficients) / steps + 1 - self.threshold)
+        return (np.sign(coefficients) * np.maximum(magnitude, 0)).astype(np.int64)
+
+    @traced
+    def dequantize(self, quantized):
+        ''' the middle of every quantization interval '''
+        steps = self.step / self.layout_(quantized.shape)[0][:, :, None]
+        magnitude = np.where(quantized != 0, np.abs(quantized) + self.threshold - .5, 0)
+        return np.sign(quantized) * magnitude * steps
+
+    @traced
+    def encode_channel_(self, quantized):
+        '''
+        (height, width) quantized band matrix to ((payload, mapping, index) of run values, the same of run lengths),
+        the index (symbols, block size, block bit offsets) lets the decoder run the blocks in parallel
+        '''
+        order = self.layout_(quantized.shape)[1]
+        scan = quantized.ravel()[order]
+        values, lengths, _ = RLECompressor.runs((scan << 1) ^ (scan >> 63))  # zigzag: 0, -1, 1, -2, ...
+        result = []
+        for runs in (values, lengths):
+            compressor = HuffmanCompressor()
+            payload, mapping = compressor.compress(runs)
+            result.append((payload, mapping, (len(runs), compressor.block_size, compressor.offsets)))
+        return tuple(result)
+
+    @traced
+    def decode_channel_(self, channel, shape):
+        decoded = []
+        for payload, mapping, index in channel:
+            compressor = HuffmanCompressor()
+            compressor.reverse_mapping = mapping
+            if index is None:
+                decoded.append(compressor.decompress(payload))
+            else:
+                count, block_size, offsets = index
+                decoded.append(compressor.decompress(payload, count, offsets, block_size))
+        values, lengths = decoded
+
+        scan = np.repeat(values, lengths)
+        scan = (scan >> 1) ^ -(scan & 1)
+        quantized = np.empty(shape[0] * shape[1], dtype=np.int64)
+        quantized[self.layout_(shape)[1]] = scan
+        return quantized.reshape(shape)
+
+    def compress(self, matrix, maxval, coefficients=None):
+        if coefficients is None:
+            coefficients = self.analyze(matrix, maxval)
+        quantized = self.quantize(coefficients)
+        return [self.encode_channel_(quantized[:, :, c]) for c in range(quantized.shape[2])]
+
+    def decompress(self, channels, height, width, maxval, color_mode, level=0):
+        quantized = np.stack([self.decode_channel_(channel, (height, width)) for channel in channels], axis=-1)
+        return self.synthesize(self.dequantize(quantized), maxval, color_mode, level)
+
+    @staticmethod
+    def psnr(original, restored, maxval):
+        error = np.mean((np.asarray(original, dtype=np.float64) - restored) ** 2)
+        return float('inf') if error == 0 else 10 * np.log10(maxval ** 2 / error)
+
+    @staticmethod
+    def channels_size(channels):
+        return sum(len(container.write_wavelet_section(*channel, indexed=True)) for channel in channels)
+
+    def search_(self, coefficients, good, increasing, low=1. / 16, high=4096., iterations=16):
+        '''
+        Bisection over the step in the log domain, good(coefficients) is monotonic in the step:
+        increasing - true for large steps (a size limit), the smallest good step is kept,
+        otherwise true for small steps (a quality limit), the largest good step is kept
+        '''
+        for _ in range(iterations):
+            self.step = self.fixed_point_((low * high) ** .5)
+            if good(coefficients) == increasing:
+                high = self.step
+            else:
+                low = self.step
+        self.step = self.fixed_point_(high if increasing else low)
+
+    def fit_psnr(self, matrix, maxval, target):
+        ''' the largest step that keeps the PSNR at least target dB, returns the coefficients '''
+        matrix = np.asarray(matrix)
+        color_mode = 3 if matrix.ndim == 3 else 2
+
+        def good(coefficients):
+            restored = self.synthesize(self.dequantize(self.quantize(coefficients)), maxval, color_mode)
+            return self.psnr(matrix, restored, maxval) >= target
+
+        coefficients = self.analyze(matrix, maxval)
+        self.search_(coefficients, good, increasing=False)
+        return coefficients
+
+    def fit_bpp(self, matrix, maxval, target):
+        ''' the smallest step that fits into target bits per pixel, returns the coefficients '''
+        matrix = np.asarray(matrix)
+        pixels = matrix.shape[0] * matrix.shape[1]
+
+        def good(coefficients):
+            return self.channels_size(self.compress(None, maxval, coefficients)) * 8 / pixels <= target
+
+        coefficients = self.analyze(matrix, maxval)
+        self.search_(coefficients, good, increasing=True)
+        return coefficients
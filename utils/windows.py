@@ -0,0 +1,77 @@
+"""
+    Window functions over sample indices. Coefficients are computed once per (type, length, parameters)
+    and kept in an LRU cache as read-only float32 arrays.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+
+WINDOW_TYPES = ('hann', 'hamming', 'blackman', 'kaiser', 'tukey', 'rectangular')
+
+
+def _cosine_sum(x, coefficients):
+    """ a0 - a1 cos(2 pi x) + a2 cos(4 pi x) - ..., x is the position in the window in [0, 1] """
+
+    result = np.zeros(len(x))
+    for k, a in enumerate(coefficients):
+        result += (-1) ** k * a * np.cos(2. * np.pi * k * x)
+    return result
+
+
+def _kaiser(x, beta):
+    return np.i0(beta * np.sqrt(np.clip(1. - (2. * x - 1.) ** 2, 0., None))) / np.i0(beta)
+
+
+def _tukey(x, alpha):
+    """ flat top with cosine tapers over alpha / 2 of the window on each side """
+
+    if alpha <= 0:
+        return np.ones(len(x))
+    edge = np.minimum(x, 1. - x)
+    return np.where(edge < alpha / 2, .5 * (1. - np.cos(2. * np.pi * edge / alpha)), 1.)
+
+
+@lru_cache(maxsize=64)
+def get_window(window_type, size, periodic=True, beta=8.6, alpha=.5):
+    """
+    periodic windows have period size (for STFT frames: shifted copies overlap-add to a constant),
+    symmetric ones (periodic=False) are for windowing a whole signal
+    """
+
+    if window_type not in WINDOW_TYPES:
+        raise ValueError('unknown window type: {}'.format(window_type))
+    if size <= 0:
+        raise ValueError('window size must be positive')
+
+    x = np.arange(size) / (size if periodic else max(size - 1, 1))
+    if window_type == 'hann':
+        window = _cosine_sum(x, (.5, .5))
+    elif window_type == 'hamming':
+        window = _cosine_sum(x, (.54, .46))
+    elif window_type == 'blackman':
+        window = _cosine_sum(x, (.42, .5, .08))
+    elif window_type == 'kaiser':
+        window = _kaiser(x, beta)
+    elif window_type == 'tukey':
+        window = _tukey(x, alpha)
+    else:
+        window = np.ones(size)
+
+    window = window.astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def apply_window(frames, window_type='hann', axis=-1, periodic=True, **params):
+    """ multiplies the frames by the window along the axis in place, frames must be a float array """
+
+    if not np.issubdtype(frames.dtype, np.floating):
+        raise TypeError('window is applied in place, float frames are expected, got {}'.format(frames.dtype))
+
+    window = get_window(window_type, frames.shape[axis], periodic, **params)
+    shape = [1] * frames.ndim
+    shape[axis] = len(window)
+    frames *= window.reshape(shape)
+    return frames